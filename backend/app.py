@@ -1,12 +1,18 @@
 # This line imports the create_app function from the app module.
 from app import create_app
 
-# This line calls the create_app function to create the Flask application instance.
-app = create_app()
-
 # This if statement checks if this script is being run directly (i.e. not being imported as a module).
+# The app is only created in here: preview workers are spawned processes, which
+# re-import this file as __mp_main__ and must not start a second copy of the
+# app (Firebase, background workers, another preview pool).
 if __name__ == '__main__':
+    from routes.change_routes import socketio
+
+    # This line calls the create_app function to create the Flask application instance.
+    app = create_app()
+
     # If this script is being run directly, this line runs the Flask application in debug mode, listening on port 5000.
-    app.run(debug=True, port=5000)
+    # It goes through Socket.IO so the change feed's WebSocket connections are served too.
+    socketio.run(app, debug=True, port=5000)
 
-# Yes, this is the entry point of the backend. The create_app function is called to create the Flask application instance, and then the application is run in debug mode, listening on port 5000.
\ No newline at end of file
+# Yes, this is the entry point of the backend for development. For a WSGI server, use wsgi:app.
@@ -9,14 +9,22 @@ def create_app():
     # Create a new Flask application
     app = Flask(__name__)
     
+    # Serialize JSON responses with orjson (DynamoDB Decimals become numbers)
+    # and compress the larger ones for clients that accept it
+    from services.response_encoding import FastJSONProvider, compress_response
+    app.json = FastJSONProvider(app)
+    app.after_request(compress_response)
+    
+    origins = ["http://localhost:5173", "http://127.0.0.1:5173"]
+    
     # Enable CORS with more permissive settings for development
     CORS(app, 
          resources={
              r"/api/*": {
-                 "origins": ["http://localhost:5173", "http://127.0.0.1:5173"],
+                 "origins": origins,
                  "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH"],
-                 "allow_headers": ["Content-Type", "Authorization"],
-                 "expose_headers": ["Content-Disposition"],
+                 "allow_headers": ["Content-Type", "Authorization", "Content-MD5", "If-None-Match"],
+                 "expose_headers": ["Content-Disposition", "X-Next-Token", "ETag"],
                  "supports_credentials": True,
                  "max_age": 600  # Cache preflight response for 10 minutes
              }
@@ -28,23 +36,92 @@ def create_app():
     # that can be uploaded to the server
     app.config.update(
         SECRET_KEY=os.getenv('FLASK_SECRET_KEY', 'dev-key-123'),
-        MAX_CONTENT_LENGTH=100 * 1024 * 1024  # 100MB max file size
+        MAX_CONTENT_LENGTH=100 * 1024 * 1024,  # 100MB max file size
+        COMPRESSION_MIN_SIZE=int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
     )
     
     # Initialize the Firebase Admin SDK
     # This is used for authentication and authorization
-    from auth.firebase import init_firebase
+    from auth.firebase import init_firebase, init_key_store
     init_firebase()
     
+    # Prefetch Google's token signing keys so ID tokens can be
+    # verified locally without a network call per request
+    init_key_store()
+    
     # Register our routes
-    # We have two blueprints: one for authentication
-    # and one for file management
+    # We have blueprints for authentication, file management,
+    # resumable (chunked) uploads, delta sync of new file versions, search,
+    # folders and the change feed
     from routes.auth_routes import auth_bp
-    from routes.file_routes import file_bp
+    from routes.file_routes import (
+        file_bp, multipart_uploader, preview_pipeline, s3_client, dynamodb, table, content_store, usage_store,
+        folder_store, change_feed, forget_cached_file
+    )
+    from routes.upload_routes import upload_bp
+    from routes.sync_routes import sync_bp
+    from routes.search_routes import search_bp
+    from routes.folder_routes import folder_bp
+    from routes.change_routes import change_bp, socketio
     
     # Register the blueprints with the app
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
     app.register_blueprint(file_bp, url_prefix='/api/files')
+    app.register_blueprint(upload_bp, url_prefix='/api/uploads')
+    app.register_blueprint(sync_bp, url_prefix='/api/files')
+    app.register_blueprint(search_bp, url_prefix='/api/files')
+    app.register_blueprint(folder_bp, url_prefix='/api/folders')
+    app.register_blueprint(change_bp, url_prefix='/api/changes')
+    
+    # Push change events to connected clients over Socket.IO, and start
+    # receiving the events other workers publish (with a shared broker)
+    socketio.init_app(app, cors_allowed_origins=origins)
+    change_feed.start()
+    
+    # Periodically abort multipart uploads that never completed
+    # (e.g. the worker died mid-upload) so their parts aren't billed forever
+    if os.getenv('S3_BUCKET_NAME'):
+        multipart_uploader.start_sweeper(
+            os.getenv('S3_BUCKET_NAME'),
+            interval=int(os.getenv('S3_MULTIPART_SWEEP_INTERVAL', '3600')),
+            max_age=int(os.getenv('S3_MULTIPART_MAX_AGE', str(24 * 3600)))
+        )
+    
+    # Optionally check in the background that every file's S3 object still
+    # exists, instead of doing a HEAD request on every download
+    reconcile_interval = int(os.getenv('STORAGE_RECONCILE_INTERVAL', '0'))
+    if reconcile_interval > 0 and os.getenv('S3_BUCKET_NAME'):
+        from services.storage_reconciler import start_reconciler
+        start_reconciler(
+            table,
+            s3_client,
+            os.getenv('S3_BUCKET_NAME'),
+            reconcile_interval,
+            on_missing=forget_cached_file,
+            usage_store=usage_store,
+            folder_store=folder_store
+        )
+    
+    # Render image previews in worker processes after uploads
+    if int(os.getenv('PREVIEW_WORKERS', '2')) > 0 and os.getenv('S3_BUCKET_NAME'):
+        preview_pipeline.start(os.getenv('S3_BUCKET_NAME'))
+    
+    # Permanently delete files that have sat in the trash for longer than
+    # TRASH_RETENTION. Set PURGE_INTERVAL=0 to run the purge as a separate
+    # process instead (python -m services.purge_worker)
+    purge_interval = int(os.getenv('PURGE_INTERVAL', '300'))
+    if purge_interval > 0 and os.getenv('S3_BUCKET_NAME'):
+        from services.purge_worker import start_purge_worker
+        start_purge_worker(
+            table,
+            dynamodb,
+            s3_client,
+            os.getenv('S3_BUCKET_NAME'),
+            interval=purge_interval,
+            retention=int(os.getenv('TRASH_RETENTION', str(24 * 3600))),
+            content_store=content_store,
+            usage_store=usage_store
+        )
     
     # Return the app
     return app
\ No newline at end of file
@@ -4,6 +4,8 @@ import firebase_admin
 from functools import wraps
 from flask import request, jsonify
 from firebase_admin import credentials, auth
+from auth.token_cache import TokenCache
+from auth.key_store import GoogleKeyStore
 
 # Authorization: Bearer <token>
 # Authorization:: The standard HTTP header name for sending credentials.
@@ -12,6 +14,23 @@ from firebase_admin import credentials, auth
 # Key Use: The server (token_required) decrypts and validates this token to confirm the user's identity securely.
 
 
+# Verifying a token (signature check + key lookup) is the most expensive part
+# of every protected request, so we remember tokens we've already verified
+# until they expire.
+token_cache = TokenCache(
+    max_size=int(os.getenv('TOKEN_CACHE_SIZE', '1024')),
+    max_ttl=int(os.getenv('TOKEN_CACHE_TTL', '3600'))
+)
+
+# Users allowed to read operational stats (cache counters, dedup totals, ...).
+# Either list their uids here or give them an `admin: true` custom claim.
+ADMIN_UIDS = {uid.strip() for uid in os.getenv('ADMIN_UIDS', '').split(',') if uid.strip()}
+
+# Local copy of Google's signing keys, so we can verify tokens without a
+# network round trip. Set up by init_key_store().
+key_store = None
+
+
 def init_firebase():
     """Initialize Firebase Admin SDK"""
     if not firebase_admin._apps:
@@ -42,6 +61,40 @@ def init_firebase():
             print(f"FIREBASE_CREDENTIALS value: {firebase_creds[:100]}..." if firebase_creds else "No FIREBASE_CREDENTIALS set")
             raise
 
+def init_key_store():
+    """Load Google's token signing keys and keep them refreshed in the background"""
+    global key_store
+
+    if os.getenv('FIREBASE_LOCAL_VERIFICATION', 'true').lower() != 'true':
+        return None
+
+    project_id = os.getenv('FIREBASE_PROJECT_ID')
+    if not project_id and firebase_admin._apps:
+        project_id = firebase_admin.get_app().project_id
+    if not project_id:
+        print("FIREBASE_PROJECT_ID not set, falling back to Firebase Admin SDK token verification")
+        return None
+
+    # GOOGLE_CERTS_FILE points at a local {kid: PEM} JSON file (fixture mode)
+    key_store = GoogleKeyStore(
+        project_id,
+        certs_file=os.getenv('GOOGLE_CERTS_FILE'),
+        grace_period=int(os.getenv('SIGNING_KEYS_GRACE_PERIOD', str(6 * 3600)))
+    )
+    key_store.start()
+    return key_store
+
+def verify_token(token):
+    """Verify a Firebase ID token, using the token cache when possible"""
+    decoded_token = token_cache.get(token)
+    if decoded_token is None:
+        if key_store is not None and key_store.ready:
+            decoded_token = key_store.verify(token)
+        else:
+            decoded_token = auth.verify_id_token(token)
+        token_cache.put(token, decoded_token)
+    return decoded_token
+
 def token_required(f):
     """Decorator to verify Firebase ID token"""
     @wraps(f)
@@ -58,13 +111,30 @@ def token_required(f):
         token = auth_header.split(' ')[1]
         
         try:
-            # Verify the ID token
-            decoded_token = auth.verify_id_token(token)
-            # Store the decoded token in the request object for later use
+            # Verify the ID token (served from the cache on repeat requests)
+            decoded_token = verify_token(token)
+            # Store the decoded token in the request object so handlers
+            # never have to verify it again
             request.decoded_token = decoded_token
             return f(*args, **kwargs)
             
         except Exception as e:
             return jsonify({'error': 'Invalid token', 'details': str(e)}), 401
             
-    return decorated_function
\ No newline at end of file
+    return decorated_function
+
+def admin_required(f):
+    """Decorator that only lets admins through (use after @token_required)"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method == 'OPTIONS':
+            return f(*args, **kwargs)
+
+        decoded_token = getattr(request, 'decoded_token', None)
+        if not decoded_token:
+            return jsonify({'error': 'Missing or invalid Authorization header'}), 401
+        if decoded_token.get('admin') is not True and decoded_token.get('uid') not in ADMIN_UIDS:
+            return jsonify({'error': 'Admin access required'}), 403
+        return f(*args, **kwargs)
+
+    return decorated_function
@@ -0,0 +1,185 @@
+import re
+import json
+import time
+import logging
+import threading
+import requests
+import jwt
+from cryptography import x509
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
+
+logger = logging.getLogger(__name__)
+
+# Shared by the Flask API (backend/auth/key_store.py) and the Lambda API
+# (lambda_deploy/key_store.py). The two files are identical copies, since
+# Lambda packaging doesn't follow symlinks reliably; change them together.
+# The Flask API refreshes the keys from a background thread (start); the
+# Lambda, which is frozen between invocations, calls refresh_if_expired.
+
+# Google publishes the certificates used to sign Firebase ID tokens here.
+# The response carries a Cache-Control max-age telling us how long they are valid.
+GOOGLE_CERTS_URL = 'https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com'
+
+MAX_AGE_PATTERN = re.compile(r'max-age=(\d+)')
+
+
+class KeyStoreError(Exception):
+    """Raised when no usable signing keys are available"""
+
+
+def parse_max_age(cache_control, default):
+    """Pull max-age (in seconds) out of a Cache-Control header"""
+    match = MAX_AGE_PATTERN.search(cache_control or '')
+    return int(match.group(1)) if match else default
+
+
+def load_public_key(pem):
+    """Load a public key from a PEM certificate or a bare PEM public key"""
+    data = pem.encode('utf-8') if isinstance(pem, str) else pem
+    if b'BEGIN CERTIFICATE' in data:
+        return x509.load_pem_x509_certificate(data).public_key()
+    return load_pem_public_key(data)
+
+
+class GoogleKeyStore:
+    """Keeps Google's token signing keys in memory and verifies ID tokens locally.
+
+    Keys are loaded once at startup and refreshed in a background thread shortly
+    before the Cache-Control max-age runs out, so requests never wait on the
+    certificate endpoint. If a refresh fails we keep serving the last good keys
+    for `grace_period` seconds past their expiry.
+
+    Setting `certs_file` switches to fixture mode: keys are read from a local
+    JSON file ({kid: PEM}) instead of Google, which lets us verify tokens signed
+    with self-signed keys when working offline.
+    """
+
+    def __init__(self, project_id, certs_url=GOOGLE_CERTS_URL, certs_file=None,
+                 grace_period=6 * 3600, default_max_age=3600, retry_interval=30,
+                 request_timeout=5, clock_skew=0):
+        self.project_id = project_id
+        self.issuer = f'https://securetoken.google.com/{project_id}'
+        self.certs_url = certs_url
+        self.certs_file = certs_file
+        self.grace_period = grace_period
+        self.default_max_age = default_max_age
+        self.retry_interval = retry_interval
+        self.request_timeout = request_timeout
+        self.clock_skew = clock_skew
+
+        self._keys = {}
+        self._expires_at = 0
+        self._retry_at = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def ready(self):
+        """True if we currently hold keys that are still usable"""
+        with self._lock:
+            return bool(self._keys) and time.time() < self._expires_at + self.grace_period
+
+    def _fetch(self):
+        """Fetch the current certificates, returning ({kid: public_key}, max_age)"""
+        if self.certs_file:
+            with open(self.certs_file, 'r') as f:
+                certs = json.load(f)
+            max_age = self.default_max_age
+        else:
+            response = requests.get(self.certs_url, timeout=self.request_timeout)
+            response.raise_for_status()
+            certs = response.json()
+            max_age = parse_max_age(response.headers.get('Cache-Control'), self.default_max_age)
+
+        keys = {kid: load_public_key(pem) for kid, pem in certs.items()}
+        if not keys:
+            raise KeyStoreError('Certificate response contained no keys')
+        return keys, max_age
+
+    def refresh(self):
+        """Reload the keys. Returns True on success; on failure the old keys are kept."""
+        try:
+            keys, max_age = self._fetch()
+        except Exception as e:
+            logger.warning(f"Failed to refresh token signing keys: {str(e)}")
+            return False
+
+        with self._lock:
+            self._keys = keys
+            self._expires_at = time.time() + max_age
+        logger.info(f"Loaded {len(keys)} token signing keys, valid for {max_age}s")
+        return True
+
+    def refresh_if_expired(self):
+        """Refresh the keys on the caller's thread if they have expired.
+
+        For callers without the background thread. While refreshes are
+        failing this tries at most once per retry_interval, and the old keys
+        stay usable for the grace period.
+        """
+        now = time.time()
+        with self._lock:
+            if now < self._expires_at or now < self._retry_at:
+                return
+            self._retry_at = now + self.retry_interval
+        self.refresh()
+
+    def _next_refresh_delay(self):
+        with self._lock:
+            remaining = self._expires_at - time.time()
+        # Refresh a little before the keys expire so we never run on stale ones
+        return max(self.retry_interval, remaining * 0.9)
+
+    def _run(self):
+        while not self._stop.wait(self._next_refresh_delay()):
+            if not self.refresh():
+                # Retry sooner than the normal schedule while the fetch is failing
+                self._stop.wait(self.retry_interval)
+
+    def start(self):
+        """Load the keys and start the background refresh thread"""
+        if not self.refresh():
+            logger.warning("Starting without token signing keys; will keep retrying in the background")
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='google-key-store', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def get_key(self, kid):
+        with self._lock:
+            if time.time() >= self._expires_at + self.grace_period:
+                raise KeyStoreError('Token signing keys are stale')
+            key = self._keys.get(kid)
+        if key is None:
+            raise KeyStoreError(f'Unknown signing key id: {kid}')
+        return key
+
+    def verify(self, token):
+        """Verify an RS256 Firebase ID token in-process and return its claims"""
+        header = jwt.get_unverified_header(token)
+        if header.get('alg') != 'RS256':
+            raise jwt.InvalidTokenError('ID token must be signed with RS256')
+
+        key = self.get_key(header.get('kid'))
+        decoded_token = jwt.decode(
+            token,
+            key=key,
+            algorithms=['RS256'],
+            audience=self.project_id,
+            issuer=self.issuer,
+            leeway=self.clock_skew,
+            options={'require': ['exp', 'iat', 'aud', 'iss', 'sub']}
+        )
+
+        subject = decoded_token['sub']
+        if not isinstance(subject, str) or not subject or len(subject) > 128:
+            raise jwt.InvalidTokenError('ID token has an invalid subject')
+        if decoded_token.get('auth_time', 0) > time.time() + self.clock_skew:
+            raise jwt.InvalidTokenError('ID token has an auth_time in the future')
+
+        # Match the shape returned by firebase_admin.auth.verify_id_token
+        decoded_token['uid'] = subject
+        return decoded_token
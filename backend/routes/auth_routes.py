@@ -1,6 +1,5 @@
 from flask import Blueprint, jsonify, request
-from firebase_admin import auth
-from auth.firebase import token_required
+from auth.firebase import token_required, admin_required, verify_token, token_cache
 
 # Create a Blueprint, which is a way to group related views and other code
 # together to make it easy to register them with an application.
@@ -22,7 +21,7 @@ def login():
     
     # Try to verify the ID token. If it's invalid, return an error response.
     try:
-        decoded_token = auth.verify_id_token(id_token)
+        decoded_token = verify_token(id_token)
         
         # If the token is valid, return the user info.
         return jsonify({
@@ -46,4 +45,12 @@ def protected_route():
     """Example protected route"""
     
     # If the token is valid, return a JSON response with a message.
-    return jsonify({'message': 'This is a protected route'})
\ No newline at end of file
+    return jsonify({'message': 'This is a protected route'})
+
+# Report how well the verified-token cache is doing (hits, misses, evictions).
+@auth_bp.route('/token-cache/stats')
+@token_required
+@admin_required
+def token_cache_stats():
+    """Return verified-token cache counters"""
+    return jsonify(token_cache.stats())
\ No newline at end of file
@@ -0,0 +1,87 @@
+from flask import Blueprint, request, jsonify, current_app
+from flask_socketio import SocketIO, join_room, emit
+from auth.firebase import token_required, admin_required, verify_token
+from routes.file_routes import change_feed
+
+# Real-time change feed. Clients connect to the /changes Socket.IO
+# namespace with their Firebase ID token and get a 'change' event for every
+# upload, delete, restore, move and new version, instead of polling the
+# listing. See services/change_feed.py for the event format.
+#
+# Connect with auth {"token": <ID token>, "epoch": ..., "since": <last seq>}
+# to resume: the missed events are replayed first. If they can't be, the
+# server sends 'resync' and the client should refetch its listing. Either
+# way it then sends 'ready' with the current epoch and seq.
+change_bp = Blueprint('changes', __name__)
+
+CHANGES_NAMESPACE = '/changes'
+
+# Initialized with the app in create_app
+socketio = SocketIO()
+
+def replay(user_id, since, epoch):
+    """The events after `since` plus the current position, or (None, ...) if the client must refetch.
+
+    Without `since` the client is starting from a fresh listing, so there is
+    nothing to replay.
+    """
+    events = []
+    if since is not None:
+        try:
+            events = change_feed.since(user_id, int(since), epoch)
+        except (TypeError, ValueError):
+            events = None
+    return events, {'epoch': change_feed.epoch, 'seq': change_feed.current_seq(user_id)}
+
+@socketio.on('connect', namespace=CHANGES_NAMESPACE)
+def connect_changes(auth=None):
+    auth = auth or {}
+    try:
+        user_id = verify_token(auth.get('token') or '')['uid']
+    except Exception as e:
+        current_app.logger.info(f"Refused change feed connection: {str(e)}")
+        return False
+
+    # Join before replaying so nothing published in between is lost; the
+    # client drops events with a seq it has already applied
+    join_room(user_id)
+    events, position = replay(user_id, auth.get('since'), auth.get('epoch'))
+    if events is None:
+        emit('resync', position)
+    else:
+        for event in events:
+            emit('change', event)
+    emit('ready', position)
+
+def deliver_change(user_id, event):
+    """Broker listener: push an event to this worker's connections for the user"""
+    socketio.emit('change', event, to=user_id, namespace=CHANGES_NAMESPACE)
+
+change_feed.add_listener(deliver_change)
+
+@change_bp.route('', methods=['GET'])
+@token_required
+def get_changes():
+    """
+    Catch up without a socket: the events after ?since=<seq>&epoch=<epoch>
+
+    Returns {events, epoch, seq, resync}; with resync true the events
+    couldn't be replayed and the client should refetch its listing.
+    """
+    try:
+        user_id = request.decoded_token['uid']
+        events, position = replay(user_id, request.args.get('since'), request.args.get('epoch'))
+        return jsonify({'events': events or [], 'resync': events is None, **position})
+
+    except Exception as e:
+        current_app.logger.error(f"Error reading changes: {str(e)}")
+        return jsonify({'error': 'Failed to read changes'}), 500
+
+@change_bp.route('/stats', methods=['GET'])
+@token_required
+@admin_required
+def change_feed_stats():
+    """
+    Return how many change events this process has published
+    """
+    return jsonify(change_feed.stats())
@@ -1,12 +1,29 @@
 import os
+import json
 import uuid
+import time
+import hashlib
+from decimal import Decimal
 from datetime import datetime
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
 from werkzeug.utils import secure_filename
-from firebase_admin import auth
+from itsdangerous import URLSafeSerializer, BadSignature
 import boto3
 from botocore.exceptions import ClientError
-from auth.firebase import token_required
+from auth.firebase import token_required, admin_required
+from services.multipart_upload import MultipartUploader
+from services.listing_cache import create_listing_cache
+from services.presigned_url_cache import PresignedUrlCache
+from services.dynamo_batch import batch_get_items, cancellation_codes, transact_write
+from services.purge_worker import remove_files
+from services.zip_stream import stream_zip, unique_names
+from services.content_store import ContentStore, content_key
+from services.upload_inspector import UploadInspector
+from services.preview_pipeline import PreviewPipeline, preview_key
+from services.search_index import SearchIndexManager
+from services.folders import FolderStore, ROOT, normalize_path, folder_attributes, placement_condition
+from services.usage import UsageStore, QuotaExceeded
+from services.change_feed import create_change_feed
 
 # Create a Blueprint for file-related routes
 file_bp = Blueprint('files', __name__)
@@ -16,6 +33,83 @@ s3_client = boto3.client('s3')
 dynamodb = boto3.resource('dynamodb')
 table = dynamodb.Table('UserFiles')
 
+# Multipart upload engine shared by all requests. Part size and concurrency
+# are tunable so we can adjust them from the throughput it logs.
+multipart_uploader = MultipartUploader(
+    s3_client,
+    part_size=int(os.getenv('S3_MULTIPART_PART_SIZE_MB', '8')) * 1024 * 1024,
+    max_concurrency=int(os.getenv('S3_MULTIPART_CONCURRENCY', '4')),
+    max_workers=int(os.getenv('S3_UPLOAD_THREADS', '16'))
+)
+
+# Per-user cache of listing pages. Anything that adds or removes a file
+# must call listing_cache.invalidate(user_id), and bump the user's listing
+# version unless it committed a usage update (listing_changed does both).
+# Set LISTING_CACHE_URL to a redis:// URL so multiple workers share one
+# coherent cache.
+listing_cache = create_listing_cache(
+    url=os.getenv('LISTING_CACHE_URL'),
+    ttl=int(os.getenv('LISTING_CACHE_TTL', '300'))
+)
+
+# Listings are read from GSIs, which can lag a write by a moment. A page
+# read within LISTING_SETTLE_TIME seconds of the user's last write is
+# neither cached nor given an ETag, so it can't stick around without
+# that write.
+LISTING_SETTLE_TIME = float(os.getenv('LISTING_SETTLE_TIME', '2'))
+
+# Change events for connected clients (see routes/change_routes.py). Set
+# CHANGE_FEED_URL to a redis:// URL to deliver them from any worker.
+change_feed = create_change_feed(
+    url=os.getenv('CHANGE_FEED_URL'),
+    history=int(os.getenv('CHANGE_FEED_HISTORY', '500'))
+)
+
+# Optional content-addressed storage: identical uploads share one S3 blob,
+# reference counted in the CONTENT_BLOBS_TABLE table
+content_store = None
+if os.getenv('CONTENT_DEDUP', 'false').lower() == 'true':
+    content_store = ContentStore(s3_client, dynamodb, os.getenv('CONTENT_BLOBS_TABLE', 'ContentBlobs'))
+
+# Presigned download URLs are reused until DOWNLOAD_URL_REUSE_FRACTION of
+# their lifetime has passed. delete_file must invalidate the entry.
+DOWNLOAD_URL_EXPIRY = int(os.getenv('DOWNLOAD_URL_EXPIRY', '3600'))
+DOWNLOAD_URL_REUSE_FRACTION = float(os.getenv('DOWNLOAD_URL_REUSE_FRACTION', '0.5'))
+download_url_cache = PresignedUrlCache(reuse_fraction=DOWNLOAD_URL_REUSE_FRACTION)
+MAX_BATCH_FILE_IDS = int(os.getenv('MAX_BATCH_FILE_IDS', '100'))
+
+# Image previews are rendered in the background after upload (started by
+# create_app when PREVIEW_WORKERS > 0) and served through their own URL cache
+PREVIEW_SIZES = tuple(int(size) for size in os.getenv('PREVIEW_SIZES', '128,512').split(','))
+preview_url_cache = PresignedUrlCache(reuse_fraction=DOWNLOAD_URL_REUSE_FRACTION)
+preview_pipeline = PreviewPipeline(
+    s3_client,
+    table,
+    sizes=PREVIEW_SIZES,
+    max_workers=int(os.getenv('PREVIEW_WORKERS', '2')),
+    queue_size=int(os.getenv('PREVIEW_QUEUE_SIZE', '100')),
+    on_ready=lambda user_id, file_id: listing_changed(user_id)
+)
+MAX_BULK_DELETE_FILE_IDS = int(os.getenv('MAX_BULK_DELETE_FILE_IDS', '5000'))
+
+# Folder rows (with their recursive size/count totals) live in FOLDERS_TABLE;
+# file rows point at their folder through folderPath/parentKey
+folder_store = FolderStore(dynamodb, os.getenv('FOLDERS_TABLE', 'UserFolders'), table)
+
+# Per-user storage usage, kept in USAGE_TABLE and updated in the same
+# transaction as every file row it counts. STORAGE_QUOTA_GB=0 disables quotas.
+usage_store = UsageStore(
+    dynamodb,
+    os.getenv('USAGE_TABLE', 'UserUsage'),
+    default_quota=int(float(os.getenv('STORAGE_QUOTA_GB', '15')) * 1024 * 1024 * 1024)
+)
+
+# ZIP downloads read objects in ARCHIVE_CHUNK_SIZE pieces and buffer at most
+# ARCHIVE_PREFETCH_CHUNKS of them, which caps memory per archive download
+MAX_ARCHIVE_FILES = int(os.getenv('MAX_ARCHIVE_FILES', '10000'))
+ARCHIVE_CHUNK_SIZE = int(os.getenv('ARCHIVE_CHUNK_SIZE_KB', '1024')) * 1024
+ARCHIVE_PREFETCH_CHUNKS = int(os.getenv('ARCHIVE_PREFETCH_CHUNKS', '8'))
+
 def get_s3_bucket_name():
     """Get the S3 bucket name from environment variables"""
     bucket_name = os.getenv('S3_BUCKET_NAME')
@@ -23,12 +117,128 @@ def get_s3_bucket_name():
         raise ValueError("S3_BUCKET_NAME environment variable not set")
     return bucket_name
 
+def load_search_documents(user_id):
+    """Read every available file of a user, for building their search index"""
+    query_args = {
+        'KeyConditionExpression': 'userId = :userId',
+        'ProjectionExpression': 'fileId, filename, #size, contentType, uploadedAt, #status',
+        'ExpressionAttributeNames': {'#size': 'size', '#status': 'status'},
+        'ExpressionAttributeValues': {':userId': user_id}
+    }
+    while True:
+        response = table.query(**query_args)
+        for item in response.get('Items', []):
+            if item.get('status', 'available') == 'available':
+                yield item
+        if 'LastEvaluatedKey' not in response:
+            break
+        query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+# Per-user filename search indexes, built on a user's first search and then
+# kept current by the upload and delete handlers
+search_index = SearchIndexManager(
+    load_search_documents,
+    max_users=int(os.getenv('SEARCH_INDEX_MAX_USERS', '1000')),
+    max_age=int(os.getenv('SEARCH_INDEX_MAX_AGE', '300'))
+)
+
+def listing_changed(user_id):
+    """Call after a write that changes a user's listings, unless it went through a usage update"""
+    listing_cache.invalidate(user_id)
+    usage_store.bump_listing_version(user_id)
+
+def forget_cached_file(user_id, file_id):
+    """Drop a file from the listing, download URL and preview URL caches and the search index"""
+    search_index.remove(user_id, file_id)
+    listing_changed(user_id)
+    download_url_cache.invalidate(user_id, file_id)
+    for size in PREVIEW_SIZES:
+        preview_url_cache.invalidate(user_id, f"{file_id}/{size}")
+
+def listing_row(item):
+    """A file row as listings (and change events) return it"""
+    return {
+        'fileId': item['fileId'],
+        'filename': item['filename'],
+        'size': item.get('size', 0),
+        'contentType': item.get('contentType', ''),
+        'uploadedAt': item['uploadedAt'],
+        'lastModified': item.get('lastModified', item['uploadedAt']),
+        'previews': [int(size) for size in item.get('previews', [])],
+        'folder': item.get('folderPath', ROOT)
+    }
+
+def resolve_folder(user_id, folder):
+    """Normalize a requested folder path; raises ValueError if it's invalid or doesn't exist"""
+    path = normalize_path(folder or ROOT)
+    if not folder_store.exists(user_id, path):
+        raise ValueError(f"Folder {path} does not exist")
+    return path
+
+def make_etag(*parts):
+    """Strong ETag over everything that determines a response body"""
+    return hashlib.sha256(json.dumps(parts, default=str).encode('utf-8')).hexdigest()[:32]
+
+def url_window():
+    """Number of the current URL reuse window. Bodies that embed presigned
+    URLs include it in their ETag, so a client never keeps a URL past its expiry."""
+    return int(time.time() // max(1, DOWNLOAD_URL_EXPIRY * DOWNLOAD_URL_REUSE_FRACTION))
+
+def with_etag(response, etag):
+    response.set_etag(etag)
+    # Let browsers keep the body but revalidate it on every use
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def listing_settled(user_id, version, age):
+    """Whether a listing page read from an index after seeing `version` (changed `age` seconds ago)
+    is safe to cache and tag with it: old enough, and no write came in while it was read"""
+    return age >= LISTING_SETTLE_TIME and usage_store.listing_version(user_id) == version
+
+def not_modified(etag):
+    """A 304 response if the client already has this ETag, otherwise None"""
+    if request.if_none_match.contains_weak(etag):
+        return with_etag(current_app.response_class(status=304), etag)
+    return None
+
+def folder_changed_response():
+    """For a write whose folder was moved or deleted while it was in progress"""
+    return jsonify({'error': 'Folder was moved or deleted, try again'}), 409
+
+def quota_exceeded_response(error):
+    return jsonify({'error': str(error)}), 507
+
+def generate_download_url(bucket_name, s3_key, filename):
+    """Sign a GET URL that downloads the object as an attachment"""
+    return s3_client.generate_presigned_url(
+        'get_object',
+        Params={
+            'Bucket': bucket_name,
+            'Key': s3_key,
+            'ResponseContentDisposition': f'attachment; filename="{filename}"'
+        },
+        ExpiresIn=DOWNLOAD_URL_EXPIRY
+    )
+
+# How long presigned upload URLs stay valid, and how long an upload
+# that was never completed keeps its reserved metadata row (DynamoDB TTL)
+PRESIGNED_UPLOAD_EXPIRY = int(os.getenv('PRESIGNED_UPLOAD_EXPIRY', '900'))
+PENDING_UPLOAD_TTL = int(os.getenv('PENDING_UPLOAD_TTL', str(24 * 60 * 60)))
+
 @file_bp.route('/upload', methods=['POST'])
 @token_required
 def upload_file():
     """
     Handle file upload
     """
+    # Check the quota before reading the body. The request's length includes
+    # the form encoding, so this errs on the side of refusing; the commit
+    # below checks the exact size again.
+    try:
+        quota = usage_store.check(request.decoded_token['uid'], request.content_length or 0)
+    except QuotaExceeded as e:
+        return quota_exceeded_response(e)
+    
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
         
@@ -40,6 +250,11 @@ def upload_file():
         # Get user ID from the Firebase token (already verified by @token_required)
         user_id = request.decoded_token['uid']
         
+        try:
+            folder = resolve_folder(user_id, request.form.get('folder'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
         # Generate a unique file ID and secure the filename
         file_id = str(uuid.uuid4())
         filename = secure_filename(file.filename)
@@ -50,47 +265,89 @@ def upload_file():
         # Get the S3 bucket name
         bucket_name = get_s3_bucket_name()
         
-        # Upload file to S3
-        s3_client.upload_fileobj(
-            file,
-            bucket_name,
-            s3_key,
-            ExtraArgs={
-                'ContentType': file.content_type or 'application/octet-stream',
-                'ACL': 'private'
-            }
-        )
+        # Count, hash and sniff the bytes as they stream through, rather
+        # than trusting the request's Content-Length and content type
+        inspector = UploadInspector(file.stream)
+        content_type = inspector.content_type(file.content_type)
         
-        # Generate a pre-signed URL for the file
-        file_url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={
-                'Bucket': bucket_name,
-                'Key': s3_key
-            },
-            ExpiresIn=3600  # URL expires in 1 hour
-        )
+        # Upload file to S3 (in parallel parts for large files)
+        def upload(stream, bucket, key):
+            multipart_uploader.upload(
+                stream,
+                bucket,
+                key,
+                extra_args={
+                    'ContentType': content_type,
+                    'ACL': 'private'
+                }
+            )
         
-        # Store file metadata in DynamoDB
-        current_time = datetime.utcnow().isoformat()
-        table.put_item(Item={
+        if content_store:
+            # Hash the upload first (werkzeug spools it, so it can be re-read)
+            # and only write it to S3 if these bytes aren't stored already
+            inspector.drain()
+            file.stream.seek(0)
+            blob = content_store.store(
+                file.stream, bucket_name, upload, content_hash=content_key(user_id, inspector.sha256), size=inspector.size
+            )
+            s3_key = blob['s3Key']
+        else:
+            upload(inspector, bucket_name, s3_key)
+        
+        item = {
             'userId': user_id,
             'fileId': file_id,
             'filename': filename,
             's3Key': s3_key,
-            'size': request.content_length or 0,
-            'contentType': file.content_type or 'application/octet-stream',
-            'uploadedAt': current_time,
-            'lastModified': current_time
-        })
+            'size': inspector.size,
+            'sha256': inspector.sha256,
+            'contentType': content_type,
+            'version': 1,
+            **folder_attributes(user_id, folder)
+        }
+        if content_store:
+            item['contentHash'] = blob['contentHash']
+        
+        # Generate a pre-signed URL for the file
+        file_url = generate_download_url(bucket_name, s3_key, filename)
+        
+        # Store file metadata in DynamoDB, together with the folder totals
+        # and the user's usage so they can never disagree
+        current_time = datetime.utcnow().isoformat()
+        item.update(uploadedAt=current_time, lastModified=current_time)
+        actions = (
+            [{'Put': {'TableName': table.name, 'Item': item, 'ConditionExpression': 'attribute_not_exists(fileId)'}}] +
+            folder_store.aggregate_updates(user_id, folder, 1, item['size']) +
+            [usage_store.update(user_id, 1, item['size'], quota)]
+        )
+        try:
+            usage_store.commit(actions)
+        except (QuotaExceeded, ClientError) as e:
+            # The transaction didn't happen, so nothing refers to the stored
+            # bytes (or our reference to the blob)
+            if content_store:
+                content_store.release(bucket_name, blob['contentHash'])
+            else:
+                s3_client.delete_object(Bucket=bucket_name, Key=s3_key)
+            if isinstance(e, QuotaExceeded):
+                return quota_exceeded_response(e)
+            if folder_store.rejected(e, actions):
+                return folder_changed_response()
+            raise
+        listing_cache.invalidate(user_id)
+        search_index.add(user_id, item)
+        change_feed.added(user_id, [listing_row(item)])
+        preview_pipeline.submit(user_id, file_id, s3_key, content_type)
         
         return jsonify({
             'message': 'File uploaded successfully',
             'fileId': file_id,
             'filename': filename,
+            'folder': folder,
             'url': file_url,
-            'size': request.content_length or 0,
-            'contentType': file.content_type or 'application/octet-stream'
+            'size': item['size'],
+            'sha256': item['sha256'],
+            'contentType': content_type
         })
         
     except Exception as e:
@@ -100,45 +357,543 @@ def upload_file():
             'details': str(e)
         }), 500
 
+@file_bp.route('/presigned-url', methods=['POST'])
+@token_required
+def create_presigned_upload():
+    """
+    Phase one of a direct-to-S3 upload: reserve a metadata row and return
+    a presigned POST (or PUT) that the browser uploads the bytes to
+    """
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get('fileName') or '')
+    content_type = data.get('fileType') or 'application/octet-stream'
+    method = (data.get('method') or 'POST').upper()
+
+    if not filename:
+        return jsonify({'error': 'fileName is required'}), 400
+    if method not in ('POST', 'PUT'):
+        return jsonify({'error': 'method must be POST or PUT'}), 400
+
+    try:
+        file_size = int(data.get('fileSize', 0))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'fileSize must be an integer'}), 400
+
+    max_size = current_app.config['MAX_CONTENT_LENGTH']
+    if file_size <= 0 or file_size > max_size:
+        return jsonify({'error': f'fileSize must be between 1 and {max_size} bytes'}), 400
+
+    try:
+        user_id = request.decoded_token['uid']
+        try:
+            folder = resolve_folder(user_id, data.get('folder'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        try:
+            usage_store.check(user_id, file_size)
+        except QuotaExceeded as e:
+            return quota_exceeded_response(e)
+        file_id = str(uuid.uuid4())
+        s3_key = f"{user_id}/{file_id}/{filename}"
+        bucket_name = get_s3_bucket_name()
+
+        if method == 'POST':
+            # The POST policy makes S3 reject anything bigger than the size
+            # we reserved or with a different content type
+            presigned = s3_client.generate_presigned_post(
+                Bucket=bucket_name,
+                Key=s3_key,
+                Fields={'Content-Type': content_type},
+                Conditions=[
+                    {'Content-Type': content_type},
+                    ['content-length-range', 1, file_size]
+                ],
+                ExpiresIn=PRESIGNED_UPLOAD_EXPIRY
+            )
+            upload = {'url': presigned['url'], 'fields': presigned['fields']}
+        else:
+            # For PUT the content type and length are part of the signature,
+            # so the client has to send exactly these headers
+            url = s3_client.generate_presigned_url(
+                'put_object',
+                Params={
+                    'Bucket': bucket_name,
+                    'Key': s3_key,
+                    'ContentType': content_type,
+                    'ContentLength': file_size
+                },
+                ExpiresIn=PRESIGNED_UPLOAD_EXPIRY
+            )
+            upload = {
+                'url': url,
+                'headers': {'Content-Type': content_type}
+            }
+
+        # Reserve the metadata row. It stays hidden from listings until the
+        # upload is completed and expires on its own if it never is.
+        current_time = datetime.utcnow().isoformat()
+        table.put_item(
+            Item={
+                'userId': user_id,
+                'fileId': file_id,
+                'filename': filename,
+                's3Key': s3_key,
+                'size': file_size,
+                'contentType': content_type,
+                'status': 'pending',
+                'uploadedAt': current_time,
+                'lastModified': current_time,
+                'expiresAt': int(time.time()) + PENDING_UPLOAD_TTL,
+                **folder_attributes(user_id, folder)
+            },
+            ConditionExpression='attribute_not_exists(fileId)'
+        )
+
+        return jsonify({
+            'fileId': file_id,
+            'filename': filename,
+            'folder': folder,
+            'method': method,
+            'expiresIn': PRESIGNED_UPLOAD_EXPIRY,
+            **upload
+        })
+
+    except Exception as e:
+        current_app.logger.error(f"Error creating presigned upload: {str(e)}")
+        return jsonify({'error': 'Failed to create upload URL'}), 500
+
+@file_bp.route('/<string:file_id>/complete', methods=['POST'])
+@token_required
+def complete_presigned_upload(file_id):
+    """
+    Phase two of a direct-to-S3 upload: check the object landed in S3
+    and mark the metadata row as available
+    """
+    try:
+        user_id = request.decoded_token['uid']
+
+        response = table.get_item(
+            Key={
+                'userId': user_id,
+                'fileId': file_id
+            }
+        )
+
+        if 'Item' not in response:
+            return jsonify({'error': 'Upload not found or access denied'}), 404
+
+        file_item = response['Item']
+        if file_item.get('status') != 'pending':
+            return jsonify({'error': 'Upload already completed'}), 409
+
+        bucket_name = get_s3_bucket_name()
+        try:
+            head = s3_client.head_object(Bucket=bucket_name, Key=file_item['s3Key'])
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return jsonify({'error': 'File has not been uploaded yet'}), 409
+            raise
+
+        # Make sure what arrived matches what was reserved
+        size = head['ContentLength']
+        if size > file_item['size'] or head.get('ContentType') != file_item['contentType']:
+            s3_client.delete_object(Bucket=bucket_name, Key=file_item['s3Key'])
+            table.delete_item(Key={'userId': user_id, 'fileId': file_id})
+            return jsonify({'error': 'Uploaded file does not match the upload request'}), 400
+
+        current_time = datetime.utcnow().isoformat()
+        actions = (
+            [{
+                'Update': {
+                    'TableName': table.name,
+                    'Key': {
+                        'userId': user_id,
+                        'fileId': file_id
+                    },
+                    'UpdateExpression': 'SET #status = :available, #size = :size, lastModified = :now REMOVE expiresAt',
+                    'ConditionExpression': '#status = :pending',
+                    'ExpressionAttributeNames': {'#status': 'status', '#size': 'size'},
+                    'ExpressionAttributeValues': {
+                        ':available': 'available',
+                        ':pending': 'pending',
+                        ':size': size,
+                        ':now': current_time
+                    }
+                }
+            }] +
+            folder_store.aggregate_updates(user_id, file_item.get('folderPath', ROOT), 1, size) +
+            [usage_store.update(user_id, 1, size, usage_store.get(user_id)['quotaBytes'])]
+        )
+        try:
+            usage_store.commit(actions)
+        except QuotaExceeded as e:
+            # Other uploads used up the space since this one was reserved
+            s3_client.delete_object(Bucket=bucket_name, Key=file_item['s3Key'])
+            table.delete_item(Key={'userId': user_id, 'fileId': file_id})
+            return quota_exceeded_response(e)
+        except ClientError as e:
+            if cancellation_codes(e)[:1] == ['ConditionalCheckFailed']:
+                return jsonify({'error': 'Upload already completed'}), 409
+            # Drop the upload rather than leave its object behind once the
+            # pending row expires
+            s3_client.delete_object(Bucket=bucket_name, Key=file_item['s3Key'])
+            table.delete_item(Key={'userId': user_id, 'fileId': file_id})
+            if folder_store.rejected(e, actions):
+                return folder_changed_response()
+            raise
+        listing_cache.invalidate(user_id)
+        search_index.add(user_id, {**file_item, 'size': size})
+        change_feed.added(user_id, [listing_row({**file_item, 'size': size, 'lastModified': current_time})])
+        preview_pipeline.submit(user_id, file_id, file_item['s3Key'], file_item['contentType'])
+
+        return jsonify({
+            'message': 'File uploaded successfully',
+            'fileId': file_id,
+            'filename': file_item['filename'],
+            'size': size,
+            'contentType': file_item['contentType']
+        })
+
+    except Exception as e:
+        current_app.logger.error(f"Error completing upload: {str(e)}")
+        return jsonify({'error': 'Failed to complete upload'}), 500
+
+# Sort orders for list_files. Each one is backed by a global secondary index
+# on UserFiles with userId as the partition key, so every page is a single
+# bounded Query:
+#   userId-uploadedAt-index  (sort key uploadedAt, S)
+#   userId-filename-index    (sort key filename, S)
+#   userId-size-index        (sort key size, N)
+# The value is (index name, ScanIndexForward for the default direction).
+LIST_SORT_ORDERS = {
+    'newest': ('userId-uploadedAt-index', False),
+    'name': ('userId-filename-index', True),
+    'size': ('userId-size-index', False)
+}
+DEFAULT_LIST_PAGE_SIZE = 100
+MAX_LIST_PAGE_SIZE = 1000
+
+def get_cursor_serializer():
+    """Signs continuation tokens so clients can't forge or tamper with them"""
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt='list-files-cursor')
+
+def to_json_value(value):
+    """Convert DynamoDB Decimals in a key into plain numbers"""
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    return value
+
+def with_download_url(user_id, file_id, filename, content_type, s3_key=None, version=None):
+    """Return a download payload for a file, reusing a cached URL when possible.
+
+    Signing is local CPU work, so this never makes a network call. URLs are
+    only cached under the user's listing `version` the row was read at
+    (other workers' writes don't reach this worker's cache, but do bump the
+    version); without one the URL is signed fresh and not cached.
+    """
+    payload = download_url_cache.get(user_id, file_id, version) if version is not None else None
+    if payload is None:
+        s3_key = s3_key or f"{user_id}/{file_id}/{filename}"
+        payload = {
+            'url': generate_download_url(get_s3_bucket_name(), s3_key, filename),
+            'filename': filename,
+            'contentType': content_type
+        }
+        if version is not None:
+            download_url_cache.put(user_id, file_id, payload, DOWNLOAD_URL_EXPIRY, version)
+    return payload
+
+def with_preview_url(user_id, file_id, size):
+    """Return a cached (or freshly signed) URL for one of a file's previews"""
+    cache_key = f"{file_id}/{size}"
+    payload = preview_url_cache.get(user_id, cache_key)
+    if payload is None:
+        url = s3_client.generate_presigned_url(
+            'get_object',
+            Params={
+                'Bucket': get_s3_bucket_name(),
+                'Key': preview_key(user_id, file_id, size)
+            },
+            ExpiresIn=DOWNLOAD_URL_EXPIRY
+        )
+        payload = {'url': url, 'size': size}
+        preview_url_cache.put(user_id, cache_key, payload, DOWNLOAD_URL_EXPIRY)
+    return payload
+
+def listing_response(user_id, files, next_token, include_urls=False, version=None):
+    """Build a listing response; the continuation token goes in a header so the body stays a plain list"""
+    if include_urls:
+        files = [
+            {**f, 'url': with_download_url(user_id, f['fileId'], f['filename'], f['contentType'], f.get('s3Key'), version)['url']}
+            for f in files
+        ]
+        # Embed the smallest preview so the dashboard can show thumbnails
+        for f in files:
+            if f.get('previews'):
+                f['thumbnailUrl'] = with_preview_url(user_id, f['fileId'], f['previews'][0])['url']
+    # The object key is only kept (in the cache) for signing URLs
+    files = [{k: v for k, v in f.items() if k != 's3Key'} for f in files]
+    result = jsonify(files)
+    if next_token:
+        result.headers['X-Next-Token'] = next_token
+    return result
+
 @file_bp.route('', methods=['GET'])
 @token_required
 def list_files():
     """
-    List all files for the authenticated user
+    List one page of files for the authenticated user
+
+    Query parameters:
+        sort: newest (default), name or size
+        order: asc or desc, to flip the sort's default direction
+        limit: page size (default 100, max 1000)
+        nextToken: continuation token from a previous page's X-Next-Token header
+        includeUrls: true to embed a presigned download URL in every file
     """
+    include_urls = request.args.get('includeUrls', 'false').lower() == 'true'
+    sort = request.args.get('sort', 'newest')
+    if sort not in LIST_SORT_ORDERS:
+        return jsonify({'error': f"sort must be one of: {', '.join(LIST_SORT_ORDERS)}"}), 400
+
+    index_name, scan_forward = LIST_SORT_ORDERS[sort]
+    order = request.args.get('order')
+    if order not in (None, 'asc', 'desc'):
+        return jsonify({'error': 'order must be asc or desc'}), 400
+    if order:
+        scan_forward = order == 'asc'
+
+    try:
+        limit = int(request.args.get('limit', DEFAULT_LIST_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    limit = max(1, min(limit, MAX_LIST_PAGE_SIZE))
+
     try:
-        # Get user ID from the Firebase token
-        token = request.headers.get('Authorization').split('Bearer ')[1]
-        decoded_token = auth.verify_id_token(token)
-        user_id = decoded_token['uid']
+        # Get user ID from the Firebase token (already verified by @token_required)
+        user_id = request.decoded_token['uid']
+        next_token = request.args.get('nextToken')
         
-        # Query DynamoDB for user's files
-        response = table.query(
-            KeyConditionExpression='userId = :userId',
-            ExpressionAttributeValues={
-                ':userId': user_id
-            },
-            ScanIndexForward=False  # Sort by sort key (uploadedAt) in descending order
+        # An idle dashboard that polls gets a 304 for one GetItem on the
+        # listing version, without reading any file rows
+        version, age = usage_store.listing_state(user_id)
+        etag = make_etag(
+            'list', user_id, version,
+            sort, scan_forward, limit, next_token, include_urls and url_window()
         )
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+        
+        query_args = {
+            'IndexName': index_name,
+            'KeyConditionExpression': 'userId = :userId',
+            # Hide presigned uploads that haven't been completed yet
+            'FilterExpression': 'attribute_not_exists(#status) OR #status = :available',
+            'ExpressionAttributeNames': {'#status': 'status'},
+            'ExpressionAttributeValues': {
+                ':userId': user_id,
+                ':available': 'available'
+            },
+            'ScanIndexForward': scan_forward,
+            'Limit': limit
+        }
+        
+        # Serve repeat dashboard loads from the listing cache. The version is
+        # part of the key: writes handled by other workers bump it without
+        # invalidating this worker's cache, and a page cached before one of
+        # them must not be served under the new ETag.
+        cache_params = {'sort': sort, 'forward': scan_forward, 'limit': limit, 'nextToken': next_token, 'version': version}
+        cached = listing_cache.get(user_id, cache_params)
+        if cached is not None:
+            return with_etag(listing_response(user_id, cached['files'], cached['nextToken'], include_urls, version), etag)
+        
+        if next_token:
+            try:
+                cursor = get_cursor_serializer().loads(next_token)
+            except BadSignature:
+                return jsonify({'error': 'Invalid nextToken'}), 400
+            # A token is only valid for the user and sort order it was issued for
+            if cursor.get('user') != user_id or cursor.get('sort') != sort or cursor.get('forward') != scan_forward:
+                return jsonify({'error': 'nextToken does not match this query'}), 400
+            query_args['ExclusiveStartKey'] = cursor['key']
+        
+        # Query DynamoDB for one page of the user's files
+        response = table.query(**query_args)
         
         # Format the response
         files = []
         for item in response.get('Items', []):
-            files.append({
-                'fileId': item['fileId'],
-                'filename': item['filename'],
-                'size': item.get('size', 0),
-                'contentType': item.get('contentType', ''),
-                'uploadedAt': item['uploadedAt'],
-                'lastModified': item.get('lastModified', item['uploadedAt'])
+            files.append({**listing_row(item), 's3Key': item.get('s3Key')})
+        
+        new_token = None
+        last_key = response.get('LastEvaluatedKey')
+        if last_key:
+            new_token = get_cursor_serializer().dumps({
+                'user': user_id,
+                'sort': sort,
+                'forward': scan_forward,
+                'key': {k: to_json_value(v) for k, v in last_key.items()}
             })
         
-        return jsonify(files)
+        # The index may not show the latest write yet; then nothing from
+        # this page is cached, not even its download URLs
+        settled = listing_settled(user_id, version, age)
+        result = listing_response(user_id, files, new_token, include_urls, version if settled else None)
+        if not settled:
+            result.headers['Cache-Control'] = 'no-store'
+            return result
+        listing_cache.set(user_id, cache_params, {'files': files, 'nextToken': new_token})
+        return with_etag(result, etag)
         
     except Exception as e:
         current_app.logger.error(f"Error listing files: {str(e)}")
         return jsonify({'error': 'Failed to list files'}), 500
 
+@file_bp.route('/download-urls', methods=['POST'])
+@token_required
+def get_download_urls():
+    """
+    Generate pre-signed download URLs for many files in one request
+    """
+    data = request.get_json(silent=True) or {}
+    file_ids = data.get('fileIds')
+    if not isinstance(file_ids, list) or not file_ids:
+        return jsonify({'error': 'fileIds must be a non-empty list'}), 400
+    if len(file_ids) > MAX_BATCH_FILE_IDS:
+        return jsonify({'error': f'At most {MAX_BATCH_FILE_IDS} fileIds per request'}), 400
+
+    try:
+        user_id = request.decoded_token['uid']
+        file_ids = list(dict.fromkeys(str(file_id) for file_id in file_ids))
+
+        # URLs we signed recently, at the current listing version, need no
+        # metadata lookup at all
+        version = usage_store.listing_version(user_id)
+        results = {}
+        for file_id in file_ids:
+            cached = download_url_cache.get(user_id, file_id, version)
+            if cached is not None:
+                results[file_id] = cached
+
+        # Fetch the rest of the metadata in bulk rather than one get_item per file
+        remaining = [file_id for file_id in file_ids if file_id not in results]
+        if remaining:
+            items = batch_get_items(
+                dynamodb,
+                table.name,
+                [{'userId': user_id, 'fileId': file_id} for file_id in remaining],
+                projection='fileId, filename, contentType, s3Key, #status',
+                names={'#status': 'status'},
+                # The URLs are cached under the version read above
+                consistent=True
+            )
+            for item in items:
+                if item.get('status', 'available') != 'available':
+                    continue
+                results[item['fileId']] = with_download_url(
+                    user_id,
+                    item['fileId'],
+                    item['filename'],
+                    item.get('contentType', 'application/octet-stream'),
+                    item.get('s3Key'),
+                    version
+                )
+
+        return jsonify({
+            'files': [{'fileId': file_id, **results[file_id]} for file_id in file_ids if file_id in results],
+            'notFound': [file_id for file_id in file_ids if file_id not in results]
+        })
+
+    except Exception as e:
+        current_app.logger.error(f"Error generating download URLs: {str(e)}")
+        return jsonify({'error': 'Failed to generate download URLs'}), 500
+
+@file_bp.route('/archive', methods=['GET', 'POST'])
+@token_required
+def download_archive():
+    """
+    Stream a ZIP archive of several files, or of every file when no IDs are given
+
+    File IDs come from a JSON body ({"fileIds": [...]}) or a comma-separated
+    fileIds query parameter. The archive is built while it is sent, so it
+    never sits in memory or on disk.
+    """
+    data = request.get_json(silent=True) or {}
+    file_ids = data.get('fileIds')
+    if file_ids is None and request.args.get('fileIds'):
+        file_ids = request.args['fileIds'].split(',')
+    if file_ids is not None and not isinstance(file_ids, list):
+        return jsonify({'error': 'fileIds must be a list'}), 400
+    if file_ids is not None and len(file_ids) > MAX_ARCHIVE_FILES:
+        return jsonify({'error': f'At most {MAX_ARCHIVE_FILES} files per archive'}), 400
+
+    try:
+        user_id = request.decoded_token['uid']
+        projection = 'fileId, filename, s3Key, #size, contentType, uploadedAt, lastModified, #status'
+        names = {'#size': 'size', '#status': 'status'}
+
+        if file_ids:
+            file_ids = list(dict.fromkeys(str(file_id) for file_id in file_ids))
+            items = batch_get_items(
+                dynamodb,
+                table.name,
+                [{'userId': user_id, 'fileId': file_id} for file_id in file_ids],
+                projection=projection,
+                names=names
+            )
+            # Keep the order the files were asked for
+            position = {file_id: i for i, file_id in enumerate(file_ids)}
+            items.sort(key=lambda item: position[item['fileId']])
+        else:
+            items = []
+            query_args = {
+                'KeyConditionExpression': 'userId = :userId',
+                'ProjectionExpression': projection,
+                'ExpressionAttributeNames': names,
+                'ExpressionAttributeValues': {':userId': user_id}
+            }
+            while True:
+                response = table.query(**query_args)
+                items.extend(response.get('Items', []))
+                if 'LastEvaluatedKey' not in response:
+                    break
+                query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+        items = [item for item in items if item.get('status', 'available') == 'available']
+        if not items:
+            return jsonify({'error': 'No files to download'}), 404
+        if len(items) > MAX_ARCHIVE_FILES:
+            return jsonify({'error': f'At most {MAX_ARCHIVE_FILES} files per archive'}), 400
+
+        entries = [
+            {
+                'name': name,
+                's3Key': item.get('s3Key') or f"{user_id}/{item['fileId']}/{item['filename']}",
+                'size': item.get('size', 0),
+                'contentType': item.get('contentType'),
+                'lastModified': item.get('lastModified', item.get('uploadedAt'))
+            }
+            for item, name in zip(items, unique_names([item['filename'] for item in items]))
+        ]
+
+        archive = stream_zip(
+            s3_client,
+            get_s3_bucket_name(),
+            entries,
+            chunk_size=ARCHIVE_CHUNK_SIZE,
+            prefetch_chunks=ARCHIVE_PREFETCH_CHUNKS
+        )
+        return Response(
+            stream_with_context(archive),
+            mimetype='application/zip',
+            headers={'Content-Disposition': 'attachment; filename="files.zip"'}
+        )
+
+    except Exception as e:
+        current_app.logger.error(f"Error creating archive: {str(e)}")
+        return jsonify({'error': 'Failed to create archive'}), 500
+
 @file_bp.route('/<string:file_id>', methods=['GET'])
 @token_required
 def get_file(file_id):
@@ -149,107 +904,365 @@ def get_file(file_id):
         # Get user ID from the token
         user_id = request.decoded_token['uid']
         
-        # Query the file metadata from DynamoDB
+        # Any change to the user's files bumps the listing version, so it
+        # also versions each file's metadata
+        version = usage_store.listing_version(user_id)
+        etag = make_etag('file', user_id, file_id, version, url_window())
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+        
+        # Repeat clicks reuse a URL signed since the last change
+        cached = download_url_cache.get(user_id, file_id, version)
+        if cached is not None:
+            return with_etag(jsonify(cached), etag)
+        
+        # Query the file metadata from DynamoDB (strongly consistent, since
+        # the response is tagged with the version read above)
         response = table.get_item(
             Key={
                 'userId': user_id,
                 'fileId': file_id
-            }
+            },
+            ConsistentRead=True
         )
         
-        if 'Item' not in response:
+        if 'Item' not in response or response['Item'].get('status', 'available') != 'available':
             return jsonify({'error': 'File not found or access denied'}), 404
             
         file_item = response['Item']
         
-        # Generate a pre-signed URL for the file
-        bucket_name = get_s3_bucket_name()
-        s3_key = f"{user_id}/{file_id}/{file_item['filename']}"
-        
-        try:
-            # Check if file exists and user has permission
-            s3_client.head_object(Bucket=bucket_name, Key=s3_key)
-            
-            # Generate pre-signed URL (valid for 1 hour)
-            presigned_url = s3_client.generate_presigned_url(
-                'get_object',
-                Params={
-                    'Bucket': bucket_name,
-                    'Key': s3_key,
-                    'ResponseContentDisposition': f'attachment; filename="{file_item["filename"]}"'
-                },
-                ExpiresIn=3600
-            )
-            
-            return jsonify({
-                'url': presigned_url,
-                'filename': file_item['filename'],
-                'contentType': file_item.get('contentType', 'application/octet-stream')
-            })
-            
-        except ClientError as e:
-            if e.response['Error']['Code'] == '404':
-                return jsonify({'error': 'File not found in storage'}), 404
-            raise
+        # Generate a pre-signed URL for the file. We trust the metadata row
+        # that the object exists (the storage reconciler catches rows whose
+        # object has gone missing) rather than doing a HEAD per download.
+        return with_etag(jsonify(with_download_url(
+            user_id,
+            file_id,
+            file_item['filename'],
+            file_item.get('contentType', 'application/octet-stream'),
+            file_item.get('s3Key'),
+            version
+        )), etag)
             
     except Exception as e:
         current_app.logger.error(f"Error generating download URL: {str(e)}")
         return jsonify({'error': 'Failed to generate download URL'}), 500
 
-@file_bp.route('/<string:file_id>', methods=['DELETE'])
+@file_bp.route('/<string:file_id>/preview', methods=['GET'])
 @token_required
-def delete_file(file_id):
+def get_preview(file_id):
     """
-    Delete a file and its metadata
+    Generate a pre-signed URL for one of a file's image previews
+
+    Query parameters:
+        size: preview size (longest edge in pixels); defaults to the smallest
     """
     try:
-        # Get user ID from the token
         user_id = request.decoded_token['uid']
         
-        # First, get the file metadata to get the filename
         response = table.get_item(
             Key={
                 'userId': user_id,
                 'fileId': file_id
-            }
+            },
+            ProjectionExpression='previews, #status',
+            ExpressionAttributeNames={'#status': 'status'}
         )
-        
-        if 'Item' not in response:
+        item = response.get('Item')
+        if not item or item.get('status', 'available') != 'available':
             return jsonify({'error': 'File not found or access denied'}), 404
-            
-        file_item = response['Item']
-        
-        # Delete from S3
-        bucket_name = get_s3_bucket_name()
-        s3_key = f"{user_id}/{file_id}/{file_item['filename']}"
         
+        sizes = sorted(int(size) for size in item.get('previews', []))
+        if not sizes:
+            return jsonify({'error': 'No preview available for this file'}), 404
         try:
-            # Delete the file from S3
-            s3_client.delete_object(Bucket=bucket_name, Key=s3_key)
-            
-            # Delete the metadata from DynamoDB
-            table.delete_item(
-                Key={
-                    'userId': user_id,
-                    'fileId': file_id
-                }
-            )
-            
-            return jsonify({'message': 'File deleted successfully'})
-            
-        except ClientError as e:
-            if e.response['Error']['Code'] == 'NoSuchKey':
-                # File doesn't exist in S3, but we'll still delete the metadata
-                current_app.logger.warning(f"File {file_id} not found in S3, but deleting metadata")
-                table.delete_item(
-                    Key={
+            size = int(request.args.get('size', sizes[0]))
+        except ValueError:
+            return jsonify({'error': 'size must be an integer'}), 400
+        if size not in sizes:
+            return jsonify({'error': f"size must be one of: {', '.join(map(str, sizes))}"}), 400
+        
+        return jsonify(with_preview_url(user_id, file_id, size))
+        
+    except Exception as e:
+        current_app.logger.error(f"Error generating preview URL: {str(e)}")
+        return jsonify({'error': 'Failed to generate preview URL'}), 500
+
+@file_bp.route('/<string:file_id>', methods=['DELETE'])
+@token_required
+def delete_file(file_id):
+    """
+    Move a file to the trash
+
+    The row becomes a tombstone and drops out of listings straight away;
+    the purge worker deletes the object and the row later, in batches.
+    Until then the file can be restored.
+    """
+    try:
+        # Get user ID from the token
+        user_id = request.decoded_token['uid']
+        
+        item = table.get_item(Key={'userId': user_id, 'fileId': file_id}, ConsistentRead=True).get('Item')
+        if not item or item.get('status', 'available') != 'available':
+            return jsonify({'error': 'File not found or access denied'}), 404
+
+        # Files in the trash don't count towards their folder's totals, so
+        # they come off in the same transaction
+        placement, values = placement_condition(item)
+        actions = (
+            [{
+                'Update': {
+                    'TableName': table.name,
+                    'Key': {
                         'userId': user_id,
                         'fileId': file_id
+                    },
+                    'UpdateExpression': 'SET #status = :deleted, tombstone = :deleted, deletedAt = :now',
+                    'ConditionExpression': f'(attribute_not_exists(#status) OR #status = :available) AND {placement}',
+                    'ExpressionAttributeNames': {'#status': 'status', '#size': 'size'},
+                    'ExpressionAttributeValues': {
+                        ':deleted': 'deleted',
+                        ':available': 'available',
+                        ':now': datetime.utcnow().isoformat(),
+                        **values
                     }
-                )
-                return jsonify({'message': 'File metadata deleted (file not found in storage)'})
+                }
+            }] +
+            folder_store.aggregate_updates(user_id, item.get('folderPath', ROOT), -1, -int(item.get('size', 0)))
+        )
+        try:
+            transact_write(dynamodb.meta.client, actions)
+        except ClientError as e:
+            if cancellation_codes(e)[:1] == ['ConditionalCheckFailed']:
+                # Deleted, moved or replaced since we read it
+                return jsonify({'error': 'File has changed, try again'}), 409
+            if folder_store.rejected(e, actions):
+                return folder_changed_response()
             raise
+
+        forget_cached_file(user_id, file_id)
+        change_feed.removed(user_id, [file_id])
+        return jsonify({'message': 'File moved to trash'})
             
     except Exception as e:
         current_app.logger.error(f"Error deleting file: {str(e)}")
         return jsonify({'error': 'Failed to delete file'}), 500
+
+@file_bp.route('/trash', methods=['GET'])
+@token_required
+def list_trash():
+    """
+    List the authenticated user's files that are waiting to be purged
+    """
+    try:
+        user_id = request.decoded_token['uid']
+        
+        query_args = {
+            'KeyConditionExpression': 'userId = :userId',
+            'FilterExpression': '#status = :deleted',
+            'ExpressionAttributeNames': {'#status': 'status'},
+            'ExpressionAttributeValues': {
+                ':userId': user_id,
+                ':deleted': 'deleted'
+            }
+        }
+        files = []
+        while True:
+            response = table.query(**query_args)
+            for item in response.get('Items', []):
+                files.append({
+                    'fileId': item['fileId'],
+                    'filename': item['filename'],
+                    'size': item.get('size', 0),
+                    'contentType': item.get('contentType', ''),
+                    'uploadedAt': item['uploadedAt'],
+                    'deletedAt': item['deletedAt'],
+                    'folder': item.get('folderPath', ROOT)
+                })
+            if 'LastEvaluatedKey' not in response:
+                break
+            query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        
+        files.sort(key=lambda f: f['deletedAt'], reverse=True)
+        return jsonify(files)
+        
+    except Exception as e:
+        current_app.logger.error(f"Error listing trash: {str(e)}")
+        return jsonify({'error': 'Failed to list trash'}), 500
+
+@file_bp.route('/<string:file_id>/restore', methods=['POST'])
+@token_required
+def restore_file(file_id):
+    """
+    Restore a file from the trash, as long as it hasn't been purged yet
+    """
+    try:
+        user_id = request.decoded_token['uid']
+        
+        item = table.get_item(Key={'userId': user_id, 'fileId': file_id}, ConsistentRead=True).get('Item')
+        if not item or item.get('status') != 'deleted':
+            return jsonify({'error': 'File not found in trash'}), 404
+
+        # If its folder was deleted while it sat in the trash, it comes back to the root
+        folder = item.get('folderPath', ROOT)
+        placement, values = placement_condition(item)
+        update = 'SET #status = :available REMOVE tombstone, deletedAt'
+        if not folder_store.exists(user_id, folder):
+            folder = ROOT
+            update = 'SET #status = :available, folderPath = :folder, parentKey = :parentKey REMOVE tombstone, deletedAt'
+            values.update({':folder': ROOT, ':parentKey': folder_attributes(user_id, ROOT)['parentKey']})
+        actions = (
+            [{
+                'Update': {
+                    'TableName': table.name,
+                    'Key': {
+                        'userId': user_id,
+                        'fileId': file_id
+                    },
+                    'UpdateExpression': update,
+                    'ConditionExpression': f'#status = :deleted AND {placement}',
+                    'ExpressionAttributeNames': {'#status': 'status', '#size': 'size'},
+                    'ExpressionAttributeValues': {
+                        ':available': 'available',
+                        ':deleted': 'deleted',
+                        **values
+                    }
+                }
+            }] +
+            folder_store.aggregate_updates(user_id, folder, 1, int(item.get('size', 0)))
+        )
+        try:
+            transact_write(dynamodb.meta.client, actions)
+        except ClientError as e:
+            if cancellation_codes(e)[:1] == ['ConditionalCheckFailed']:
+                # Restored or claimed by the purge worker since we read it
+                return jsonify({'error': 'File not found in trash'}), 404
+            if folder_store.rejected(e, actions):
+                return folder_changed_response()
+            raise
+
+        item = {**item, 'status': 'available', **folder_attributes(user_id, folder)}
+        listing_changed(user_id)
+        search_index.invalidate(user_id)
+        change_feed.added(user_id, [listing_row(item)])
+        return jsonify({'message': 'File restored'})
+        
+    except Exception as e:
+        current_app.logger.error(f"Error restoring file: {str(e)}")
+        return jsonify({'error': 'Failed to restore file'}), 500
+
+@file_bp.route('/bulk-delete', methods=['POST'])
+@token_required
+def bulk_delete_files():
+    """
+    Delete many files and their metadata in batches
+
+    Returns a per-file result: deleted, not_found or failed.
+    """
+    data = request.get_json(silent=True) or {}
+    file_ids = data.get('fileIds')
+    if not isinstance(file_ids, list) or not file_ids:
+        return jsonify({'error': 'fileIds must be a non-empty list'}), 400
+    if len(file_ids) > MAX_BULK_DELETE_FILE_IDS:
+        return jsonify({'error': f'At most {MAX_BULK_DELETE_FILE_IDS} fileIds per request'}), 400
+
+    try:
+        user_id = request.decoded_token['uid']
+        file_ids = list(dict.fromkeys(str(file_id) for file_id in file_ids))
+        results = {file_id: 'not_found' for file_id in file_ids}
+
+        # Fetch all the metadata with BatchGetItem instead of a get_item per file
+        items = batch_get_items(
+            dynamodb,
+            table.name,
+            [{'userId': user_id, 'fileId': file_id} for file_id in file_ids],
+            projection='userId, fileId, filename, s3Key, contentHash, previews, folderPath, #size, fileSize, #status',
+            names={'#size': 'size', '#status': 'status'},
+            # The deletes are conditional on the rows being as read here
+            consistent=True
+        )
+
+        # Bulk delete is permanent: remove the objects and rows right away
+        # using the same batched deletes as the purge worker. The live files
+        # come off their folders' totals in the same transactions.
+        deleted, failed = remove_files(
+            table, dynamodb, s3_client, get_s3_bucket_name(), items, content_store, usage_store, folder_store
+        )
+        for _, file_id in deleted:
+            results[file_id] = 'deleted'
+            download_url_cache.invalidate(user_id, file_id)
+            search_index.remove(user_id, file_id)
+        for _, file_id in failed:
+            results[file_id] = 'failed'
+        if deleted:
+            listing_cache.invalidate(user_id)
+            change_feed.removed(user_id, [file_id for _, file_id in deleted])
+
+        counts = {}
+        for status in results.values():
+            counts[status] = counts.get(status, 0) + 1
+
+        return jsonify({
+            'results': [{'fileId': file_id, 'status': results[file_id]} for file_id in file_ids],
+            'deleted': counts.get('deleted', 0),
+            'notFound': counts.get('not_found', 0),
+            'failed': counts.get('failed', 0)
+        })
+
+    except Exception as e:
+        current_app.logger.error(f"Error bulk deleting files: {str(e)}")
+        return jsonify({'error': 'Failed to delete files'}), 500
+
+@file_bp.route('/usage', methods=['GET'])
+@token_required
+def get_usage():
+    """
+    Return the authenticated user's storage usage and quota
+    """
+    try:
+        return jsonify(usage_store.get(request.decoded_token['uid']))
+    except Exception as e:
+        current_app.logger.error(f"Error reading storage usage: {str(e)}")
+        return jsonify({'error': 'Failed to read storage usage'}), 500
+
+@file_bp.route('/listing-cache/stats', methods=['GET'])
+@token_required
+@admin_required
+def listing_cache_stats():
+    """
+    Return listing cache hit ratio and staleness counters
+    """
+    return jsonify(listing_cache.stats())
+
+@file_bp.route('/dedup/stats', methods=['GET'])
+@token_required
+@admin_required
+def dedup_stats():
+    """
+    Return deduplication totals: dedup ratio and bytes saved
+    """
+    if not content_store:
+        return jsonify({'error': 'Content deduplication is not enabled'}), 404
+    try:
+        return jsonify(content_store.stats())
+    except Exception as e:
+        current_app.logger.error(f"Error reading dedup stats: {str(e)}")
+        return jsonify({'error': 'Failed to read dedup stats'}), 500
+
+@file_bp.route('/previews/stats', methods=['GET'])
+@token_required
+@admin_required
+def preview_stats():
+    """
+    Return preview pipeline counters (queued, rejected, completed, ...)
+    """
+    return jsonify(preview_pipeline.stats())
+
+@file_bp.route('/download-url-cache/stats', methods=['GET'])
+@token_required
+@admin_required
+def download_url_cache_stats():
+    """
+    Return presigned download URL cache counters
+    """
+    return jsonify(download_url_cache.stats())
\ No newline at end of file
@@ -0,0 +1,248 @@
+from flask import Blueprint, request, jsonify, current_app
+from itsdangerous import BadSignature
+from auth.firebase import token_required
+from routes.file_routes import (
+    dynamodb, table, folder_store, usage_store, change_feed, get_cursor_serializer, to_json_value,
+    listing_changed, listing_settled, make_etag, not_modified, with_etag
+)
+from services.dynamo_batch import batch_get_items
+from services.folders import ROOT, FolderConflict, normalize_path
+
+# Folders are metadata only: a file's S3 key never contains its folder, so
+# moving or renaming a folder rewrites DynamoDB rows and copies nothing
+folder_bp = Blueprint('folders', __name__)
+
+DEFAULT_FOLDER_PAGE_SIZE = 100
+MAX_FOLDER_PAGE_SIZE = 1000
+MAX_MOVE_FILE_IDS = 1000
+
+def folder_summary(folder):
+    return {
+        'path': folder['path'],
+        'name': folder.get('name', ''),
+        'fileCount': int(folder.get('subtreeFileCount', 0)),
+        'size': int(folder.get('subtreeSize', 0)),
+        'createdAt': folder.get('createdAt')
+    }
+
+@folder_bp.route('', methods=['GET'])
+@token_required
+def list_folder():
+    """
+    List one folder: its totals, its subfolders and one page of its files
+
+    Query parameters:
+        path: folder path, e.g. /photos/2024/ (default: the root)
+        order: asc (default) or desc, by filename
+        limit: page size (default 100, max 1000)
+        nextToken: continuation token from a previous page
+    """
+    try:
+        path = normalize_path(request.args.get('path', ROOT))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    order = request.args.get('order', 'asc')
+    if order not in ('asc', 'desc'):
+        return jsonify({'error': 'order must be asc or desc'}), 400
+    try:
+        limit = max(1, min(int(request.args.get('limit', DEFAULT_FOLDER_PAGE_SIZE)), MAX_FOLDER_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+
+    try:
+        user_id = request.decoded_token['uid']
+        next_token = request.args.get('nextToken')
+        version, age = usage_store.listing_state(user_id)
+        etag = make_etag('folder', user_id, version, path, order, limit, next_token)
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+
+        folder = folder_store.get(user_id, path)
+        if folder is None:
+            return jsonify({'error': 'Folder not found'}), 404
+
+        start_key = None
+        if next_token:
+            try:
+                cursor = get_cursor_serializer().loads(next_token)
+            except BadSignature:
+                return jsonify({'error': 'Invalid nextToken'}), 400
+            if cursor.get('user') != user_id or cursor.get('folder') != path or cursor.get('order') != order:
+                return jsonify({'error': 'nextToken does not match this query'}), 400
+            start_key = cursor['key']
+
+        items, last_key = folder_store.list_files(user_id, path, limit, start_key, forward=order == 'asc')
+        files = [
+            {
+                'fileId': item['fileId'],
+                'filename': item['filename'],
+                'size': item.get('size', 0),
+                'contentType': item.get('contentType', ''),
+                'uploadedAt': item['uploadedAt'],
+                'lastModified': item.get('lastModified', item['uploadedAt'])
+            }
+            for item in items
+        ]
+
+        new_token = None
+        if last_key:
+            new_token = get_cursor_serializer().dumps({
+                'user': user_id,
+                'folder': path,
+                'order': order,
+                'key': {k: to_json_value(v) for k, v in last_key.items()}
+            })
+
+        # Subfolders come with the first page only
+        subfolders = []
+        if not next_token:
+            subfolders = sorted(
+                (folder_summary(subfolder) for subfolder in folder_store.list_subfolders(user_id, path)),
+                key=lambda subfolder: subfolder['name'].lower()
+            )
+
+        result = jsonify({
+            'folder': folder_summary(folder),
+            'folders': subfolders,
+            'files': files,
+            'nextToken': new_token
+        })
+        if not listing_settled(user_id, version, age):
+            # The folder's file index may not show the latest write yet
+            result.headers['Cache-Control'] = 'no-store'
+            return result
+        return with_etag(result, etag)
+
+    except Exception as e:
+        current_app.logger.error(f"Error listing folder: {str(e)}")
+        return jsonify({'error': 'Failed to list folder'}), 500
+
+@folder_bp.route('', methods=['POST'])
+@token_required
+def create_folder():
+    """
+    Create a folder. Body: {"path": "/parent/new-folder/"}; the parent must exist
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        path = normalize_path(data.get('path') or '')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        user_id = request.decoded_token['uid']
+        try:
+            folder = folder_store.create(user_id, path)
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
+        except FolderConflict as e:
+            return jsonify({'error': str(e)}), 409
+        listing_changed(user_id)
+        return jsonify(folder_summary(folder)), 201
+
+    except Exception as e:
+        current_app.logger.error(f"Error creating folder: {str(e)}")
+        return jsonify({'error': 'Failed to create folder'}), 500
+
+@folder_bp.route('', methods=['DELETE'])
+@token_required
+def delete_folder():
+    """
+    Delete an empty folder. Query parameter: path
+    """
+    try:
+        path = normalize_path(request.args.get('path') or '')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        user_id = request.decoded_token['uid']
+        try:
+            folder_store.delete(user_id, path)
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
+        except FolderConflict as e:
+            return jsonify({'error': str(e)}), 409
+        listing_changed(user_id)
+        return jsonify({'message': 'Folder deleted'})
+
+    except Exception as e:
+        current_app.logger.error(f"Error deleting folder: {str(e)}")
+        return jsonify({'error': 'Failed to delete folder'}), 500
+
+@folder_bp.route('/move', methods=['POST'])
+@token_required
+def move_folder():
+    """
+    Move or rename a folder with everything in it. Body: {"from": "/a/", "to": "/b/c/"}
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        source = normalize_path(data.get('from') or '')
+        target = normalize_path(data.get('to') or '')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        user_id = request.decoded_token['uid']
+        try:
+            moved = folder_store.move(user_id, source, target)
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
+        except FolderConflict as e:
+            return jsonify({'error': str(e)}), 409
+        listing_changed(user_id)
+        change_feed.publish(user_id, 'moved', **{'from': source, 'to': target})
+        return jsonify({'message': 'Folder moved', 'from': source, 'to': target, **moved})
+
+    except Exception as e:
+        current_app.logger.error(f"Error moving folder: {str(e)}")
+        return jsonify({'error': 'Failed to move folder'}), 500
+
+@folder_bp.route('/move-files', methods=['POST'])
+@token_required
+def move_files():
+    """
+    Move files into a folder. Body: {"fileIds": [...], "to": "/folder/"}
+    """
+    data = request.get_json(silent=True) or {}
+    file_ids = data.get('fileIds')
+    if not isinstance(file_ids, list) or not file_ids:
+        return jsonify({'error': 'fileIds must be a non-empty list'}), 400
+    if len(file_ids) > MAX_MOVE_FILE_IDS:
+        return jsonify({'error': f'At most {MAX_MOVE_FILE_IDS} fileIds per request'}), 400
+    try:
+        target = normalize_path(data.get('to') or ROOT)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        user_id = request.decoded_token['uid']
+        if not folder_store.exists(user_id, target):
+            return jsonify({'error': 'Folder not found'}), 404
+
+        file_ids = list(dict.fromkeys(str(file_id) for file_id in file_ids))
+        items = batch_get_items(
+            dynamodb,
+            table.name,
+            [{'userId': user_id, 'fileId': file_id} for file_id in file_ids],
+            projection='fileId, folderPath, parentKey, #size, #status',
+            names={'#size': 'size', '#status': 'status'}
+        )
+        # Files that are mid-upload or in the trash stay where they are
+        items = [item for item in items if item.get('status', 'available') == 'available']
+        already_there = {item['fileId'] for item in items if item.get('folderPath', ROOT) == target}
+        moved = set(folder_store.move_files(user_id, items, target)) | already_there
+        if moved:
+            listing_changed(user_id)
+            change_feed.updated(user_id, [{'fileId': file_id, 'folder': target} for file_id in moved])
+
+        return jsonify({
+            'moved': [file_id for file_id in file_ids if file_id in moved],
+            'notMoved': [file_id for file_id in file_ids if file_id not in moved]
+        })
+
+    except Exception as e:
+        current_app.logger.error(f"Error moving files: {str(e)}")
+        return jsonify({'error': 'Failed to move files'}), 500
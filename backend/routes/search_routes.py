@@ -0,0 +1,72 @@
+from flask import Blueprint, request, jsonify, current_app
+from auth.firebase import token_required, admin_required
+from routes.file_routes import search_index
+from services.search_index import to_timestamp
+
+# Filename search over an in-memory index per user, so a search never
+# has to pull the user's whole listing from DynamoDB
+search_bp = Blueprint('search', __name__)
+
+SEARCH_MODES = ('prefix', 'token', 'substring')
+DEFAULT_SEARCH_LIMIT = 50
+MAX_SEARCH_LIMIT = 500
+
+@search_bp.route('/search', methods=['GET'])
+@token_required
+def search_files():
+    """
+    Search the authenticated user's files by name
+
+    Query parameters:
+        q: search text
+        mode: prefix (default; each word starts a word of the name),
+              token (whole words) or substring (anywhere in the name)
+        type: content type prefix, e.g. image/ or application/pdf
+        minSize, maxSize: size bounds in bytes
+        after, before: ISO upload timestamps
+        limit: number of results (default 50, max 500)
+    """
+    args = request.args
+    mode = args.get('mode', 'prefix')
+    if mode not in SEARCH_MODES:
+        return jsonify({'error': f"mode must be one of: {', '.join(SEARCH_MODES)}"}), 400
+
+    try:
+        limit = max(1, min(int(args.get('limit', DEFAULT_SEARCH_LIMIT)), MAX_SEARCH_LIMIT))
+        min_size = int(args['minSize']) if args.get('minSize') else None
+        max_size = int(args['maxSize']) if args.get('maxSize') else None
+    except ValueError:
+        return jsonify({'error': 'limit, minSize and maxSize must be integers'}), 400
+    try:
+        after = to_timestamp(args['after']) if args.get('after') else None
+        before = to_timestamp(args['before']) if args.get('before') else None
+    except ValueError:
+        return jsonify({'error': 'after and before must be ISO timestamps'}), 400
+
+    try:
+        user_id = request.decoded_token['uid']
+        total, files = search_index.search(
+            user_id,
+            query=args.get('q', '').strip(),
+            mode=mode,
+            content_type=args.get('type') or None,
+            min_size=min_size,
+            max_size=max_size,
+            after=after,
+            before=before,
+            limit=limit
+        )
+        return jsonify({'total': total, 'files': files})
+
+    except Exception as e:
+        current_app.logger.error(f"Error searching files: {str(e)}")
+        return jsonify({'error': 'Failed to search files'}), 500
+
+@search_bp.route('/search/stats', methods=['GET'])
+@token_required
+@admin_required
+def search_index_stats():
+    """
+    Return how many users and files are indexed in this process
+    """
+    return jsonify(search_index.stats())
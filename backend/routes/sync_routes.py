@@ -0,0 +1,216 @@
+import io
+import json
+import uuid
+from datetime import datetime
+from flask import Blueprint, request, jsonify, current_app
+from botocore.exceptions import ClientError
+from auth.firebase import token_required
+from routes.file_routes import (
+    s3_client, table, content_store, preview_pipeline, search_index, folder_store, usage_store, change_feed,
+    forget_cached_file, quota_exceeded_response, folder_changed_response, get_s3_bucket_name
+)
+from services.folders import ROOT, placement_condition
+from services.usage import QuotaExceeded
+from services.dynamo_batch import cancellation_codes
+from services.delta_sync import (
+    DeltaAssembler, block_signatures, default_block_size, normalize_recipe,
+    MIN_BLOCK_SIZE, MAX_BLOCK_SIZE
+)
+
+# Delta sync: to upload a new version of a large file, the client fetches
+# the block signatures of the current version, works out which blocks it
+# already has, and sends only the changed bytes plus a recipe. The server
+# assembles the new version in S3, copying unchanged ranges server-side.
+sync_bp = Blueprint('sync', __name__)
+
+def get_available_file(user_id, file_id):
+    """Fetch a file's metadata row, or None if it doesn't exist or isn't available"""
+    response = table.get_item(
+        Key={
+            'userId': user_id,
+            'fileId': file_id
+        },
+        ConsistentRead=True
+    )
+    item = response.get('Item')
+    if not item or item.get('status', 'available') != 'available':
+        return None
+    return item
+
+@sync_bp.route('/<string:file_id>/signatures', methods=['GET'])
+@token_required
+def get_block_signatures(file_id):
+    """
+    Return rolling (Adler-32) and strong (BLAKE2b) checksums for each block of a file
+
+    Query parameters:
+        blockSize: block size in bytes (default: about sqrt of the file size)
+    """
+    try:
+        user_id = request.decoded_token['uid']
+        item = get_available_file(user_id, file_id)
+        if not item:
+            return jsonify({'error': 'File not found or access denied'}), 404
+
+        size = int(item.get('size', 0))
+        try:
+            block_size = int(request.args.get('blockSize') or default_block_size(size))
+        except ValueError:
+            return jsonify({'error': 'blockSize must be an integer'}), 400
+        if not MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE:
+            return jsonify({'error': f'blockSize must be between {MIN_BLOCK_SIZE} and {MAX_BLOCK_SIZE}'}), 400
+
+        body = s3_client.get_object(Bucket=get_s3_bucket_name(), Key=item['s3Key'])['Body']
+        try:
+            signatures = block_signatures(body, block_size)
+        finally:
+            body.close()
+
+        return jsonify({
+            'fileId': file_id,
+            'version': int(item.get('version', 1)),
+            'size': size,
+            'blockSize': block_size,
+            'blocks': signatures
+        })
+
+    except Exception as e:
+        current_app.logger.error(f"Error computing block signatures: {str(e)}")
+        return jsonify({'error': 'Failed to compute block signatures'}), 500
+
+@sync_bp.route('/<string:file_id>/delta', methods=['POST'])
+@token_required
+def upload_delta(file_id):
+    """
+    Create a new version of a file from a recipe and the changed bytes
+
+    Multipart form fields:
+        recipe: JSON {"baseVersion", "blockSize", "size", "ops"}, where each op
+            is {"copy": firstBlock, "blocks": count} (reuse blocks of the base
+            version) or {"data": length} (take the next bytes of `data`)
+        data: the changed bytes, concatenated in recipe order
+    """
+    try:
+        recipe = json.loads(request.form.get('recipe', ''))
+        base_version = int(recipe['baseVersion'])
+        block_size = int(recipe['blockSize'])
+        expected_size = int(recipe['size'])
+        ops = recipe['ops']
+    except (ValueError, KeyError, TypeError):
+        return jsonify({'error': 'recipe must be JSON with baseVersion, blockSize, size and ops'}), 400
+    if not isinstance(ops, list) or not MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE:
+        return jsonify({'error': 'Invalid recipe'}), 400
+
+    try:
+        user_id = request.decoded_token['uid']
+        item = get_available_file(user_id, file_id)
+        if not item:
+            return jsonify({'error': 'File not found or access denied'}), 404
+
+        current_version = int(item.get('version', 1))
+        if base_version != current_version:
+            return jsonify({'error': 'File has changed since the signatures were taken', 'version': current_version}), 409
+
+        try:
+            segments, total = normalize_recipe(ops, block_size, int(item.get('size', 0)))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if total != expected_size:
+            return jsonify({'error': 'Recipe does not add up to the declared size'}), 400
+
+        # Only growth counts against the quota
+        growth = total - int(item.get('size', 0))
+        try:
+            quota = usage_store.check(user_id, max(growth, 0))
+        except QuotaExceeded as e:
+            return quota_exceeded_response(e)
+
+        # Each attempt gets its own key, so the base version stays intact
+        # (and readable) until the new one is committed, and two clients
+        # racing to write the same version can't overwrite each other
+        bucket_name = get_s3_bucket_name()
+        version = current_version + 1
+        s3_key = f"{user_id}/{file_id}/v{version}-{uuid.uuid4().hex[:8]}/{item['filename']}"
+        data = request.files.get('data')
+        assembler = DeltaAssembler(
+            s3_client,
+            bucket_name,
+            item['s3Key'],
+            s3_key,
+            extra_args={
+                'ContentType': item.get('contentType', 'application/octet-stream'),
+                'ACL': 'private'
+            }
+        )
+        try:
+            stats = assembler.assemble(segments, data.stream if data else io.BytesIO())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        current_time = datetime.utcnow().isoformat()
+        placement, values = placement_condition(item)
+        actions = (
+            [{
+                'Update': {
+                    'TableName': table.name,
+                    'Key': {
+                        'userId': user_id,
+                        'fileId': file_id
+                    },
+                    'UpdateExpression': 'SET s3Key = :key, #size = :size, version = :version, lastModified = :now, '
+                                        'deltaBytes = :delta REMOVE sha256, contentHash',
+                    'ConditionExpression': f's3Key = :base_key AND (attribute_not_exists(#status) OR #status = :available) '
+                                           f'AND {placement}',
+                    'ExpressionAttributeNames': {'#size': 'size', '#status': 'status'},
+                    'ExpressionAttributeValues': {
+                        ':key': s3_key,
+                        ':size': total,
+                        ':version': version,
+                        ':now': current_time,
+                        ':delta': stats['literalBytes'],
+                        ':base_key': item['s3Key'],
+                        ':available': 'available',
+                        **values
+                    }
+                }
+            }] +
+            folder_store.aggregate_updates(user_id, item.get('folderPath', ROOT), 0, growth) +
+            [usage_store.update(user_id, 0, growth, quota)]
+        )
+        try:
+            usage_store.commit(actions)
+        except QuotaExceeded as e:
+            s3_client.delete_object(Bucket=bucket_name, Key=s3_key)
+            return quota_exceeded_response(e)
+        except ClientError as e:
+            # Nothing refers to the new version's object
+            s3_client.delete_object(Bucket=bucket_name, Key=s3_key)
+            if cancellation_codes(e)[:1] == ['ConditionalCheckFailed']:
+                # Someone else committed a version (or deleted or moved the file) first
+                return jsonify({'error': 'File has changed since the signatures were taken'}), 409
+            if folder_store.rejected(e, actions):
+                return folder_changed_response()
+            raise
+
+        # The base version is no longer referenced
+        if item.get('contentHash') and content_store:
+            content_store.release(bucket_name, item['contentHash'])
+        else:
+            s3_client.delete_object(Bucket=bucket_name, Key=item['s3Key'])
+        forget_cached_file(user_id, file_id)
+        search_index.add(user_id, {**item, 'size': total})
+        change_feed.updated(user_id, [{'fileId': file_id, 'size': total, 'version': version, 'lastModified': current_time}])
+        preview_pipeline.submit(user_id, file_id, s3_key, item.get('contentType'))
+
+        return jsonify({
+            'message': 'File updated successfully',
+            'fileId': file_id,
+            'version': version,
+            'size': total,
+            'bytesReceived': stats['literalBytes'],
+            'bytesCopied': total - stats['literalBytes']
+        })
+
+    except Exception as e:
+        current_app.logger.error(f"Error applying delta: {str(e)}")
+        return jsonify({'error': 'Failed to update file'}), 500
@@ -0,0 +1,409 @@
+import os
+import uuid
+import time
+import base64
+import hashlib
+from datetime import datetime
+from flask import Blueprint, request, jsonify, current_app
+from werkzeug.utils import secure_filename
+from botocore.exceptions import ClientError
+from auth.firebase import token_required
+from routes.file_routes import (
+    s3_client, dynamodb, table, listing_cache, preview_pipeline, search_index, folder_store, usage_store,
+    change_feed, listing_row, resolve_folder, quota_exceeded_response, folder_changed_response, get_s3_bucket_name
+)
+from services.usage import QuotaExceeded
+from services.dynamo_batch import cancellation_codes
+from services.folders import ROOT, folder_attributes
+
+# Resumable uploads: the client opens a session, sends numbered chunks in
+# any order (each with a Content-MD5 checksum), asks which chunks are still
+# missing after a dropped connection, and finally commits. Each chunk is one
+# S3 multipart part, so nothing is re-sent once S3 has accepted it. A
+# committed session keeps a completedAt marker until its TTL, so a retried
+# commit gets the stored file back.
+upload_bp = Blueprint('uploads', __name__)
+
+# Upload sessions live in their own table next to UserFiles,
+# keyed the same way (userId + sessionId)
+sessions_table = dynamodb.Table(os.getenv('UPLOAD_SESSIONS_TABLE', 'UploadSessions'))
+
+# S3 parts (other than the last) must be at least 5MB, and there can be at most 10,000
+MIN_CHUNK_SIZE = 5 * 1024 * 1024
+MAX_CHUNKS = 10000
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_RESUMABLE_UPLOAD_SIZE = int(os.getenv('MAX_RESUMABLE_UPLOAD_SIZE', str(5 * 1024 * 1024 * 1024)))
+UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL', str(24 * 60 * 60)))
+
+def get_session(user_id, session_id):
+    """Fetch an upload session, or None if it doesn't exist for this user"""
+    response = sessions_table.get_item(
+        Key={
+            'userId': user_id,
+            'sessionId': session_id
+        },
+        ConsistentRead=True
+    )
+    return response.get('Item')
+
+def session_status(session):
+    """Summarize which chunks have been received and which are missing"""
+    received = sorted(int(n) for n in session.get('parts', {}))
+    received_set = set(received)
+    missing = [n for n in range(1, int(session['totalChunks']) + 1) if n not in received_set]
+    return {
+        'sessionId': session['sessionId'],
+        'fileName': session['filename'],
+        'fileSize': int(session['fileSize']),
+        'chunkSize': int(session['chunkSize']),
+        'totalChunks': int(session['totalChunks']),
+        'receivedChunks': received,
+        'missingChunks': missing,
+        'completed': 'completedAt' in session
+    }
+
+def completed_response(user_id, session):
+    """Answer for a session whose file is already stored, from the stored file row"""
+    item = table.get_item(
+        Key={'userId': user_id, 'fileId': session['fileId']},
+        ConsistentRead=True
+    ).get('Item')
+    if not item:
+        # Deleted since it was uploaded
+        return jsonify({'error': 'Uploaded file no longer exists'}), 404
+    return jsonify({
+        'message': 'File uploaded successfully',
+        'fileId': item['fileId'],
+        'filename': item['filename'],
+        'size': int(item['size']),
+        'contentType': item['contentType']
+    })
+
+def mark_completed(user_id, session_id):
+    """Keep the session (until its TTL) as a record that its file was stored"""
+    sessions_table.update_item(
+        Key={
+            'userId': user_id,
+            'sessionId': session_id
+        },
+        UpdateExpression='SET completedAt = :now',
+        ConditionExpression='attribute_exists(sessionId)',
+        ExpressionAttributeValues={':now': datetime.utcnow().isoformat()}
+    )
+
+@upload_bp.route('', methods=['POST'])
+@token_required
+def create_upload_session():
+    """
+    Start a resumable upload session
+    """
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get('fileName') or '')
+    content_type = data.get('fileType') or 'application/octet-stream'
+
+    if not filename:
+        return jsonify({'error': 'fileName is required'}), 400
+
+    try:
+        file_size = int(data.get('fileSize', 0))
+        chunk_size = int(data.get('chunkSize', DEFAULT_CHUNK_SIZE))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'fileSize and chunkSize must be integers'}), 400
+
+    if file_size <= 0 or file_size > MAX_RESUMABLE_UPLOAD_SIZE:
+        return jsonify({'error': f'fileSize must be between 1 and {MAX_RESUMABLE_UPLOAD_SIZE} bytes'}), 400
+
+    max_chunk_size = current_app.config['MAX_CONTENT_LENGTH']
+    if chunk_size < MIN_CHUNK_SIZE or chunk_size > max_chunk_size:
+        return jsonify({'error': f'chunkSize must be between {MIN_CHUNK_SIZE} and {max_chunk_size} bytes'}), 400
+
+    total_chunks = (file_size + chunk_size - 1) // chunk_size
+    if total_chunks > MAX_CHUNKS:
+        return jsonify({'error': f'File needs more than {MAX_CHUNKS} chunks, use a larger chunkSize'}), 400
+
+    try:
+        user_id = request.decoded_token['uid']
+        try:
+            folder = resolve_folder(user_id, data.get('folder'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        # Refuse before the client sends a single chunk
+        try:
+            usage_store.check(user_id, file_size)
+        except QuotaExceeded as e:
+            return quota_exceeded_response(e)
+        session_id = str(uuid.uuid4())
+        file_id = str(uuid.uuid4())
+        s3_key = f"{user_id}/{file_id}/{filename}"
+        bucket_name = get_s3_bucket_name()
+
+        multipart = s3_client.create_multipart_upload(
+            Bucket=bucket_name,
+            Key=s3_key,
+            ContentType=content_type,
+            ACL='private'
+        )
+
+        session = {
+            'userId': user_id,
+            'sessionId': session_id,
+            'fileId': file_id,
+            'filename': filename,
+            's3Key': s3_key,
+            'uploadId': multipart['UploadId'],
+            'contentType': content_type,
+            'folder': folder,
+            'fileSize': file_size,
+            'chunkSize': chunk_size,
+            'totalChunks': total_chunks,
+            'parts': {},
+            'createdAt': datetime.utcnow().isoformat(),
+            # Abandoned sessions are cleaned up by the table's TTL, and their
+            # S3 parts by the multipart upload sweeper; completed sessions
+            # stay until then too, to answer retried commits
+            'expiresAt': int(time.time()) + UPLOAD_SESSION_TTL
+        }
+        sessions_table.put_item(Item=session)
+
+        return jsonify(session_status(session)), 201
+
+    except Exception as e:
+        current_app.logger.error(f"Error creating upload session: {str(e)}")
+        return jsonify({'error': 'Failed to create upload session'}), 500
+
+@upload_bp.route('/<string:session_id>', methods=['GET'])
+@token_required
+def get_upload_session(session_id):
+    """
+    Report which chunks of an upload session are received and which are missing
+    """
+    try:
+        session = get_session(request.decoded_token['uid'], session_id)
+        if not session:
+            return jsonify({'error': 'Upload session not found'}), 404
+        return jsonify(session_status(session))
+
+    except Exception as e:
+        current_app.logger.error(f"Error reading upload session: {str(e)}")
+        return jsonify({'error': 'Failed to read upload session'}), 500
+
+@upload_bp.route('/<string:session_id>/chunks/<int:chunk_number>', methods=['PUT'])
+@token_required
+def upload_chunk(session_id, chunk_number):
+    """
+    Upload one chunk (the raw request body) of a resumable upload
+    """
+    try:
+        user_id = request.decoded_token['uid']
+        session = get_session(user_id, session_id)
+        if not session:
+            return jsonify({'error': 'Upload session not found'}), 404
+        if 'completedAt' in session:
+            return jsonify({'error': 'Upload already completed'}), 409
+
+        total_chunks = int(session['totalChunks'])
+        chunk_size = int(session['chunkSize'])
+        if chunk_number < 1 or chunk_number > total_chunks:
+            return jsonify({'error': f'Chunk number must be between 1 and {total_chunks}'}), 400
+
+        # Every chunk is full-sized except possibly the last one
+        if chunk_number < total_chunks:
+            expected_size = chunk_size
+        else:
+            expected_size = int(session['fileSize']) - chunk_size * (total_chunks - 1)
+
+        data = request.get_data(cache=False)
+        if len(data) != expected_size:
+            return jsonify({'error': f'Chunk {chunk_number} must be {expected_size} bytes, got {len(data)}'}), 400
+
+        # Check the per-chunk checksum here, and pass it on so S3 checks it too
+        content_md5 = base64.b64encode(hashlib.md5(data).digest()).decode('ascii')
+        client_md5 = request.headers.get('Content-MD5')
+        if not client_md5:
+            return jsonify({'error': 'Content-MD5 header is required'}), 400
+        if client_md5 != content_md5:
+            return jsonify({'error': 'Chunk checksum mismatch'}), 400
+
+        part = s3_client.upload_part(
+            Bucket=get_s3_bucket_name(),
+            Key=session['s3Key'],
+            UploadId=session['uploadId'],
+            PartNumber=chunk_number,
+            Body=data,
+            ContentMD5=content_md5
+        )
+
+        # Record the part. Chunks can arrive concurrently, so each one only
+        # sets its own entry in the parts map.
+        sessions_table.update_item(
+            Key={
+                'userId': user_id,
+                'sessionId': session_id
+            },
+            UpdateExpression='SET parts.#chunk = :part',
+            ConditionExpression='attribute_exists(sessionId)',
+            ExpressionAttributeNames={'#chunk': str(chunk_number)},
+            ExpressionAttributeValues={
+                ':part': {'etag': part['ETag'], 'md5': content_md5}
+            }
+        )
+
+        return jsonify({'chunk': chunk_number, 'md5': content_md5})
+
+    except Exception as e:
+        current_app.logger.error(f"Error uploading chunk: {str(e)}")
+        return jsonify({'error': 'Failed to upload chunk'}), 500
+
+@upload_bp.route('/<string:session_id>/complete', methods=['POST'])
+@token_required
+def complete_upload_session(session_id):
+    """
+    Commit a resumable upload once every chunk has been received
+    """
+    try:
+        user_id = request.decoded_token['uid']
+        session = get_session(user_id, session_id)
+        if not session:
+            return jsonify({'error': 'Upload session not found'}), 404
+        if 'completedAt' in session:
+            # A retry (e.g. after a client timeout): answer the same way
+            return completed_response(user_id, session)
+
+        status = session_status(session)
+        if status['missingChunks']:
+            return jsonify({'error': 'Upload is missing chunks', **status}), 409
+
+        # Other uploads may have used up the space since the session started
+        try:
+            quota = usage_store.check(user_id, int(session['fileSize']))
+        except QuotaExceeded as e:
+            return quota_exceeded_response(e)
+
+        size = int(session['fileSize'])
+        parts = session['parts']
+        try:
+            s3_client.complete_multipart_upload(
+                Bucket=get_s3_bucket_name(),
+                Key=session['s3Key'],
+                UploadId=session['uploadId'],
+                MultipartUpload={
+                    'Parts': [
+                        {'PartNumber': n, 'ETag': parts[str(n)]['etag']}
+                        for n in range(1, int(session['totalChunks']) + 1)
+                    ]
+                }
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'NoSuchUpload':
+                raise
+            # An earlier complete already assembled the object. If it also
+            # stored the file, answer the same way it did; if it failed
+            # before that, record the object it left behind now.
+            if table.get_item(
+                Key={'userId': user_id, 'fileId': session['fileId']},
+                ConsistentRead=True
+            ).get('Item'):
+                mark_completed(user_id, session_id)
+                return completed_response(user_id, session)
+            try:
+                size = s3_client.head_object(Bucket=get_s3_bucket_name(), Key=session['s3Key'])['ContentLength']
+            except ClientError as e:
+                if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                    raise
+                # Aborted instead (e.g. by the sweeper), so nothing to record
+                sessions_table.delete_item(Key={'userId': user_id, 'sessionId': session_id})
+                return jsonify({'error': 'Upload session expired, start the upload again'}), 410
+
+        # Store file metadata in DynamoDB, the same way upload_file does
+        current_time = datetime.utcnow().isoformat()
+        item = {
+            'userId': user_id,
+            'fileId': session['fileId'],
+            'filename': session['filename'],
+            's3Key': session['s3Key'],
+            'size': size,
+            'contentType': session['contentType'],
+            'uploadedAt': current_time,
+            'lastModified': current_time,
+            **folder_attributes(user_id, session.get('folder', ROOT))
+        }
+        actions = (
+            [{'Put': {'TableName': table.name, 'Item': item, 'ConditionExpression': 'attribute_not_exists(fileId)'}}] +
+            folder_store.aggregate_updates(user_id, item['folderPath'], 1, item['size']) +
+            [usage_store.update(user_id, 1, item['size'], quota)]
+        )
+        try:
+            usage_store.commit(actions)
+        except QuotaExceeded as e:
+            s3_client.delete_object(Bucket=get_s3_bucket_name(), Key=session['s3Key'])
+            sessions_table.delete_item(Key={'userId': user_id, 'sessionId': session_id})
+            return quota_exceeded_response(e)
+        except ClientError as e:
+            if cancellation_codes(e)[:1] != ['ConditionalCheckFailed']:
+                # The multipart upload is already completed, so a retry
+                # couldn't finish it: drop the object and the session
+                s3_client.delete_object(Bucket=get_s3_bucket_name(), Key=session['s3Key'])
+                sessions_table.delete_item(Key={'userId': user_id, 'sessionId': session_id})
+                if folder_store.rejected(e, actions):
+                    return folder_changed_response()
+                raise
+            # A concurrent complete already stored the file (and counted
+            # it); answer the same way it did
+            mark_completed(user_id, session_id)
+            return completed_response(user_id, session)
+        listing_cache.invalidate(user_id)
+        search_index.add(user_id, item)
+        change_feed.added(user_id, [listing_row(item)])
+        preview_pipeline.submit(user_id, session['fileId'], session['s3Key'], session['contentType'])
+
+        mark_completed(user_id, session_id)
+
+        return jsonify({
+            'message': 'File uploaded successfully',
+            'fileId': session['fileId'],
+            'filename': session['filename'],
+            'size': size,
+            'contentType': session['contentType']
+        })
+
+    except Exception as e:
+        current_app.logger.error(f"Error completing upload session: {str(e)}")
+        return jsonify({'error': 'Failed to complete upload'}), 500
+
+@upload_bp.route('/<string:session_id>', methods=['DELETE'])
+@token_required
+def abort_upload_session(session_id):
+    """
+    Cancel a resumable upload and discard its chunks
+    """
+    try:
+        user_id = request.decoded_token['uid']
+        session = get_session(user_id, session_id)
+        if not session:
+            return jsonify({'error': 'Upload session not found'}), 404
+        if 'completedAt' in session:
+            return jsonify({'error': 'Upload already completed'}), 409
+
+        try:
+            s3_client.abort_multipart_upload(
+                Bucket=get_s3_bucket_name(),
+                Key=session['s3Key'],
+                UploadId=session['uploadId']
+            )
+        except ClientError as e:
+            # Already completed or aborted, nothing left in S3
+            if e.response['Error']['Code'] != 'NoSuchUpload':
+                raise
+
+        sessions_table.delete_item(
+            Key={
+                'userId': user_id,
+                'sessionId': session_id
+            }
+        )
+
+        return jsonify({'message': 'Upload cancelled'})
+
+    except Exception as e:
+        current_app.logger.error(f"Error aborting upload session: {str(e)}")
+        return jsonify({'error': 'Failed to cancel upload'}), 500
@@ -0,0 +1,234 @@
+import json
+import uuid
+import logging
+import threading
+from decimal import Decimal
+from datetime import datetime
+from collections import deque
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Per-user change events, so open tabs and devices can patch their file
+# list instead of refetching it. An event is a small delta:
+#   {'seq': 7, 'type': 'added',   'files': [<listing row>, ...]}
+#   {'seq': 8, 'type': 'updated', 'files': [{'fileId': ..., <changed fields>}, ...]}
+#   {'seq': 9, 'type': 'removed', 'fileIds': [...]}
+#   {'seq': 10, 'type': 'moved',  'from': '/a/', 'to': '/b/a/'}   (a whole folder)
+# Sequence numbers count up per user within one broker epoch. A client
+# remembers the epoch and the last seq it applied and passes both back when
+# it reconnects; if the broker can't replay from there (new epoch, or the
+# events have aged out of the history) the client refetches its listing.
+
+
+def to_json(value):
+    # DynamoDB numbers come back as Decimal
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    return str(value)
+
+
+class LocalBroker:
+    """In-process broker. Only workers in this process see the events; use
+    RedisBroker when running several Flask workers."""
+
+    def __init__(self, history=500):
+        self.epoch = uuid.uuid4().hex
+        self.history = history
+        self._seq = {}
+        self._events = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def publish(self, user_id, event):
+        with self._lock:
+            seq = self._seq.get(user_id, 0) + 1
+            self._seq[user_id] = seq
+            event = {**event, 'seq': seq}
+            self._events.setdefault(user_id, deque(maxlen=self.history)).append(event)
+        self._deliver(user_id, event)
+        return event
+
+    def since(self, user_id, seq):
+        """Events after `seq`, or None if they are no longer all available"""
+        with self._lock:
+            events = list(self._events.get(user_id, ()))
+            current = self._seq.get(user_id, 0)
+        return replayable(events, seq, current)
+
+    def current_seq(self, user_id):
+        with self._lock:
+            return self._seq.get(user_id, 0)
+
+    def add_listener(self, callback):
+        """callback(user_id, event) is called for every event published to this broker"""
+        self._listeners.append(callback)
+
+    def _deliver(self, user_id, event):
+        for callback in self._listeners:
+            try:
+                callback(user_id, event)
+            except Exception as e:
+                logger.warning(f"Change listener failed: {str(e)}")
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class RedisBroker(LocalBroker):
+    """Broker on a Redis-compatible server, so every worker sees every event.
+
+    Sequence numbers come from INCR, the last `history` events per user are
+    kept in a capped list for replay, and each event is also PUBLISHed so a
+    subscriber thread in every worker can hand it to its own listeners.
+    """
+
+    def __init__(self, url, history=500, prefix='changes:', log_ttl=24 * 3600):
+        if redis is None:
+            raise ImportError("The redis package is required for a shared change feed (pip install redis)")
+        super().__init__(history=history)
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.log_ttl = log_ttl
+        # Shared by all workers; only changes if Redis loses its data
+        self.client.set(prefix + 'epoch', self.epoch, nx=True)
+        self.epoch = self.client.get(prefix + 'epoch').decode('ascii')
+        self._thread = None
+        self._pubsub = None
+
+    def publish(self, user_id, event):
+        seq = self.client.incr(f'{self.prefix}seq:{user_id}')
+        event = {**event, 'seq': seq}
+        payload = json.dumps(event, default=to_json)
+        log_key = f'{self.prefix}log:{user_id}'
+        pipe = self.client.pipeline()
+        pipe.rpush(log_key, payload)
+        pipe.ltrim(log_key, -self.history, -1)
+        pipe.expire(log_key, self.log_ttl)
+        pipe.publish(self.prefix + 'events', json.dumps({'userId': user_id, 'event': event}, default=to_json))
+        pipe.execute()
+        return event
+
+    def since(self, user_id, seq):
+        # Concurrent publishes can append slightly out of order
+        events = sorted(
+            (json.loads(payload) for payload in self.client.lrange(f'{self.prefix}log:{user_id}', 0, -1)),
+            key=lambda event: event['seq']
+        )
+        return replayable(events, seq, self.current_seq(user_id))
+
+    def current_seq(self, user_id):
+        value = self.client.get(f'{self.prefix}seq:{user_id}')
+        return int(value) if value is not None else 0
+
+    def start(self):
+        """Start handing events published by any worker to this worker's listeners"""
+        if self._thread is not None:
+            return
+        self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(self.prefix + 'events')
+        self._thread = threading.Thread(target=self._run, name='change-feed', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._pubsub is not None:
+            self._pubsub.close()
+
+    def _run(self):
+        for message in self._pubsub.listen():
+            try:
+                data = json.loads(message['data'])
+            except (TypeError, ValueError):
+                continue
+            self._deliver(data['userId'], data['event'])
+
+
+def replayable(events, seq, current):
+    """The events after `seq`, or None if the ones right after it are gone"""
+    if seq >= current:
+        return [] if seq == current else None
+    missed = [event for event in events if event['seq'] > seq]
+    if not missed or missed[0]['seq'] != seq + 1:
+        return None
+    return missed
+
+
+class ChangeFeed:
+    """Publishes file changes per user and replays them to reconnecting clients"""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self._lock = threading.Lock()
+        self.published = 0
+        self.failed = 0
+
+    @property
+    def epoch(self):
+        return self.broker.epoch
+
+    def publish(self, user_id, event_type, **delta):
+        """Publish one event. A broker failure is logged, never raised: the
+        write it describes has already happened, and clients catch up by
+        refetching when they notice a gap."""
+        # Round-trip through JSON so every broker and transport gets plain values
+        event = json.loads(json.dumps(
+            {'type': event_type, 'at': datetime.utcnow().isoformat(), **delta},
+            default=to_json
+        ))
+        try:
+            event = self.broker.publish(user_id, event)
+        except Exception as e:
+            logger.warning(f"Failed to publish a change for {user_id}: {str(e)}")
+            with self._lock:
+                self.failed += 1
+            return None
+        with self._lock:
+            self.published += 1
+        return event
+
+    def added(self, user_id, files):
+        return self.publish(user_id, 'added', files=files)
+
+    def updated(self, user_id, files):
+        return self.publish(user_id, 'updated', files=files)
+
+    def removed(self, user_id, file_ids):
+        return self.publish(user_id, 'removed', fileIds=list(file_ids))
+
+    def since(self, user_id, seq, epoch=None):
+        """Events to replay after (epoch, seq), or None if the client must refetch"""
+        if epoch is not None and epoch != self.broker.epoch:
+            return None
+        return self.broker.since(user_id, seq)
+
+    def current_seq(self, user_id):
+        return self.broker.current_seq(user_id)
+
+    def add_listener(self, callback):
+        self.broker.add_listener(callback)
+
+    def start(self):
+        self.broker.start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'broker': type(self.broker).__name__,
+                'epoch': self.broker.epoch,
+                'published': self.published,
+                'failed': self.failed
+            }
+
+
+def create_change_feed(url=None, history=500):
+    """Build a change feed: Redis if a redis:// URL is given, otherwise in-process"""
+    if url:
+        return ChangeFeed(RedisBroker(url, history=history))
+    return ChangeFeed(LocalBroker(history=history))
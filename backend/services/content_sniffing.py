@@ -0,0 +1,146 @@
+import struct
+
+# Content type detection from a file's first bytes, shared by the Flask API
+# (backend/services/content_sniffing.py) and the Lambda API
+# (lambda_deploy/content_sniffing.py). The two files are identical copies,
+# since Lambda packaging and Windows checkouts don't follow symlinks reliably;
+# change them together. Standard library only, so it runs in either place.
+
+
+def _bmp_header(head):
+    # Reserved fields are zero and the DIB header is one of the known sizes
+    if len(head) < 18 or head[6:10] != b'\x00\x00\x00\x00':
+        return False
+    return struct.unpack_from('<I', head, 14)[0] in (12, 16, 40, 52, 56, 64, 108, 124)
+
+
+def _pe_header(head):
+    # e_lfanew (at 0x3C) points at the "PE\0\0" signature of a real executable
+    if len(head) < 0x40:
+        return False
+    offset = struct.unpack_from('<I', head, 0x3C)[0]
+    return head[offset:offset + 4] == b'PE\x00\x00'
+
+
+def _id3_header(head):
+    # ID3v2.2-2.4 with a syncsafe tag size (every byte below 0x80)
+    return len(head) >= 10 and head[3] in (2, 3, 4) and head[4] != 0xFF and all(b < 0x80 for b in head[6:10])
+
+
+def _gzip_header(head):
+    # Deflate is the only compression method gzip defines
+    return len(head) >= 3 and head[2] == 8
+
+
+def _bzip2_header(head):
+    return len(head) >= 4 and head[3:4] in b'123456789'
+
+
+# (offset, signature, MIME type, check) for formats we can recognise from
+# their first bytes. A short signature is only trusted if its check of the
+# surrounding header passes.
+MAGIC_NUMBERS = [
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png', None),
+    (0, b'\xff\xd8\xff', 'image/jpeg', None),
+    (0, b'GIF87a', 'image/gif', None),
+    (0, b'GIF89a', 'image/gif', None),
+    (0, b'BM', 'image/bmp', _bmp_header),
+    (0, b'II*\x00', 'image/tiff', None),
+    (0, b'MM\x00*', 'image/tiff', None),
+    (0, b'%PDF-', 'application/pdf', None),
+    (0, b'PK\x03\x04', 'application/zip', None),
+    (0, b'\x1f\x8b', 'application/gzip', _gzip_header),
+    (0, b'BZh', 'application/x-bzip2', _bzip2_header),
+    (0, b'7z\xbc\xaf\x27\x1c', 'application/x-7z-compressed', None),
+    (0, b'Rar!\x1a\x07', 'application/vnd.rar', None),
+    (0, b'ID3', 'audio/mpeg', _id3_header),
+    (0, b'OggS', 'audio/ogg', None),
+    (0, b'fLaC', 'audio/flac', None),
+    (0, b'MZ', 'application/x-msdownload', _pe_header),
+    (0, b'\x7fELF', 'application/x-executable', None),
+]
+
+# Signatures short enough to occur at the start of ordinary text (e.g. "BMW
+# notes", "MZ..."). Even with their header check passing, they never
+# override a declared text/* type.
+WEAK_SIGNATURES = {b'BM', b'MZ', b'ID3', b'\x1f\x8b', b'BZh'}
+
+# Container formats identified by a second signature further in
+RIFF_TYPES = {
+    b'WEBP': 'image/webp',
+    b'WAVE': 'audio/wav',
+    b'AVI ': 'video/x-msvideo',
+}
+
+# ISO base media files (MP4, QuickTime, M4A, HEIF, AVIF, 3GP) all start with
+# an ftyp box, whose major brand says which of them it is
+FTYP_BRANDS = {
+    b'qt  ': 'video/quicktime',
+    b'M4A ': 'audio/mp4',
+    b'M4B ': 'audio/mp4',
+    b'heic': 'image/heic',
+    b'heix': 'image/heic',
+    b'heim': 'image/heic',
+    b'heis': 'image/heic',
+    b'mif1': 'image/heif',
+    b'msf1': 'image/heif',
+    b'avif': 'image/avif',
+    b'avis': 'image/avif',
+    b'3gp4': 'video/3gpp',
+    b'3gp5': 'video/3gpp',
+    b'3gp6': 'video/3gpp',
+    b'3g2a': 'video/3gpp2',
+}
+
+# Matroska and WebM share the EBML header; the DocType tells them apart
+EBML_MAGIC = b'\x1a\x45\xdf\xa3'
+
+# Containers that hold audio, video or images alike. A generic brand
+# (isom, mp42, ...) or doctype only tells us the container, so a declared
+# type from the same family is kept.
+CONTAINER_FAMILIES = [
+    {'video/mp4', 'audio/mp4', 'audio/x-m4a', 'video/quicktime', 'image/heic', 'image/heif', 'image/heic-sequence',
+     'image/heif-sequence', 'image/avif', 'video/3gpp', 'audio/3gpp', 'video/3gpp2', 'audio/3gpp2'},
+    {'video/webm', 'audio/webm', 'video/x-matroska', 'audio/x-matroska'},
+    {'audio/ogg', 'video/ogg', 'application/ogg', 'audio/opus'},
+]
+
+# Zip-based formats whose specific type the client knows better than we do
+ZIP_BASED_PREFIXES = ('application/vnd.openxmlformats', 'application/vnd.oasis', 'application/epub', 'application/java')
+
+
+def same_container(sniffed, declared):
+    return any(sniffed in family and declared in family for family in CONTAINER_FAMILIES)
+
+
+def sniff_content_type(head, declared=None):
+    """Pick a MIME type from the first bytes of a file.
+
+    A recognised signature wins over what the client declared, except that
+    a declared zip-based format (docx, xlsx, ...) is kept for a zip file, a
+    declared type in the same container family (audio/mp4 for an MP4
+    container, ...) is kept, and a declared text type is kept against a
+    weak signature. Otherwise the declared type is used, or
+    application/octet-stream.
+    """
+    head = bytes(head[:512])
+    declared = (declared or '').strip() or None
+    sniffed = None
+    if head[:4] == b'RIFF' and head[8:12] in RIFF_TYPES:
+        sniffed = RIFF_TYPES[head[8:12]]
+    elif head[4:8] == b'ftyp' and len(head) >= 12:
+        sniffed = FTYP_BRANDS.get(head[8:12], 'video/mp4')
+    elif head[:4] == EBML_MAGIC:
+        sniffed = 'video/webm' if b'webm' in head[:64] else 'video/x-matroska'
+    else:
+        for offset, signature, mime, check in MAGIC_NUMBERS:
+            if head[offset:offset + len(signature)] == signature and (check is None or check(head)):
+                if signature in WEAK_SIGNATURES and declared and declared.startswith('text/'):
+                    return declared
+                sniffed = mime
+                break
+    if sniffed == 'application/zip' and declared and declared.startswith(ZIP_BASED_PREFIXES):
+        return declared
+    if sniffed and declared and same_container(sniffed, declared.lower()):
+        return declared
+    return sniffed or declared or 'application/octet-stream'
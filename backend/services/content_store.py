@@ -0,0 +1,195 @@
+import uuid
+import hashlib
+import logging
+from datetime import datetime
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# Item in the blob table that holds the running dedup totals
+STATS_KEY = '__stats__'
+
+
+def content_key(user_id, content_hash):
+    """The blob key for one user's copy of some content.
+
+    Blobs are only shared between the files of one user. Sharing them
+    across users would let anyone find out whether somebody else stores a
+    given file, by uploading it and watching it get deduplicated.
+    """
+    return f"{user_id}/{content_hash}"
+
+
+class ContentStore:
+    """Content-addressed blob storage with reference counting.
+
+    Each distinct content key (see content_key) maps to one S3 object,
+    recorded in a DynamoDB table (partition key `contentHash`) with a
+    refCount. Uploading
+    bytes that are already stored only increments the count, and releasing
+    the last reference deletes the object.
+
+    Race safety comes from two rules: a count can only be incremented while
+    it is above zero, and every new blob gets a fresh key
+    (blobs/<key>/<uuid>). So once a blob's count reaches zero its object is
+    unreachable and can be deleted without coordination, even if someone
+    uploads the same bytes again at the same moment (they get a new object).
+    """
+
+    def __init__(self, s3_client, dynamodb, table_name):
+        self.s3_client = s3_client
+        self.table = dynamodb.Table(table_name)
+
+    @staticmethod
+    def hash_stream(stream, chunk_size=1024 * 1024):
+        """Read a seekable stream once, returning (sha256 hex, size), then rewind it"""
+        digest = hashlib.sha256()
+        size = 0
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+        stream.seek(0)
+        return digest.hexdigest(), size
+
+    def _add_reference(self, content_hash):
+        """Increment a live blob's count; return its S3 key, or None if there is no live blob"""
+        try:
+            response = self.table.update_item(
+                Key={'contentHash': content_hash},
+                UpdateExpression='ADD refCount :one',
+                ConditionExpression='refCount > :zero',
+                ExpressionAttributeValues={':one': 1, ':zero': 0},
+                ReturnValues='ALL_NEW'
+            )
+            return response['Attributes']['s3Key']
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return None
+            raise
+
+    def store(self, stream, bucket, upload, content_hash=None, size=None):
+        """Store the content of `stream`, writing to S3 only if it isn't stored yet.
+
+        `upload(stream, bucket, key)` performs the actual S3 write.
+        `content_hash` is the blob's content key (content_key); without one
+        the stream is hashed and the bare hash is used. Returns a dict with
+        contentHash, s3Key, size and deduplicated.
+        """
+        if content_hash is None:
+            content_hash, size = self.hash_stream(stream)
+
+        s3_key = self._add_reference(content_hash)
+        if s3_key is not None:
+            self._record(logical=size, stored=0, hits=1)
+            return {'contentHash': content_hash, 's3Key': s3_key, 'size': size, 'deduplicated': True}
+
+        s3_key = f"blobs/{content_hash}/{uuid.uuid4()}"
+        upload(stream, bucket, s3_key)
+        while True:
+            try:
+                # Claim the hash, replacing a dead (zero count) blob if there is one
+                response = self.table.put_item(
+                    Item={
+                        'contentHash': content_hash,
+                        's3Key': s3_key,
+                        'size': size,
+                        'refCount': 1,
+                        'createdAt': datetime.utcnow().isoformat()
+                    },
+                    ConditionExpression='attribute_not_exists(contentHash) OR refCount = :zero',
+                    ExpressionAttributeValues={':zero': 0},
+                    ReturnValues='ALL_OLD'
+                )
+                old = response.get('Attributes')
+                if old:
+                    # Its releaser may have crashed before deleting the object
+                    self._delete_object(bucket, old['s3Key'])
+                self._record(logical=size, stored=size, hits=0)
+                return {'contentHash': content_hash, 's3Key': s3_key, 'size': size, 'deduplicated': False}
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+            # A concurrent upload of the same bytes won; share its blob and drop ours
+            existing_key = self._add_reference(content_hash)
+            if existing_key is not None:
+                self._delete_object(bucket, s3_key)
+                self._record(logical=size, stored=0, hits=1)
+                return {'contentHash': content_hash, 's3Key': existing_key, 'size': size, 'deduplicated': True}
+
+    def release(self, bucket, content_hash):
+        """Drop one reference to a blob, deleting the object when it was the last one.
+
+        Returns True if the blob was garbage collected.
+        """
+        try:
+            response = self.table.update_item(
+                Key={'contentHash': content_hash},
+                UpdateExpression='ADD refCount :minus_one',
+                ConditionExpression='refCount > :zero',
+                ExpressionAttributeValues={':minus_one': -1, ':zero': 0},
+                ReturnValues='ALL_NEW'
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                logger.warning(f"Blob {content_hash} has no references left to release")
+                return False
+            raise
+
+        blob = response['Attributes']
+        size = int(blob.get('size', 0))
+        if blob['refCount'] > 0:
+            self._record(logical=-size, stored=0)
+            return False
+
+        # Nothing can reference this object again, so delete it first and
+        # only then the row (which a new upload may already have replaced)
+        self._delete_object(bucket, blob['s3Key'])
+        try:
+            self.table.delete_item(
+                Key={'contentHash': content_hash},
+                ConditionExpression='refCount = :zero AND s3Key = :key',
+                ExpressionAttributeValues={':zero': 0, ':key': blob['s3Key']}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+        self._record(logical=-size, stored=-size)
+        return True
+
+    def _delete_object(self, bucket, s3_key):
+        try:
+            self.s3_client.delete_object(Bucket=bucket, Key=s3_key)
+        except ClientError as e:
+            logger.warning(f"Failed to delete blob {s3_key}: {str(e)}")
+
+    def _record(self, logical, stored, hits=None):
+        """Update the shared dedup totals; a failure here never fails the upload"""
+        update = 'ADD logicalBytes :logical, storedBytes :stored'
+        values = {':logical': logical, ':stored': stored}
+        if hits is not None:
+            update += ', uploads :one, hits :hits'
+            values.update({':one': 1, ':hits': hits})
+        try:
+            self.table.update_item(
+                Key={'contentHash': STATS_KEY},
+                UpdateExpression=update,
+                ExpressionAttributeValues=values
+            )
+        except ClientError as e:
+            logger.warning(f"Failed to update dedup stats: {str(e)}")
+
+    def stats(self):
+        item = self.table.get_item(Key={'contentHash': STATS_KEY}).get('Item', {})
+        logical = int(item.get('logicalBytes', 0))
+        stored = int(item.get('storedBytes', 0))
+        return {
+            'uploads': int(item.get('uploads', 0)),
+            'hits': int(item.get('hits', 0)),
+            'logicalBytes': logical,
+            'storedBytes': stored,
+            'bytesSaved': logical - stored,
+            'dedupRatio': (logical / stored) if stored else 1.0
+        }
@@ -0,0 +1,270 @@
+import zlib
+import math
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# S3 multipart limits: every part but the last must be at least 5MB, and
+# UploadPartCopy copies at most 5GB per part
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_COPY_PART_SIZE = 5 * 1024 * 1024 * 1024
+
+MIN_BLOCK_SIZE = 64 * 1024
+MAX_BLOCK_SIZE = 8 * 1024 * 1024
+
+ADLER_MOD = 65521
+
+
+def default_block_size(file_size):
+    """rsync-style block size: about sqrt(size), rounded to a power of two and clamped"""
+    if file_size <= 0:
+        return MIN_BLOCK_SIZE
+    size = 1 << max(0, math.ceil(math.log2(math.sqrt(file_size))))
+    return max(MIN_BLOCK_SIZE, min(MAX_BLOCK_SIZE, size))
+
+
+def strong_hash(block):
+    return hashlib.blake2b(block, digest_size=16).hexdigest()
+
+
+def block_signatures(body, block_size):
+    """Read a stream block by block and return [[weak, strong], ...].
+
+    The weak checksum is Adler-32, which a client can roll one byte at a
+    time to find matching blocks at any offset; the strong hash confirms a
+    match.
+    """
+    signatures = []
+    pending = b''
+    for chunk in body.iter_chunks(block_size):
+        pending += chunk
+        while len(pending) >= block_size:
+            block, pending = pending[:block_size], pending[block_size:]
+            signatures.append([zlib.adler32(block), strong_hash(block)])
+    if pending:
+        signatures.append([zlib.adler32(pending), strong_hash(pending)])
+    return signatures
+
+
+def build_delta(signatures, block_size, data):
+    """Reference client side of the protocol: diff `data` against a file's signatures.
+
+    Returns (ops, literal) where `ops` is the recipe to send and `literal`
+    the bytes of the changed regions, in order. Copy ops reference runs of
+    blocks of the existing file; data ops consume bytes from `literal`.
+    """
+    blocks_by_weak = {}
+    for index, (weak, strong) in enumerate(signatures):
+        blocks_by_weak.setdefault(weak, []).append((strong, index))
+
+    ops = []
+    literal = bytearray()
+    literal_start = 0
+    position = 0
+    window = data[:block_size]
+    weak = zlib.adler32(window)
+    a, b = weak & 0xffff, weak >> 16
+
+    def emit_literal(end):
+        if end > literal_start:
+            literal.extend(data[literal_start:end])
+            if ops and 'data' in ops[-1]:
+                ops[-1]['data'] += end - literal_start
+            else:
+                ops.append({'data': end - literal_start})
+
+    while position < len(data):
+        length = min(block_size, len(data) - position)
+        match = None
+        for strong, index in blocks_by_weak.get(weak, ()):
+            if strong == strong_hash(data[position:position + length]):
+                match = index
+                break
+
+        if match is not None:
+            emit_literal(position)
+            if ops and 'copy' in ops[-1] and ops[-1]['copy'] + ops[-1]['blocks'] == match:
+                ops[-1]['blocks'] += 1
+            else:
+                ops.append({'copy': match, 'blocks': 1})
+            position += length
+            literal_start = position
+            weak = zlib.adler32(data[position:position + block_size])
+            a, b = weak & 0xffff, weak >> 16
+            continue
+
+        # Roll the window forward one byte
+        out_byte = data[position]
+        if position + block_size < len(data):
+            in_byte = data[position + block_size]
+            a = (a - out_byte + in_byte) % ADLER_MOD
+            b = (b - length * out_byte + a - 1) % ADLER_MOD
+        else:
+            # The window shrinks at the end of the data
+            a = (a - out_byte) % ADLER_MOD
+            b = (b - length * out_byte - 1) % ADLER_MOD
+        weak = (b << 16) | a
+        position += 1
+
+    emit_literal(len(data))
+    return ops, bytes(literal)
+
+
+def normalize_recipe(ops, block_size, source_size):
+    """Validate a recipe and turn it into ('copy', offset, length) / ('data', length) segments"""
+    segments = []
+    total = 0
+    for op in ops:
+        if not isinstance(op, dict):
+            raise ValueError("Each recipe op must be an object")
+        if 'copy' in op:
+            start, count = op['copy'], op.get('blocks', 1)
+            if not isinstance(start, int) or not isinstance(count, int) or start < 0 or count < 1:
+                raise ValueError("copy ops need a non-negative block index and a positive block count")
+            offset = start * block_size
+            if offset >= source_size:
+                raise ValueError(f"Block {start} is past the end of the file")
+            length = min(count * block_size, source_size - offset)
+            # Merge with the previous copy when the source ranges are contiguous
+            if segments and segments[-1][0] == 'copy' and segments[-1][1] + segments[-1][2] == offset:
+                segments[-1] = ('copy', segments[-1][1], segments[-1][2] + length)
+            else:
+                segments.append(('copy', offset, length))
+        elif 'data' in op:
+            length = op['data']
+            if not isinstance(length, int) or length < 1:
+                raise ValueError("data ops need a positive length")
+            segments.append(('data', length))
+        else:
+            raise ValueError("Unknown recipe op")
+        total += length
+    return segments, total
+
+
+class DeltaAssembler:
+    """Builds a new object from ranges of an existing one plus new bytes.
+
+    Unchanged ranges of at least 5MB are copied inside S3 with
+    UploadPartCopy, so they never pass through this server. Smaller copied
+    ranges and the new bytes are gathered into parts of `part_size` and
+    uploaded normally (short copied ranges are fetched with a ranged GET).
+    """
+
+    def __init__(self, s3_client, bucket, source_key, target_key, part_size=8 * 1024 * 1024, extra_args=None):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.source_key = source_key
+        self.target_key = target_key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.extra_args = extra_args or {}
+        self.stats = {'copiedBytes': 0, 'uploadedBytes': 0, 'literalBytes': 0, 'fetchedBytes': 0}
+        self._buffer = bytearray()
+        self._parts = []
+        self._upload_id = None
+
+    def _read_range(self, offset, length):
+        response = self.s3_client.get_object(
+            Bucket=self.bucket,
+            Key=self.source_key,
+            Range=f"bytes={offset}-{offset + length - 1}"
+        )
+        data = response['Body'].read()
+        self.stats['fetchedBytes'] += len(data)
+        return data
+
+    def _upload_buffer(self, size):
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        part_number = len(self._parts) + 1
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket,
+            Key=self.target_key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            Body=data
+        )
+        self._parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+        self.stats['uploadedBytes'] += len(data)
+
+    def _flush_full_parts(self):
+        while len(self._buffer) >= self.part_size:
+            self._upload_buffer(self.part_size)
+
+    def _copy(self, offset, length):
+        # Top the buffer up to a valid part size from the start of the range
+        if self._buffer:
+            need = min(length, max(0, MIN_PART_SIZE - len(self._buffer)))
+            if need:
+                self._buffer.extend(self._read_range(offset, need))
+                offset += need
+                length -= need
+            if length < MIN_PART_SIZE:
+                # Too short to stand alone as a part, so it joins the buffer
+                if length:
+                    self._buffer.extend(self._read_range(offset, length))
+                self._flush_full_parts()
+                return
+            self._upload_buffer(len(self._buffer))
+
+        while length >= MIN_PART_SIZE:
+            size = min(length, MAX_COPY_PART_SIZE)
+            part_number = len(self._parts) + 1
+            response = self.s3_client.upload_part_copy(
+                Bucket=self.bucket,
+                Key=self.target_key,
+                UploadId=self._upload_id,
+                PartNumber=part_number,
+                CopySource={'Bucket': self.bucket, 'Key': self.source_key},
+                CopySourceRange=f"bytes={offset}-{offset + size - 1}"
+            )
+            self._parts.append({'PartNumber': part_number, 'ETag': response['CopyPartResult']['ETag']})
+            self.stats['copiedBytes'] += size
+            offset += size
+            length -= size
+        if length:
+            self._buffer.extend(self._read_range(offset, length))
+
+    def _data(self, stream, length):
+        remaining = length
+        while remaining > 0:
+            chunk = stream.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                raise ValueError("Delta data ended before the recipe did")
+            self._buffer.extend(chunk)
+            remaining -= len(chunk)
+            self._flush_full_parts()
+        self.stats['literalBytes'] += length
+
+    def assemble(self, segments, stream):
+        """Run the recipe, reading new bytes from `stream`; returns transfer stats"""
+        self._upload_id = self.s3_client.create_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.target_key,
+            **self.extra_args
+        )['UploadId']
+        try:
+            for segment in segments:
+                if segment[0] == 'copy':
+                    self._copy(segment[1], segment[2])
+                else:
+                    self._data(stream, segment[1])
+            if stream.read(1):
+                raise ValueError("Delta data is longer than the recipe")
+            # The last part may be any size, including empty for an empty file
+            if self._buffer or not self._parts:
+                self._upload_buffer(len(self._buffer))
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.target_key,
+                UploadId=self._upload_id,
+                MultipartUpload={'Parts': self._parts}
+            )
+        except BaseException:
+            try:
+                self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.target_key, UploadId=self._upload_id)
+            except Exception as e:
+                logger.error(f"Failed to abort delta upload for {self.target_key}: {str(e)}")
+            raise
+        logger.info(f"Assembled {self.target_key}: {self.stats}")
+        return self.stats
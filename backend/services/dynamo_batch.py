@@ -0,0 +1,107 @@
+import time
+from botocore.exceptions import ClientError
+
+# DynamoDB limits per batch request
+BATCH_GET_LIMIT = 100
+BATCH_WRITE_LIMIT = 25
+
+
+def backoff_delays(max_retries, base_delay=0.05, max_delay=2.0):
+    """Exponential backoff delays for retrying unprocessed batch items"""
+    for attempt in range(max_retries):
+        yield min(max_delay, base_delay * (2 ** attempt))
+
+
+def batch_get_items(dynamodb, table_name, keys, projection=None, names=None, max_retries=5, consistent=False):
+    """Fetch many items with BatchGetItem, retrying unprocessed keys with backoff.
+
+    `keys` may be longer than the 100-key limit; it is split into batches.
+    Returns the items found (in no particular order). Pass `consistent` when
+    the items feed conditional writes that must see the latest version.
+    """
+    items = []
+    for start in range(0, len(keys), BATCH_GET_LIMIT):
+        request = {'Keys': keys[start:start + BATCH_GET_LIMIT]}
+        if projection:
+            request['ProjectionExpression'] = projection
+        if names:
+            request['ExpressionAttributeNames'] = names
+        if consistent:
+            request['ConsistentRead'] = True
+
+        pending = {table_name: request}
+        delays = backoff_delays(max_retries)
+        while pending:
+            response = dynamodb.batch_get_item(RequestItems=pending)
+            items.extend(response.get('Responses', {}).get(table_name, []))
+            pending = response.get('UnprocessedKeys') or {}
+            if pending:
+                delay = next(delays, None)
+                if delay is None:
+                    raise RuntimeError(f"BatchGetItem left {len(pending[table_name]['Keys'])} keys unprocessed")
+                time.sleep(delay)
+    return items
+
+
+def _batch_write(dynamodb, table_name, requests, max_retries):
+    """Send write requests 25 at a time, returning the ones still unprocessed after all retries"""
+    failed = []
+    for start in range(0, len(requests), BATCH_WRITE_LIMIT):
+        pending = {table_name: requests[start:start + BATCH_WRITE_LIMIT]}
+        delays = backoff_delays(max_retries)
+        while pending:
+            response = dynamodb.batch_write_item(RequestItems=pending)
+            pending = response.get('UnprocessedItems') or {}
+            if pending:
+                delay = next(delays, None)
+                if delay is None:
+                    failed.extend(pending[table_name])
+                    break
+                time.sleep(delay)
+    return failed
+
+
+def batch_delete_items(dynamodb, table_name, keys, max_retries=5):
+    """Delete many items with BatchWriteItem, retrying unprocessed items with backoff.
+
+    Returns the keys that were still unprocessed after all retries.
+    """
+    requests = [{'DeleteRequest': {'Key': key}} for key in keys]
+    return [request['DeleteRequest']['Key'] for request in _batch_write(dynamodb, table_name, requests, max_retries)]
+
+
+def batch_put_items(dynamodb, table_name, items, max_retries=5):
+    """Write many whole items with BatchWriteItem, retrying unprocessed items with backoff.
+
+    Returns the items that were still unprocessed after all retries.
+    """
+    requests = [{'PutRequest': {'Item': item}} for item in items]
+    return [request['PutRequest']['Item'] for request in _batch_write(dynamodb, table_name, requests, max_retries)]
+
+
+def transact_write(client, actions, max_retries=5):
+    """TransactWriteItems, retried with backoff when a concurrent transaction on the same items cancelled it.
+
+    Writes by one user share their usage and folder rows, so two uploads
+    at once can conflict. Cancellations for any other reason (a failed
+    condition in particular) are raised straight away.
+    """
+    delays = backoff_delays(max_retries)
+    while True:
+        try:
+            return client.transact_write_items(TransactItems=actions)
+        except ClientError as e:
+            codes = cancellation_codes(e)
+            if 'TransactionConflict' not in codes or 'ConditionalCheckFailed' in codes:
+                raise
+            delay = next(delays, None)
+            if delay is None:
+                raise
+            time.sleep(delay)
+
+
+def cancellation_codes(error):
+    """For a cancelled TransactWriteItems, the failure code of each action in order ('None' if it was fine)"""
+    if error.response['Error']['Code'] != 'TransactionCanceledException':
+        return []
+    return [reason.get('Code', 'None') for reason in error.response.get('CancellationReasons', [])]
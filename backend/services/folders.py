@@ -0,0 +1,589 @@
+import logging
+from datetime import datetime
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from services.dynamo_batch import batch_delete_items, batch_put_items, cancellation_codes, transact_write
+
+logger = logging.getLogger(__name__)
+
+# Folders are stored as materialized paths: "/" is the root and every other
+# folder is "/name/.../" (always with the trailing slash, so a subtree is a
+# plain prefix). The folders table has one row per folder:
+#   partition key userId (S), sort key path (S)
+#   LSI userId-parentPath-index (sort key parentPath, S) for listing subfolders
+# Rows carry subtreeFileCount / subtreeSize, the totals over the folder and
+# everything below it, kept up to date with ADD on every change. Those ADDs
+# are conditional on the folder row existing and not being moved (a folder
+# being moved has movingTo set), so a write racing a move or a delete fails
+# instead of updating a row that is about to go away.
+#
+# File rows in UserFiles get folderPath plus parentKey = "<userId>#<folderPath>",
+# the partition key of a GSI that makes listing one folder a bounded Query:
+#   parentKey-filename-index  (partition key parentKey, S; sort key filename, S)
+ROOT = '/'
+SUBFOLDER_INDEX = 'userId-parentPath-index'
+FOLDER_FILES_INDEX = 'parentKey-filename-index'
+
+MAX_FOLDER_DEPTH = 32
+MAX_FOLDER_NAME_LENGTH = 255
+
+# DynamoDB TransactWriteItems accepts at most 100 actions
+TRANSACTION_LIMIT = 100
+
+# Condition for writes that rely on a (non-root) folder row staying put
+FOLDER_WRITABLE = 'attribute_exists(parentPath) AND attribute_not_exists(movingTo)'
+
+
+class FolderConflict(Exception):
+    """The folder already exists, isn't empty, or can't be moved where asked"""
+
+
+def normalize_path(path):
+    """Turn "a/b", "/a/b" or "/a//b/" into "/a/b/"; raises ValueError if it isn't a valid folder path"""
+    if not isinstance(path, str):
+        raise ValueError("Folder path must be a string")
+    names = [name for name in path.split('/') if name]
+    if len(names) > MAX_FOLDER_DEPTH:
+        raise ValueError(f"Folders can be at most {MAX_FOLDER_DEPTH} levels deep")
+    for name in names:
+        if name in ('.', '..') or len(name) > MAX_FOLDER_NAME_LENGTH or any(ord(c) < 32 for c in name):
+            raise ValueError(f"Invalid folder name: {name!r}")
+    return ROOT + ''.join(f"{name}/" for name in names)
+
+
+def parent_of(path):
+    return path[:path.rstrip('/').rfind('/') + 1]
+
+
+def name_of(path):
+    return path.rstrip('/').rsplit('/', 1)[-1]
+
+
+def ancestors_of(path):
+    """The path itself and every folder above it, up to and including the root"""
+    paths = [path]
+    while path != ROOT:
+        path = parent_of(path)
+        paths.append(path)
+    return paths
+
+
+def depth_of(path):
+    return path.count('/') - 1
+
+
+def folder_attributes(user_id, path):
+    """The attributes that place a file row in a folder"""
+    return {'folderPath': path, 'parentKey': f"{user_id}#{path}"}
+
+
+def placement_condition(item):
+    """Condition that a file row is still in the folder and of the size `item`
+    says, for writes that change those folders' totals. Uses #size."""
+    conditions, values = [], {}
+    for attribute, name, placeholder in (('folderPath', 'folderPath', ':old_folder'), ('size', '#size', ':old_size')):
+        if attribute in item:
+            conditions.append(f'{name} = {placeholder}')
+            values[placeholder] = item[attribute]
+        else:
+            conditions.append(f'attribute_not_exists({name})')
+    return ' AND '.join(conditions), values
+
+
+class FolderStore:
+    """Folder rows plus the folder placement of file rows.
+
+    Moving or renaming a folder only rewrites metadata: the folder rows of
+    the subtree and the parentKey of the files in it. S3 keys don't contain
+    the folder, so no object is ever copied.
+    """
+
+    def __init__(self, dynamodb, table_name, files_table):
+        self.dynamodb = dynamodb
+        # The resource's client takes plain Python values, like Table does
+        self.client = dynamodb.meta.client
+        self.table = dynamodb.Table(table_name)
+        self.files_table = files_table
+
+    def get(self, user_id, path):
+        """Fetch a folder row, or None if the folder doesn't exist (the root always does)"""
+        item = self.table.get_item(
+            Key={'userId': user_id, 'path': path},
+            ConsistentRead=True
+        ).get('Item')
+        if path == ROOT:
+            return item or {'userId': user_id, 'path': ROOT, 'subtreeFileCount': 0, 'subtreeSize': 0}
+        # A late aggregate update can recreate a bare row for a folder that
+        # was just moved or deleted; only rows with a parentPath are folders
+        if item is None or 'parentPath' not in item:
+            return None
+        return item
+
+    def exists(self, user_id, path):
+        return path == ROOT or self.get(user_id, path) is not None
+
+    def create(self, user_id, path):
+        """Create a folder under an existing parent; raises LookupError or FolderConflict"""
+        if path == ROOT:
+            raise FolderConflict("The root folder always exists")
+        parent = parent_of(path)
+        if not self.exists(user_id, parent):
+            raise LookupError(f"Parent folder {parent} does not exist")
+        now = datetime.utcnow().isoformat()
+        actions = [{
+            'Update': {
+                'TableName': self.table.name,
+                'Key': {'userId': user_id, 'path': path},
+                'UpdateExpression': 'SET #name = :name, parentPath = :parent, createdAt = :now '
+                                    'ADD subtreeFileCount :zero, subtreeSize :zero',
+                'ConditionExpression': 'attribute_not_exists(parentPath)',
+                'ExpressionAttributeNames': {'#name': 'name'},
+                'ExpressionAttributeValues': {':name': name_of(path), ':parent': parent, ':now': now, ':zero': 0}
+            }
+        }]
+        if parent != ROOT:
+            # The parent must still be there, and not be in the middle of a
+            # move that wouldn't take the new folder along
+            actions.append({
+                'ConditionCheck': {
+                    'TableName': self.table.name,
+                    'Key': {'userId': user_id, 'path': parent},
+                    'ConditionExpression': FOLDER_WRITABLE
+                }
+            })
+        try:
+            transact_write(self.client, actions)
+        except ClientError as e:
+            codes = cancellation_codes(e)
+            if codes[:1] == ['ConditionalCheckFailed']:
+                raise FolderConflict(f"Folder {path} already exists")
+            if 'ConditionalCheckFailed' in codes:
+                raise FolderConflict(f"Parent folder {parent} was moved or deleted")
+            raise
+        return self.get(user_id, path)
+
+    def delete(self, user_id, path):
+        """Delete an empty folder; raises LookupError or FolderConflict"""
+        if path == ROOT:
+            raise FolderConflict("The root folder can't be deleted")
+        if self.list_subfolders(user_id, path, limit=1):
+            raise FolderConflict(f"Folder {path} has subfolders")
+        try:
+            self.table.delete_item(
+                Key={'userId': user_id, 'path': path},
+                ConditionExpression=f'{FOLDER_WRITABLE} AND '
+                                    '(attribute_not_exists(subtreeFileCount) OR subtreeFileCount = :zero)',
+                ExpressionAttributeValues={':zero': 0},
+                ReturnValuesOnConditionCheckFailure='ALL_OLD'
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                if 'parentPath' not in e.response.get('Item', {}):
+                    raise LookupError(f"Folder {path} does not exist")
+                if 'movingTo' in e.response['Item']:
+                    raise FolderConflict(f"Folder {path} is being moved")
+                raise FolderConflict(f"Folder {path} is not empty")
+            raise
+
+    def list_subfolders(self, user_id, path, limit=None):
+        query_args = {
+            'IndexName': SUBFOLDER_INDEX,
+            'KeyConditionExpression': Key('userId').eq(user_id) & Key('parentPath').eq(path)
+        }
+        folders = []
+        while True:
+            if limit:
+                query_args['Limit'] = limit - len(folders)
+            response = self.table.query(**query_args)
+            folders.extend(response.get('Items', []))
+            if 'LastEvaluatedKey' not in response or (limit and len(folders) >= limit):
+                break
+            query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        return folders
+
+    def list_files(self, user_id, path, limit, start_key=None, forward=True):
+        """One page of a folder's available files, by name; returns (items, last evaluated key)"""
+        query_args = {
+            'IndexName': FOLDER_FILES_INDEX,
+            'KeyConditionExpression': 'parentKey = :parentKey',
+            'FilterExpression': 'attribute_not_exists(#status) OR #status = :available',
+            'ExpressionAttributeNames': {'#status': 'status'},
+            'ExpressionAttributeValues': {
+                ':parentKey': folder_attributes(user_id, path)['parentKey'],
+                ':available': 'available'
+            },
+            'ScanIndexForward': forward,
+            'Limit': limit
+        }
+        if start_key:
+            query_args['ExclusiveStartKey'] = start_key
+        response = self.files_table.query(**query_args)
+        return response.get('Items', []), response.get('LastEvaluatedKey')
+
+    def _folder_file_rows(self, user_id, path):
+        """Every file row placed in a folder (in any status), for moving them"""
+        query_args = {
+            'IndexName': FOLDER_FILES_INDEX,
+            'KeyConditionExpression': 'parentKey = :parentKey',
+            'ExpressionAttributeValues': {':parentKey': folder_attributes(user_id, path)['parentKey']}
+        }
+        while True:
+            response = self.files_table.query(**query_args)
+            yield from response.get('Items', [])
+            if 'LastEvaluatedKey' not in response:
+                break
+            query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def aggregate_updates(self, user_id, path, files, size):
+        """TransactWriteItems actions that add files/size to a folder and every folder above it.
+
+        Returned separately so callers can commit them in the same
+        transaction as the file change itself. The transaction fails if a
+        folder other than the root was moved or deleted meanwhile (see
+        `rejected`).
+        """
+        return [self._total_update(user_id, folder, files, size) for folder in ancestors_of(path)]
+
+    def combined_updates(self, user_id, totals):
+        """aggregate_updates for several folders at once, from {path: (files, size)}.
+
+        A transaction can't update the same folder row twice, so the totals
+        of shared ancestors are summed into one action per folder.
+        """
+        combined = {}
+        for path, (files, size) in totals.items():
+            for folder in ancestors_of(path):
+                folder_files, folder_size = combined.get(folder, (0, 0))
+                combined[folder] = (folder_files + files, folder_size + size)
+        return [
+            self._total_update(user_id, folder, files, size)
+            for folder, (files, size) in combined.items() if files or size
+        ]
+
+    def _total_update(self, user_id, folder, files, size):
+        update = {
+            'TableName': self.table.name,
+            'Key': {'userId': user_id, 'path': folder},
+            'UpdateExpression': 'ADD subtreeFileCount :files, subtreeSize :size',
+            'ExpressionAttributeValues': {':files': files, ':size': size}
+        }
+        # The root's row is created by its first update; any other folder
+        # must exist and not be moving
+        if folder != ROOT:
+            update['ConditionExpression'] = FOLDER_WRITABLE
+        return {'Update': update}
+
+    def rejected(self, error, actions):
+        """Whether a cancelled transaction failed because a folder in it was moved or deleted meanwhile"""
+        return any(
+            code == 'ConditionalCheckFailed' and action.get('Update', {}).get('TableName') == self.table.name
+            for action, code in zip(actions, cancellation_codes(error))
+        )
+
+    def adjust(self, user_id, path, files, size):
+        """Add to (or, with negative numbers, take from) the totals of a folder and its ancestors"""
+        if not files and not size:
+            return
+        self.client.transact_write_items(TransactItems=self.aggregate_updates(user_id, path, files, size))
+
+    def _move_row(self, user_id, item, target):
+        """A conditional update that re-points one file row of a folder being moved"""
+        values = {
+            ':path': target,
+            ':parentKey': folder_attributes(user_id, target)['parentKey']
+        }
+        if 'parentKey' in item:
+            # Only move it if nobody else has moved it meanwhile
+            condition = 'parentKey = :old'
+            values[':old'] = item['parentKey']
+        else:
+            condition = 'attribute_exists(fileId) AND attribute_not_exists(parentKey)'
+        return {
+            'Update': {
+                'TableName': self.files_table.name,
+                'Key': {'userId': user_id, 'fileId': item['fileId']},
+                'UpdateExpression': 'SET folderPath = :path, parentKey = :parentKey',
+                'ConditionExpression': condition,
+                'ExpressionAttributeValues': values
+            }
+        }
+
+    def _move_rows(self, user_id, items, target):
+        """Point file rows at another folder, 100 per transaction; returns the items that moved"""
+        moved = []
+        for start in range(0, len(items), TRANSACTION_LIMIT):
+            chunk = items[start:start + TRANSACTION_LIMIT]
+            try:
+                self.client.transact_write_items(
+                    TransactItems=[self._move_row(user_id, item, target) for item in chunk]
+                )
+                moved.extend(chunk)
+                continue
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'TransactionCanceledException':
+                    raise
+            # Some row in the chunk changed meanwhile, so move the rest one by one
+            for item in chunk:
+                try:
+                    self.client.update_item(**self._move_row(user_id, item, target)['Update'])
+                    moved.append(item)
+                except ClientError as e:
+                    if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                        raise
+        return moved
+
+    def _move_file_actions(self, user_id, items, target):
+        """The row updates that move live files into `target`, plus the folder total shifts, for one transaction.
+
+        Each row update is conditional on the file still being live, in the
+        folder and of the size it was read with, so the shifts always match
+        what actually moved. Shared ancestors would net to zero and are left
+        alone.
+        """
+        actions = []
+        totals = {}
+        for item in items:
+            placement, values = placement_condition(item)
+            actions.append({
+                'Update': {
+                    'TableName': self.files_table.name,
+                    'Key': {'userId': user_id, 'fileId': item['fileId']},
+                    'UpdateExpression': 'SET folderPath = :path, parentKey = :parentKey',
+                    'ConditionExpression': f'(attribute_not_exists(#status) OR #status = :available) AND {placement}',
+                    'ExpressionAttributeNames': {'#status': 'status', '#size': 'size'},
+                    'ExpressionAttributeValues': {
+                        ':path': target,
+                        ':parentKey': folder_attributes(user_id, target)['parentKey'],
+                        ':available': 'available',
+                        **values
+                    }
+                }
+            })
+            size = int(item.get('size', 0))
+            for folder, sign in ((item.get('folderPath', ROOT), -1), (target, 1)):
+                files, total = totals.get(folder, (0, 0))
+                totals[folder] = (files + sign, total + sign * size)
+        return actions + self.combined_updates(user_id, totals)
+
+    def move_files(self, user_id, items, target):
+        """Move live file rows (with fileId, folderPath, size) into `target`.
+
+        The rows and their folders' totals change together, as many files
+        per transaction as fit. If a transaction fails because some file
+        changed meanwhile, its files are retried one by one. Returns the file
+        IDs that were moved.
+        """
+        items = [item for item in items if item.get('folderPath', ROOT) != target]
+
+        chunks, chunk = [], []
+        for item in items:
+            if chunk and len(self._move_file_actions(user_id, chunk + [item], target)) > TRANSACTION_LIMIT:
+                chunks.append(chunk)
+                chunk = []
+            chunk.append(item)
+        if chunk:
+            chunks.append(chunk)
+
+        moved = []
+        for chunk in chunks:
+            try:
+                transact_write(self.client, self._move_file_actions(user_id, chunk, target))
+                moved.extend(chunk)
+                continue
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'TransactionCanceledException':
+                    raise
+            # Some file (or folder) changed meanwhile, so move them one by one
+            for item in chunk:
+                try:
+                    transact_write(self.client, self._move_file_actions(user_id, [item], target))
+                    moved.append(item)
+                except ClientError as e:
+                    if 'ConditionalCheckFailed' not in cancellation_codes(e):
+                        raise
+        return [item['fileId'] for item in moved]
+
+    def _lock(self, user_id, path, target):
+        """Mark a folder as being moved, which stops every write that would change its totals"""
+        self.table.update_item(
+            Key={'userId': user_id, 'path': path},
+            UpdateExpression='SET movingTo = :target',
+            ConditionExpression=FOLDER_WRITABLE,
+            ExpressionAttributeValues={':target': target}
+        )
+
+    def _unlock(self, user_id, paths):
+        for path in paths:
+            try:
+                self.table.update_item(
+                    Key={'userId': user_id, 'path': path},
+                    UpdateExpression='REMOVE movingTo',
+                    ConditionExpression='attribute_exists(parentPath)'
+                )
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+
+    def _lock_subtree(self, user_id, source, target):
+        """Lock `source` and every folder below it; returns their rows, read after locking.
+
+        Locked folders can't get new subfolders, so locking level by level
+        until a read finds nothing new catches folders created meanwhile.
+        Raises FolderConflict (after unlocking) if one is already being moved.
+        """
+        locked = []
+        try:
+            self._lock(user_id, source, target)
+            locked.append(source)
+            while True:
+                subtree = []
+                query_args = {
+                    'KeyConditionExpression': Key('userId').eq(user_id) & Key('path').begins_with(source),
+                    'ConsistentRead': True
+                }
+                while True:
+                    response = self.table.query(**query_args)
+                    subtree.extend(item for item in response.get('Items', []) if 'parentPath' in item)
+                    if 'LastEvaluatedKey' not in response:
+                        break
+                    query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+                unlocked = [folder['path'] for folder in subtree if 'movingTo' not in folder]
+                if not unlocked:
+                    return subtree
+                for path in unlocked:
+                    self._lock(user_id, path, target)
+                    locked.append(path)
+        except ClientError as e:
+            self._unlock(user_id, locked)
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                raise FolderConflict(f"Folder {source} is being moved or was deleted")
+            raise
+
+    def move(self, user_id, source, target):
+        """Move or rename a folder and everything in it; returns {'folders': n, 'files': n}.
+
+        Raises LookupError if the folder or the target's parent doesn't
+        exist and FolderConflict if the target exists or is inside the source.
+
+        The old folders are locked first, so no upload, delete or move can
+        change their totals while they are copied. The new top folder and
+        the totals of both sets of ancestors change in one transaction. A
+        move that dies part way leaves the old folders locked.
+        """
+        if source == ROOT:
+            raise FolderConflict("The root folder can't be moved")
+        if target.startswith(source):
+            raise FolderConflict("A folder can't be moved into itself")
+        if self.get(user_id, source) is None:
+            raise LookupError(f"Folder {source} does not exist")
+        if not self.exists(user_id, parent_of(target)):
+            raise LookupError(f"Parent folder {parent_of(target)} does not exist")
+        if self.get(user_id, target) is not None:
+            raise FolderConflict(f"Folder {target} already exists")
+
+        subtree = self._lock_subtree(user_id, source, target)
+        old_paths = [folder['path'] for folder in subtree]
+        renamed = {path: target + path[len(source):] for path in old_paths}
+        new_rows = {}
+        for folder in subtree:
+            path = renamed[folder['path']]
+            row = {**folder, 'path': path, 'name': name_of(path), 'parentPath': parent_of(path)}
+            row.pop('movingTo', None)
+            new_rows[path] = row
+        root = new_rows[target]
+
+        if max(depth_of(path) for path in new_rows) > MAX_FOLDER_DEPTH:
+            self._unlock(user_id, old_paths)
+            raise FolderConflict(f"Folders can be at most {MAX_FOLDER_DEPTH} levels deep")
+
+        # 1. Create the new top folder, and move the subtree's totals from
+        #    the old ancestors to the new ones, all at once
+        files, size = int(root.get('subtreeFileCount', 0)), int(root.get('subtreeSize', 0))
+        actions = [{
+            'Put': {
+                'TableName': self.table.name,
+                'Item': root,
+                'ConditionExpression': 'attribute_not_exists(parentPath)'
+            }
+        }] + self.combined_updates(user_id, {
+            parent_of(source): (-files, -size),
+            parent_of(target): (files, size)
+        })
+        try:
+            transact_write(self.client, actions)
+        except ClientError as e:
+            self._unlock(user_id, old_paths)
+            codes = cancellation_codes(e)
+            if codes[:1] == ['ConditionalCheckFailed']:
+                raise FolderConflict(f"Folder {target} already exists")
+            if 'ConditionalCheckFailed' in codes:
+                raise LookupError(f"Parent folder {parent_of(target)} was moved or deleted")
+            raise
+
+        # 2. The folders below it, carrying their totals over
+        unprocessed = batch_put_items(self.dynamodb, self.table.name, [row for path, row in new_rows.items() if path != target])
+        if unprocessed:
+            raise RuntimeError(f"Failed to write {len(unprocessed)} folder rows while moving {source}")
+
+        # 3. Re-point the files, folder by folder. Their totals came along
+        #    with the folder rows.
+        moved_files = 0
+        for path in old_paths:
+            rows = list(self._folder_file_rows(user_id, path))
+            moved_files += len(self._move_rows(user_id, rows, renamed[path]))
+
+        # 4. Drop the old folder rows
+        unprocessed = batch_delete_items(
+            self.dynamodb,
+            self.table.name,
+            [{'userId': user_id, 'path': path} for path in old_paths]
+        )
+        if unprocessed:
+            logger.warning(f"{len(unprocessed)} old folder rows left behind after moving {source}")
+        return {'folders': len(subtree), 'files': moved_files}
+
+
+def backfill_root_folders(files_table, folder_store):
+    """Place files from before folders existed in the root folder and count them in its totals"""
+    totals = {}
+    scan_args = {
+        'FilterExpression': 'attribute_not_exists(parentKey)',
+        'ProjectionExpression': 'userId, fileId, #size, #status',
+        'ExpressionAttributeNames': {'#size': 'size', '#status': 'status'}
+    }
+    while True:
+        response = files_table.scan(**scan_args)
+        for item in response.get('Items', []):
+            user_id = item['userId']
+            try:
+                files_table.update_item(
+                    Key={'userId': user_id, 'fileId': item['fileId']},
+                    UpdateExpression='SET folderPath = :path, parentKey = :parentKey',
+                    ConditionExpression='attribute_exists(fileId) AND attribute_not_exists(parentKey)',
+                    ExpressionAttributeValues={':path': ROOT, ':parentKey': folder_attributes(user_id, ROOT)['parentKey']}
+                )
+            except ClientError as e:
+                if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                    continue
+                raise
+            if item.get('status', 'available') == 'available':
+                files, size = totals.get(user_id, (0, 0))
+                totals[user_id] = (files + 1, size + int(item.get('size', 0)))
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    for user_id, (files, size) in totals.items():
+        folder_store.adjust(user_id, ROOT, files, size)
+    logger.info(f"Placed the files of {len(totals)} users in their root folder")
+    return totals
+
+
+if __name__ == '__main__':
+    # One-off backfill for existing tables: python -m services.folders
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    from routes.file_routes import table, folder_store
+    backfill_root_folders(table, folder_store)
@@ -0,0 +1,147 @@
+import json
+import time
+import threading
+from collections import OrderedDict
+from services.response_encoding import cache_default
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class MemoryBackend:
+    """In-process LRU with per-entry TTL.
+
+    Only coherent within one worker process; use RedisBackend when running
+    several Flask workers.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        # Generation counters are kept apart from the LRU so they are never
+        # evicted (losing one would make old entries visible again)
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+
+class RedisBackend:
+    """Shared backend for any Redis-compatible server, so all workers see the same entries"""
+
+    def __init__(self, url, prefix='listing-cache:'):
+        if redis is None:
+            raise ImportError("The redis package is required for a shared listing cache (pip install redis)")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl):
+        # Decimals are stored as numbers, so a Redis hit returns the same
+        # JSON as a fresh query does
+        self.client.set(self.prefix + key, json.dumps(value, default=cache_default), ex=int(ttl))
+
+    def get_counter(self, key):
+        value = self.client.get(self.prefix + key)
+        return int(value) if value is not None else 0
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+
+class ListingCache:
+    """Caches file-listing pages per user.
+
+    Every cache key includes the user's current generation number. Writes
+    (upload, delete) bump the generation, which makes all of that user's
+    cached pages unreachable at once; they then age out through the TTL.
+    """
+
+    def __init__(self, backend, ttl=300):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._served_age_total = 0.0
+        self._served_age_max = 0.0
+
+    def _key(self, user_id, params):
+        generation = self.backend.get_counter(f'gen:{user_id}')
+        return f'{user_id}:{generation}:{json.dumps(params, sort_keys=True)}'
+
+    def get(self, user_id, params):
+        """Return the cached page for these listing parameters, or None"""
+        entry = self.backend.get(self._key(user_id, params))
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            # Track how old the listings we serve are
+            age = time.time() - entry['storedAt']
+            self.hits += 1
+            self._served_age_total += age
+            self._served_age_max = max(self._served_age_max, age)
+        return entry['value']
+
+    def set(self, user_id, params, value):
+        self.backend.set(self._key(user_id, params), {'storedAt': time.time(), 'value': value}, self.ttl)
+
+    def invalidate(self, user_id):
+        """Drop every cached listing page for a user"""
+        self.backend.incr(f'gen:{user_id}')
+        with self._lock:
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': type(self.backend).__name__,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hitRatio': (self.hits / lookups) if lookups else 0.0,
+                'servedAgeAvg': (self._served_age_total / self.hits) if self.hits else 0.0,
+                'servedAgeMax': self._served_age_max
+            }
+
+
+def create_listing_cache(url=None, ttl=300, max_entries=10000):
+    """Build a listing cache: Redis if a redis:// URL is given, otherwise in-process"""
+    if url:
+        return ListingCache(RedisBackend(url), ttl=ttl)
+    return ListingCache(MemoryBackend(max_entries=max_entries), ttl=ttl)
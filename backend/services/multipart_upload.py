@@ -0,0 +1,212 @@
+import time
+import base64
+import hashlib
+import logging
+import threading
+from datetime import datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# S3 rejects multipart parts smaller than 5MB (except the last one)
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class MultipartUploader:
+    """Uploads streams to S3 as parallel multipart uploads.
+
+    Parts are read from the incoming stream on the request thread and handed to
+    a thread pool that is shared by every request, so the number of S3
+    connections stays bounded no matter how many uploads run at once.
+    `max_concurrency` caps the parts in flight per upload, which also caps the
+    memory one upload can hold (max_concurrency * part_size).
+
+    Every request carries a SHA-256 checksum of its bytes (the whole object
+    for a PutObject, each part for a multipart upload), so S3 rejects
+    anything that was corrupted on the way. SHA-256 rather than the cheaper
+    CRC32C because it is the algorithm the rest of the upload path already
+    uses: the stored sha256 and the dedup content key are SHA-256 (a CRC
+    can't key content, collisions are trivial), so a small file's S3
+    checksum is that same digest.
+
+    If anything fails the multipart upload is aborted so no orphaned parts are
+    left behind (and billed). `start_sweeper` additionally aborts incomplete
+    uploads left over from crashed workers.
+    """
+
+    def __init__(self, s3_client, part_size=8 * 1024 * 1024, max_concurrency=4,
+                 max_workers=16, multipart_threshold=None):
+        self.s3_client = s3_client
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.max_concurrency = max_concurrency
+        # Streams smaller than this go up as a single PutObject
+        self.multipart_threshold = max(multipart_threshold or self.part_size, self.part_size)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='s3-multipart')
+        self._sweeper = None
+        self._stop = threading.Event()
+
+    def _read_part(self, fileobj, size):
+        """Read up to `size` bytes, looping because streams may return short reads"""
+        chunks = []
+        remaining = size
+        while remaining > 0:
+            chunk = fileobj.read(remaining)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return b''.join(chunks)
+
+    @staticmethod
+    def _checksum(data):
+        return base64.b64encode(hashlib.sha256(data).digest()).decode('ascii')
+
+    def _upload_part(self, bucket, key, upload_id, part_number, data):
+        started = time.monotonic()
+        # Hashing here keeps it on the worker threads, in parallel
+        checksum = self._checksum(data)
+        response = self.s3_client.upload_part(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=data,
+            ChecksumAlgorithm='SHA256',
+            ChecksumSHA256=checksum
+        )
+        elapsed = time.monotonic() - started
+        logger.debug(f"Uploaded part {part_number} of {key} ({len(data)} bytes) in {elapsed:.3f}s")
+        return {
+            'PartNumber': part_number,
+            'ETag': response['ETag'],
+            'ChecksumSHA256': checksum,
+            'Size': len(data),
+            'Seconds': elapsed
+        }
+
+    def upload(self, fileobj, bucket, key, extra_args=None):
+        """Upload a file-like object to S3 and return transfer statistics"""
+        extra_args = extra_args or {}
+        started = time.monotonic()
+
+        first_part = self._read_part(fileobj, self.multipart_threshold)
+        if len(first_part) < self.multipart_threshold:
+            # Small file: one request is cheaper than a multipart upload
+            self.s3_client.put_object(
+                Bucket=bucket,
+                Key=key,
+                Body=first_part,
+                ChecksumAlgorithm='SHA256',
+                ChecksumSHA256=self._checksum(first_part),
+                **extra_args
+            )
+            return self._log_stats(key, len(first_part), 1, started, [])
+
+        upload_id = self.s3_client.create_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            ChecksumAlgorithm='SHA256',
+            **extra_args
+        )['UploadId']
+        in_flight = threading.Semaphore(self.max_concurrency)
+        futures = []
+
+        def submit(part_number, data):
+            in_flight.acquire()
+            future = self._executor.submit(self._upload_part, bucket, key, upload_id, part_number, data)
+            future.add_done_callback(lambda _: in_flight.release())
+            futures.append(future)
+
+        try:
+            # The first read can span several parts if the threshold is
+            # larger than the part size, so split it the same way
+            data = first_part
+            part_number = 1
+            while data:
+                for offset in range(0, len(data), self.part_size):
+                    submit(part_number, data[offset:offset + self.part_size])
+                    part_number += 1
+                # Stop reading early if a part has already failed
+                if any(f.done() and f.exception() for f in futures):
+                    break
+                data = self._read_part(fileobj, self.part_size)
+
+            parts = [future.result() for future in futures]
+            self.s3_client.complete_multipart_upload(
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={
+                    'Parts': [
+                        {'PartNumber': p['PartNumber'], 'ETag': p['ETag'], 'ChecksumSHA256': p['ChecksumSHA256']}
+                        for p in parts
+                    ]
+                }
+            )
+        except BaseException:
+            # Wait for parts still running so nothing is uploaded after the abort
+            for future in futures:
+                future.exception()
+            try:
+                self.s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            except Exception as e:
+                logger.error(f"Failed to abort multipart upload {upload_id} for {key}: {str(e)}")
+            raise
+
+        return self._log_stats(key, sum(p['Size'] for p in parts), len(parts), started, parts)
+
+    def _log_stats(self, key, size, part_count, started, parts):
+        elapsed = time.monotonic() - started
+        throughput = size / elapsed / (1024 * 1024) if elapsed > 0 else 0.0
+        stats = {
+            'size': size,
+            'parts': part_count,
+            'seconds': elapsed,
+            'throughputMBps': throughput
+        }
+        if parts:
+            part_times = [p['Seconds'] for p in parts]
+            stats['partSecondsMin'] = min(part_times)
+            stats['partSecondsMax'] = max(part_times)
+            stats['partSecondsAvg'] = sum(part_times) / len(part_times)
+        logger.info(f"Uploaded {key}: {size} bytes in {part_count} part(s), "
+                    f"{elapsed:.2f}s, {throughput:.2f} MB/s, "
+                    f"part_size={self.part_size} concurrency={self.max_concurrency}")
+        return stats
+
+    def abort_incomplete_uploads(self, bucket, max_age):
+        """Abort multipart uploads in the bucket that were started more than `max_age` seconds ago"""
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=max_age)
+        aborted = 0
+        paginator = self.s3_client.get_paginator('list_multipart_uploads')
+        for page in paginator.paginate(Bucket=bucket):
+            for upload in page.get('Uploads', []):
+                if upload['Initiated'] < cutoff:
+                    self.s3_client.abort_multipart_upload(
+                        Bucket=bucket,
+                        Key=upload['Key'],
+                        UploadId=upload['UploadId']
+                    )
+                    aborted += 1
+        if aborted:
+            logger.info(f"Aborted {aborted} incomplete multipart upload(s) in {bucket}")
+        return aborted
+
+    def start_sweeper(self, bucket, interval=3600, max_age=24 * 3600):
+        """Periodically abort incomplete multipart uploads in a background thread"""
+        if self._sweeper is not None:
+            return
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.abort_incomplete_uploads(bucket, max_age)
+                except Exception as e:
+                    logger.error(f"Multipart upload sweep failed: {str(e)}")
+
+        self._sweeper = threading.Thread(target=run, name='s3-multipart-sweeper', daemon=True)
+        self._sweeper.start()
+
+    def shutdown(self):
+        self._stop.set()
+        self._executor.shutdown(wait=True)
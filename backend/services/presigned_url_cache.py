@@ -0,0 +1,62 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class PresignedUrlCache:
+    """Reuses presigned download URLs keyed by (user, fileId).
+
+    A URL is handed out again until `reuse_fraction` of its lifetime has
+    passed, so a reused link is always valid for at least the remaining
+    (1 - reuse_fraction) of its expiry. Deleting a file must call
+    `invalidate` so its link is not served again.
+
+    The cache lives in each process, and `invalidate` only reaches the one
+    that handled the write. Entries can therefore carry a `version` (the
+    user's listing version when the URL was signed), and are only reused
+    under that same version.
+    """
+
+    def __init__(self, max_entries=10000, reuse_fraction=0.5):
+        self.max_entries = max_entries
+        self.reuse_fraction = reuse_fraction
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id, file_id, version=None):
+        """Return the cached response payload, or None if missing, too old to reuse or from another version"""
+        key = (user_id, file_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic() or entry[1] != version:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, user_id, file_id, payload, expires_in, version=None):
+        """Cache a payload containing a URL that was just signed for `expires_in` seconds"""
+        reuse_until = time.monotonic() + expires_in * self.reuse_fraction
+        with self._lock:
+            self._entries[(user_id, file_id)] = (reuse_until, version, payload)
+            self._entries.move_to_end((user_id, file_id))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id, file_id):
+        with self._lock:
+            self._entries.pop((user_id, file_id), None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRatio': (self.hits / lookups) if lookups else 0.0
+            }
@@ -0,0 +1,184 @@
+import io
+import time
+import queue
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from botocore.exceptions import ClientError
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_CONTENT_TYPE = 'image/jpeg'
+
+
+def preview_key(user_id, file_id, size):
+    """Previews live next to the original, under the file's own prefix"""
+    return f"{user_id}/{file_id}/previews/{size}.jpg"
+
+
+def can_preview(content_type):
+    # Pillow reads the common raster formats; multi-page ones (GIF, TIFF)
+    # get a preview of their first frame. PDFs are deliberately left out:
+    # rendering a page needs a PDF engine (pdfium or poppler), a native
+    # dependency the workers don't ship with, so they keep the generic icon.
+    return (content_type or '').startswith('image/') and content_type != 'image/svg+xml'
+
+
+def render_previews(data, sizes, quality=80):
+    """Render JPEG thumbnails of an image, one per size (longest edge, in pixels).
+
+    Runs in a worker process. Returns {size: jpeg bytes}.
+    """
+    image = Image.open(io.BytesIO(data))
+    # For JPEGs, let the decoder downscale while decoding, which is much
+    # cheaper than decoding at full size and resizing afterwards
+    image.draft('RGB', (max(sizes), max(sizes)))
+    image.seek(0)
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'L'):
+        # Flatten transparency onto white, since JPEG has no alpha
+        rgba = image.convert('RGBA')
+        image = Image.new('RGB', rgba.size, (255, 255, 255))
+        image.paste(rgba, mask=rgba.getchannel('A'))
+
+    previews = {}
+    # Work from the largest size down, each one resized from the last
+    for size in sorted(sizes, reverse=True):
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=quality, optimize=True)
+        previews[size] = output.getvalue()
+    return previews
+
+
+class PreviewPipeline:
+    """Generates image previews in the background after uploads.
+
+    Upload handlers call `submit`, which never blocks: jobs go into a
+    bounded queue and are refused (and counted) when it's full, so a burst
+    of uploads can't pile up unbounded work or memory. Dispatcher threads
+    download the original and upload the results; the image work itself
+    runs in a process pool so it doesn't hold the GIL on request threads.
+    """
+
+    def __init__(self, s3_client, table, sizes=(128, 512), max_workers=2, queue_size=100,
+                 max_source_bytes=50 * 1024 * 1024, on_ready=None):
+        self.s3_client = s3_client
+        self.table = table
+        self.on_ready = on_ready
+        self.sizes = tuple(sorted(sizes))
+        self.max_workers = max_workers
+        self.max_source_bytes = max_source_bytes
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._executor = None
+        self._bucket = None
+        self._lock = threading.Lock()
+        self._counters = {'queued': 0, 'rejected': 0, 'completed': 0, 'failed': 0, 'skipped': 0}
+        self._render_seconds = 0.0
+
+    def start(self, bucket):
+        """Start the worker processes and dispatcher threads"""
+        if self._executor is not None:
+            return
+        self._bucket = bucket
+        # Spawned (not forked) workers don't inherit the web server's threads and locks
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+        # One dispatcher per worker process keeps every process busy
+        # while bounding the originals held in memory
+        for i in range(self.max_workers):
+            threading.Thread(target=self._run, name=f'preview-dispatch-{i}', daemon=True).start()
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def submit(self, user_id, file_id, s3_key, content_type):
+        """Queue preview generation for a file; returns False if it was refused"""
+        if self._executor is None or not can_preview(content_type):
+            return False
+        try:
+            self._queue.put_nowait((user_id, file_id, s3_key))
+        except queue.Full:
+            logger.warning(f"Preview queue full, skipping previews for {file_id}")
+            self._count('rejected')
+            return False
+        self._count('queued')
+        return True
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._process(*job)
+            except Exception as e:
+                logger.error(f"Preview generation failed for {job[1]}: {str(e)}")
+                self._count('failed')
+            finally:
+                self._queue.task_done()
+
+    def _process(self, user_id, file_id, s3_key):
+        response = self.s3_client.get_object(Bucket=self._bucket, Key=s3_key)
+        if response['ContentLength'] > self.max_source_bytes:
+            response['Body'].close()
+            self._count('skipped')
+            return
+        data = response['Body'].read()
+
+        started = time.monotonic()
+        previews = self._executor.submit(render_previews, data, self.sizes).result()
+        with self._lock:
+            self._render_seconds += time.monotonic() - started
+
+        for size, preview in previews.items():
+            self.s3_client.put_object(
+                Bucket=self._bucket,
+                Key=preview_key(user_id, file_id, size),
+                Body=preview,
+                ContentType=PREVIEW_CONTENT_TYPE
+            )
+
+        # Only record them if the file still points at the object we rendered
+        try:
+            self.table.update_item(
+                Key={
+                    'userId': user_id,
+                    'fileId': file_id
+                },
+                UpdateExpression='SET previews = :sizes',
+                ConditionExpression='s3Key = :key',
+                ExpressionAttributeValues={
+                    ':sizes': sorted(previews),
+                    ':key': s3_key
+                },
+                ReturnValuesOnConditionCheckFailure='ALL_OLD'
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            # The file was deleted or replaced meanwhile. A newer version
+            # queues its own previews; otherwise nothing would clean these up.
+            if e.response.get('Item') is None:
+                self.s3_client.delete_objects(
+                    Bucket=self._bucket,
+                    Delete={'Objects': [{'Key': preview_key(user_id, file_id, size)} for size in previews]}
+                )
+            self._count('skipped')
+            return
+        if self.on_ready:
+            self.on_ready(user_id, file_id)
+        self._count('completed')
+
+    def stats(self):
+        with self._lock:
+            completed = self._counters['completed']
+            return {
+                **self._counters,
+                'pending': self._queue.qsize(),
+                'workers': self.max_workers,
+                'renderSecondsAvg': (self._render_seconds / completed) if completed else 0.0
+            }
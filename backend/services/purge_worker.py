@@ -0,0 +1,266 @@
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from botocore.exceptions import ClientError
+from services.dynamo_batch import batch_delete_items
+from services.preview_pipeline import preview_key
+
+logger = logging.getLogger(__name__)
+
+# Deleted files stay in UserFiles as tombstones (status = 'deleted') until
+# the purge worker removes them. Tombstones carry `tombstone` + `deletedAt`
+# attributes, which feed a sparse GSI so the worker only ever reads rows
+# that are actually waiting to be purged:
+#   tombstone-deletedAt-index  (partition key tombstone, S; sort key deletedAt, S)
+TOMBSTONE_INDEX = 'tombstone-deletedAt-index'
+
+# S3 DeleteObjects accepts at most 1000 keys per request
+S3_DELETE_BATCH_SIZE = 1000
+
+# A claimed row that is still 'purging' after this many seconds belongs to a
+# purge that died part way through, and can be claimed again
+CLAIM_LEASE = 3600
+
+
+def object_key(item):
+    return item.get('s3Key') or f"{item['userId']}/{item['fileId']}/{item['filename']}"
+
+
+def delete_rows(table, dynamodb, items, usage_store=None, folder_store=None):
+    """Delete metadata rows in batches; returns the keys that couldn't be deleted.
+
+    With a usage store, each batch also takes the files off their owners'
+    storage usage in the same transaction, and off their folders' totals
+    when a folder store is given too.
+    """
+    if usage_store:
+        return usage_store.delete_rows(table, items, folder_store)
+    return batch_delete_items(dynamodb, table.name, [{'userId': item['userId'], 'fileId': item['fileId']} for item in items])
+
+
+def remove_files(table, dynamodb, s3_client, bucket, items, content_store=None, usage_store=None, folder_store=None):
+    """Delete the S3 objects and then the metadata rows for `items`, in batches.
+
+    Each item needs userId, fileId and s3Key (or filename), and size and
+    status when a usage store is given, plus folderPath when a folder store
+    is given too. Rows are only removed once their object is gone, so a
+    failed S3 delete never leaves an object without a row. Returns
+    (deleted, failed) as sets of (userId, fileId).
+
+    Deduplicated files (with a contentHash) share their blob, so for those
+    the row goes first and then the blob's reference is released; a crash
+    in between leaks a reference rather than breaking another file.
+    """
+    remove_previews(s3_client, bucket, items)
+
+    shared = [item for item in items if item.get('contentHash')]
+    items = [item for item in items if not item.get('contentHash')]
+    if shared:
+        deleted, failed = remove_shared_files(table, dynamodb, bucket, shared, content_store, usage_store, folder_store)
+    else:
+        deleted, failed = set(), set()
+
+    item_by_key = {object_key(item): item for item in items}
+    s3_keys = list(item_by_key)
+    removable = []
+
+    for start in range(0, len(s3_keys), S3_DELETE_BATCH_SIZE):
+        batch = s3_keys[start:start + S3_DELETE_BATCH_SIZE]
+        response = s3_client.delete_objects(
+            Bucket=bucket,
+            Delete={
+                'Objects': [{'Key': s3_key} for s3_key in batch],
+                'Quiet': True
+            }
+        )
+        # In quiet mode S3 only reports the keys it failed to delete.
+        # Deleting a key that doesn't exist counts as success.
+        errors = {error['Key']: error for error in response.get('Errors', [])}
+        for s3_key in batch:
+            item = item_by_key[s3_key]
+            if s3_key in errors:
+                logger.warning(f"Failed to delete {s3_key}: {errors[s3_key].get('Message')}")
+                failed.add((item['userId'], item['fileId']))
+            else:
+                removable.append(item)
+
+    unprocessed = delete_rows(table, dynamodb, removable, usage_store, folder_store)
+    failed.update((key['userId'], key['fileId']) for key in unprocessed)
+    deleted.update((item['userId'], item['fileId']) for item in removable)
+    return deleted - failed, failed
+
+
+def remove_previews(s3_client, bucket, items):
+    """Best-effort delete of the files' preview images"""
+    keys = [
+        preview_key(item['userId'], item['fileId'], int(size))
+        for item in items
+        for size in item.get('previews', [])
+    ]
+    for start in range(0, len(keys), S3_DELETE_BATCH_SIZE):
+        response = s3_client.delete_objects(
+            Bucket=bucket,
+            Delete={
+                'Objects': [{'Key': key} for key in keys[start:start + S3_DELETE_BATCH_SIZE]],
+                'Quiet': True
+            }
+        )
+        for error in response.get('Errors', []):
+            logger.warning(f"Failed to delete preview {error['Key']}: {error.get('Message')}")
+
+
+def remove_shared_files(table, dynamodb, bucket, items, content_store, usage_store=None, folder_store=None):
+    """Delete the rows of deduplicated files, then release their blobs"""
+    if content_store is None:
+        raise ValueError("Deduplicated files can't be removed without a content store")
+    unprocessed = {(key['userId'], key['fileId']) for key in delete_rows(table, dynamodb, items, usage_store, folder_store)}
+    deleted = set()
+    for item in items:
+        file_key = (item['userId'], item['fileId'])
+        if file_key not in unprocessed:
+            content_store.release(bucket, item['contentHash'])
+            deleted.add(file_key)
+    return deleted, unprocessed
+
+
+def claim_tombstones(table, cutoff, limit, lease=CLAIM_LEASE):
+    """Move tombstones deleted before `cutoff` to 'purging' and return them.
+
+    The conditional update means a file restored from the trash in the
+    meantime is never purged, and a restore can't happen once it's claimed.
+    Rows claimed more than `lease` seconds ago are claimed again.
+    """
+    now = datetime.utcnow()
+    claimed = []
+    query_args = {
+        'IndexName': TOMBSTONE_INDEX,
+        'KeyConditionExpression': 'tombstone = :deleted AND deletedAt < :cutoff',
+        'ExpressionAttributeValues': {
+            ':deleted': 'deleted',
+            ':cutoff': cutoff
+        }
+    }
+    while len(claimed) < limit:
+        response = table.query(**query_args)
+        for item in response.get('Items', []):
+            try:
+                response = table.update_item(
+                    Key={
+                        'userId': item['userId'],
+                        'fileId': item['fileId']
+                    },
+                    UpdateExpression='SET #status = :purging, purgeClaimedAt = :now',
+                    # Claims without a timestamp predate the lease and are just as stuck
+                    ConditionExpression='#status = :deleted OR (#status = :purging AND '
+                                        '(attribute_not_exists(purgeClaimedAt) OR purgeClaimedAt < :expired))',
+                    ExpressionAttributeNames={'#status': 'status'},
+                    ExpressionAttributeValues={
+                        ':purging': 'purging',
+                        ':deleted': 'deleted',
+                        ':now': now.isoformat(),
+                        ':expired': (now - timedelta(seconds=lease)).isoformat()
+                    },
+                    # The whole row as claimed: the deletes are conditional on it
+                    ReturnValues='ALL_NEW'
+                )
+                claimed.append(response['Attributes'])
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+            if len(claimed) >= limit:
+                break
+        if 'LastEvaluatedKey' not in response:
+            break
+        query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return claimed
+
+
+def release_claims(table, keys):
+    """Put claimed rows that weren't purged back in the trash, so the next run (or a restore) can have them"""
+    for user_id, file_id in keys:
+        try:
+            table.update_item(
+                Key={
+                    'userId': user_id,
+                    'fileId': file_id
+                },
+                UpdateExpression='SET #status = :deleted REMOVE purgeClaimedAt',
+                ConditionExpression='#status = :purging',
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues={
+                    ':deleted': 'deleted',
+                    ':purging': 'purging'
+                }
+            )
+        except ClientError as e:
+            # Already deleted after all
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                logger.warning(f"Failed to release purge claim on {file_id}: {str(e)}")
+
+
+def purge_tombstones(table, dynamodb, s3_client, bucket, retention, batch_size=S3_DELETE_BATCH_SIZE, content_store=None,
+                     usage_store=None):
+    """Permanently delete files that have been in the trash for longer than `retention` seconds"""
+    cutoff = (datetime.utcnow() - timedelta(seconds=retention)).isoformat()
+    total = 0
+    while True:
+        claimed = claim_tombstones(table, cutoff, batch_size)
+        if not claimed:
+            break
+        try:
+            deleted, failed = remove_files(table, dynamodb, s3_client, bucket, claimed, content_store, usage_store)
+        except Exception:
+            release_claims(table, [(item['userId'], item['fileId']) for item in claimed])
+            raise
+        total += len(deleted)
+        if failed:
+            release_claims(table, failed)
+            # Leave the rest for the next run rather than spinning on errors
+            logger.warning(f"Failed to purge {len(failed)} file(s), will retry on the next run")
+            break
+        if len(claimed) < batch_size:
+            break
+    if total:
+        logger.info(f"Purged {total} deleted file(s)")
+    return total
+
+
+def start_purge_worker(table, dynamodb, s3_client, bucket, interval=300, retention=24 * 3600, content_store=None,
+                       usage_store=None):
+    """Run purge_tombstones every `interval` seconds in a background thread"""
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                purge_tombstones(
+                    table, dynamodb, s3_client, bucket, retention,
+                    content_store=content_store, usage_store=usage_store
+                )
+            except Exception as e:
+                logger.error(f"Purge of deleted files failed: {str(e)}")
+
+    threading.Thread(target=run, name='purge-worker', daemon=True).start()
+    return stop
+
+
+if __name__ == '__main__':
+    # Run the purge as a separate process: python -m services.purge_worker
+    import os
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    from routes.file_routes import table, dynamodb, s3_client, content_store, usage_store, get_s3_bucket_name
+    interval = int(os.getenv('PURGE_INTERVAL', '300'))
+    retention = int(os.getenv('TRASH_RETENTION', str(24 * 3600)))
+    while True:
+        try:
+            purge_tombstones(
+                table, dynamodb, s3_client, get_s3_bucket_name(), retention,
+                content_store=content_store, usage_store=usage_store
+            )
+        except Exception as e:
+            logger.error(f"Purge of deleted files failed: {str(e)}")
+        time.sleep(interval)
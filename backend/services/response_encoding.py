@@ -0,0 +1,163 @@
+import gzip
+from decimal import Decimal
+from flask import request, current_app
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Response bodies smaller than this aren't worth compressing
+DEFAULT_MIN_SIZE = 1024
+
+# Levels that favour speed: these run on every listing response
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 3
+
+COMPRESSIBLE_TYPES = {'application/json', 'text/plain', 'text/html', 'text/csv'}
+
+
+def to_number(value):
+    """DynamoDB returns every number as a Decimal"""
+    return int(value) if value == value.to_integral_value() else float(value)
+
+
+def cache_default(value):
+    """json.dumps default for values stored outside the process (e.g. in
+    Redis): Decimals become numbers, like in responses, anything else a string"""
+    if isinstance(value, Decimal):
+        return to_number(value)
+    return str(value)
+
+
+def available_encodings():
+    """Content codings we can produce, in order of preference"""
+    encodings = []
+    if zstandard is not None:
+        encodings.append('zstd')
+    if brotli is not None:
+        encodings.append('br')
+    encodings.append('gzip')
+    return encodings
+
+
+def negotiate_encoding(accept_encoding, encodings=None):
+    """Pick a content coding for an Accept-Encoding header, or None for identity.
+
+    The client's q-values decide; ties go to our own preference order.
+    """
+    encodings = encodings or available_encodings()
+    weights = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+
+    best, best_q = None, 0.0
+    for encoding in encodings:
+        q = weights.get(encoding, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(data, encoding):
+    if encoding == 'gzip':
+        # mtime=0 keeps the output the same for the same input
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    raise ValueError(f"Unsupported content coding: {encoding}")
+
+
+def compress_response(response):
+    """after_request hook: compress JSON and text bodies the client accepts compressed"""
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.status_code < 200
+        or response.status_code in (204, 206)
+        or response.status_code >= 300
+        or 'Content-Encoding' in response.headers
+        or response.mimetype not in COMPRESSIBLE_TYPES
+    ):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < current_app.config.get('COMPRESSION_MIN_SIZE', DEFAULT_MIN_SIZE):
+        return response
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+
+    compressed = compress(data, encoding)
+    if len(compressed) >= len(data):
+        return response
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    # A strong ETag would claim the compressed and plain bodies are the same
+    # bytes. Weak comparison (which If-None-Match uses) still matches it.
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def encode_json(obj, sort_keys=False, default=None):
+    """Serialize to UTF-8 JSON bytes with orjson, handing Decimals and the
+    types Flask knows how to encode to `default`"""
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+    if sort_keys:
+        options |= orjson.OPT_SORT_KEYS
+    return orjson.dumps(obj, default=default, option=options)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that serializes with orjson when it's installed.
+
+    DynamoDB Decimals become plain numbers instead of the strings Flask's
+    default provider makes of them, so rows can be returned as they come
+    back from a query.
+    """
+
+    @staticmethod
+    def default(value):
+        if isinstance(value, Decimal):
+            return to_number(value)
+        return DefaultJSONProvider.default(value)
+
+    def dumps(self, obj, **kwargs):
+        # Callers asking for json.dumps options get the standard library
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return encode_json(obj, self.sort_keys, self.default).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        if orjson is None or self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(encode_json(obj, self.sort_keys, self.default) + b'\n', mimetype=self.mimetype)
@@ -0,0 +1,269 @@
+import re
+import time
+import heapq
+import bisect
+import threading
+from array import array
+from datetime import datetime, timezone
+from collections import OrderedDict
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+# Compact the arrays once this fraction of the entries has been removed
+COMPACT_RATIO = 0.5
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def trigrams(text):
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def to_timestamp(value):
+    """ISO timestamp (UTC, as stored in UserFiles) to epoch seconds; raises ValueError if invalid"""
+    moment = datetime.fromisoformat(str(value))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def from_timestamp(value):
+    return datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None).isoformat()
+
+
+class UserSearchIndex:
+    """Filename index for one user's files.
+
+    Files are stored column-wise in parallel arrays indexed by a document
+    number, and every posting list (token -> docs, trigram -> docs) is an
+    array('I') of document numbers, so 100k files cost a few MB rather than
+    a dict per file. Removing a file only clears its `alive` flag; the
+    arrays are compacted once enough entries are dead.
+    """
+
+    def __init__(self):
+        self.file_ids = []
+        self.names = []
+        self.sizes = array('q')
+        self.uploaded = array('d')
+        self.type_ids = array('H')
+        self.alive = bytearray()
+        self.types = []
+        self._type_lookup = {}
+        self.doc_by_file = {}
+        self.tokens = {}
+        self.grams = {}
+        self.sorted_tokens = []
+        self.dead = 0
+
+    def __len__(self):
+        return len(self.doc_by_file)
+
+    def add(self, file):
+        """Index a file dict with fileId, filename, size, contentType and uploadedAt"""
+        if file['fileId'] in self.doc_by_file:
+            self.remove(file['fileId'])
+        doc = len(self.file_ids)
+        name = file['filename']
+        content_type = file.get('contentType') or ''
+        if content_type not in self._type_lookup:
+            self._type_lookup[content_type] = len(self.types)
+            self.types.append(content_type)
+
+        self.file_ids.append(file['fileId'])
+        self.names.append(name)
+        self.sizes.append(int(file.get('size') or 0))
+        try:
+            self.uploaded.append(to_timestamp(file.get('uploadedAt', '')))
+        except ValueError:
+            self.uploaded.append(0.0)
+        self.type_ids.append(self._type_lookup[content_type])
+        self.alive.append(1)
+        self.doc_by_file[file['fileId']] = doc
+
+        for token in set(tokenize(name)):
+            postings = self.tokens.get(token)
+            if postings is None:
+                postings = self.tokens[token] = array('I')
+                bisect.insort(self.sorted_tokens, token)
+            postings.append(doc)
+        for gram in trigrams(name):
+            self.grams.setdefault(gram, array('I')).append(doc)
+
+    def remove(self, file_id):
+        doc = self.doc_by_file.pop(file_id, None)
+        if doc is None:
+            return
+        self.alive[doc] = 0
+        self.dead += 1
+        if self.dead > COMPACT_RATIO * len(self.file_ids):
+            self._compact()
+
+    def _compact(self):
+        live = [
+            {
+                'fileId': self.file_ids[doc],
+                'filename': self.names[doc],
+                'size': self.sizes[doc],
+                'contentType': self.types[self.type_ids[doc]],
+                'uploadedAt': from_timestamp(self.uploaded[doc])
+            }
+            for doc in range(len(self.file_ids)) if self.alive[doc]
+        ]
+        self.__init__()
+        for file in live:
+            self.add(file)
+
+    def _prefix_docs(self, prefix):
+        docs = set()
+        start = bisect.bisect_left(self.sorted_tokens, prefix)
+        for token in self.sorted_tokens[start:]:
+            if not token.startswith(prefix):
+                break
+            docs.update(self.tokens[token])
+        return docs
+
+    def _substring_docs(self, text):
+        text = text.lower()
+        grams = trigrams(text)
+        if not grams:
+            # Too short for trigrams, so check every name
+            return {doc for doc, name in enumerate(self.names) if text in name.lower()}
+        postings = sorted((self.grams.get(gram, ()) for gram in grams), key=len)
+        docs = set(postings[0])
+        for posting in postings[1:]:
+            docs.intersection_update(posting)
+            if not docs:
+                break
+        # Trigrams can match out of order, so confirm the substring
+        return {doc for doc in docs if text in self.names[doc].lower()}
+
+    def search(self, query='', mode='prefix', content_type=None, min_size=None, max_size=None,
+               after=None, before=None, limit=50):
+        """Return matching files, newest first.
+
+        mode is 'prefix' (every query word starts a word of the name),
+        'token' (every query word is a whole word of the name) or
+        'substring' (the query appears anywhere in the name).
+        """
+        if not query:
+            docs = set(range(len(self.file_ids)))
+        elif mode == 'substring':
+            docs = self._substring_docs(query)
+        else:
+            docs = None
+            for word in tokenize(query):
+                if mode == 'token':
+                    matches = set(self.tokens.get(word, ()))
+                else:
+                    matches = self._prefix_docs(word)
+                docs = matches if docs is None else docs & matches
+                if not docs:
+                    break
+            docs = docs or set()
+
+        type_ids = None
+        if content_type:
+            type_ids = {i for i, t in enumerate(self.types) if t.startswith(content_type)}
+
+        results = []
+        for doc in docs:
+            if not self.alive[doc]:
+                continue
+            if type_ids is not None and self.type_ids[doc] not in type_ids:
+                continue
+            if min_size is not None and self.sizes[doc] < min_size:
+                continue
+            if max_size is not None and self.sizes[doc] > max_size:
+                continue
+            if after is not None and self.uploaded[doc] < after:
+                continue
+            if before is not None and self.uploaded[doc] >= before:
+                continue
+            results.append(doc)
+
+        newest = heapq.nlargest(limit, results, key=lambda doc: self.uploaded[doc])
+        return len(results), [
+            {
+                'fileId': self.file_ids[doc],
+                'filename': self.names[doc],
+                'size': self.sizes[doc],
+                'contentType': self.types[self.type_ids[doc]],
+                'uploadedAt': from_timestamp(self.uploaded[doc])
+            }
+            for doc in newest
+        ]
+
+
+class SearchIndexManager:
+    """Keeps per-user search indexes in memory, building them lazily.
+
+    A user's index is built from DynamoDB (through `loader`) on their first
+    search and then kept up to date by the upload and delete handlers.
+    Updates for users without a loaded index are simply dropped, since the
+    next build reads the table anyway. Indexes are per process, so with
+    several workers an index is also rebuilt once it is older than
+    `max_age` seconds, which bounds how stale another worker's writes can
+    look. At most `max_users` indexes are kept (least recently used first out).
+    """
+
+    def __init__(self, loader, max_users=1000, max_age=300):
+        self.loader = loader
+        self.max_users = max_users
+        self.max_age = max_age
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._indexes.get(user_id)
+            if entry is not None and time.time() - entry[0] < self.max_age:
+                self._indexes.move_to_end(user_id)
+                return entry[1], entry[2]
+
+        # Build outside the lock so other users' searches aren't held up
+        index = UserSearchIndex()
+        for file in self.loader(user_id):
+            index.add(file)
+        lock = threading.Lock()
+        with self._lock:
+            self._indexes[user_id] = (time.time(), index, lock)
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+            self.builds += 1
+        return index, lock
+
+    def search(self, user_id, **kwargs):
+        index, lock = self.get(user_id)
+        with lock:
+            return index.search(**kwargs)
+
+    def _update(self, user_id, apply):
+        with self._lock:
+            entry = self._indexes.get(user_id)
+        if entry is not None:
+            with entry[2]:
+                apply(entry[1])
+
+    def add(self, user_id, file):
+        self._update(user_id, lambda index: index.add(file))
+
+    def remove(self, user_id, file_id):
+        self._update(user_id, lambda index: index.remove(file_id))
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._indexes.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'users': len(self._indexes),
+                'files': sum(len(entry[1]) for entry in self._indexes.values()),
+                'builds': self.builds
+            }
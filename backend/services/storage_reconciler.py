@@ -0,0 +1,116 @@
+import logging
+import threading
+from botocore.exceptions import ClientError
+from services.dynamo_batch import cancellation_codes, transact_write
+from services.folders import ROOT
+from services.usage import stored_size
+
+logger = logging.getLogger(__name__)
+
+
+def find_missing_objects(table, s3_client, bucket):
+    """Find metadata rows whose S3 object no longer exists.
+
+    Instead of a HEAD request per file, this lists each key prefix once
+    (a user's folder, or the shared blobs/ folder for deduplicated files)
+    and compares it with the rows. Returns the missing rows (userId,
+    fileId, s3Key and, where set, folderPath and size).
+    """
+    rows_by_prefix = {}
+    scan_args = {
+        'ProjectionExpression': 'userId, fileId, s3Key, folderPath, #size, fileSize, #status',
+        'ExpressionAttributeNames': {'#size': 'size', '#status': 'status'}
+    }
+    while True:
+        response = table.scan(**scan_args)
+        for item in response.get('Items', []):
+            # Only completed uploads are expected to have an object
+            if 's3Key' in item and item.get('status', 'available') == 'available':
+                rows_by_prefix.setdefault(item['s3Key'].split('/', 1)[0], []).append(item)
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    missing = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for prefix, rows in rows_by_prefix.items():
+        keys = set()
+        for page in paginator.paginate(Bucket=bucket, Prefix=f"{prefix}/"):
+            keys.update(obj['Key'] for obj in page.get('Contents', []))
+        missing.extend(row for row in rows if row['s3Key'] not in keys)
+    return missing
+
+
+def missing_row_update(table, item):
+    """The conditional update that marks one row as missing"""
+    update = {
+        'TableName': table.name,
+        'Key': {
+            'userId': item['userId'],
+            'fileId': item['fileId']
+        },
+        'UpdateExpression': 'SET #status = :missing',
+        # Only if the row still points at the object we found gone (a new
+        # version or a re-pointed blob moves s3Key), is still live (a
+        # trashed row has to stay a tombstone so the purge worker deletes it
+        # and its objects) and is still in the folder we take it out of
+        'ConditionExpression': 's3Key = :scanned_key AND (attribute_not_exists(#status) OR #status = :available)',
+        'ExpressionAttributeNames': {'#status': 'status'},
+        'ExpressionAttributeValues': {
+            ':missing': 'missing',
+            ':scanned_key': item['s3Key'],
+            ':available': 'available'
+        }
+    }
+    if 'folderPath' in item:
+        update['ConditionExpression'] += ' AND folderPath = :folder'
+        update['ExpressionAttributeValues'][':folder'] = item['folderPath']
+    else:
+        update['ConditionExpression'] += ' AND attribute_not_exists(folderPath)'
+    return {'Update': update}
+
+
+def reconcile_storage(table, s3_client, bucket, on_missing=None, usage_store=None, folder_store=None):
+    """Mark rows whose object is gone as 'missing' so they drop out of listings.
+
+    A missing file no longer takes up storage, so with a usage store the
+    same transaction takes it off its owner's usage, and off its folders'
+    totals when a folder store is given too. Returns the (userId, fileId)
+    of the rows that were marked.
+    """
+    missing = []
+    for item in find_missing_objects(table, s3_client, bucket):
+        user_id, file_id = item['userId'], item['fileId']
+        actions = [missing_row_update(table, item)]
+        if usage_store:
+            actions.append(usage_store.update(user_id, -1, -stored_size(item)))
+        if folder_store:
+            actions += folder_store.aggregate_updates(user_id, item.get('folderPath', ROOT), -1, -stored_size(item))
+        try:
+            transact_write(table.meta.client, actions)
+        except ClientError as e:
+            # The row changed, or its folder is being moved: try again next time
+            if 'ConditionalCheckFailed' in cancellation_codes(e):
+                continue
+            raise
+        missing.append((user_id, file_id))
+        if on_missing:
+            on_missing(user_id, file_id)
+    if missing:
+        logger.warning(f"Marked {len(missing)} file(s) as missing from storage")
+    return missing
+
+
+def start_reconciler(table, s3_client, bucket, interval, on_missing=None, usage_store=None, folder_store=None):
+    """Run reconcile_storage every `interval` seconds in a background thread"""
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                reconcile_storage(table, s3_client, bucket, on_missing, usage_store, folder_store)
+            except Exception as e:
+                logger.error(f"Storage reconciliation failed: {str(e)}")
+
+    threading.Thread(target=run, name='storage-reconciler', daemon=True).start()
+    return stop
@@ -0,0 +1,57 @@
+import hashlib
+from services.content_sniffing import sniff_content_type
+
+
+class UploadInspector:
+    """Wraps an upload stream and inspects the bytes as they are read.
+
+    Anything reading through it (the S3 uploader, a hashing pass) gets the
+    exact byte count and SHA-256 for free, in the same pass. The first
+    `sniff_bytes` are peeked up front so the content type is known before
+    the upload starts; they are replayed to the reader, nothing else is
+    buffered.
+    """
+
+    def __init__(self, stream, sniff_bytes=512):
+        self.stream = stream
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+        self.head = self._read_head(sniff_bytes)
+        self._pending = self.head
+
+    def _read_head(self, size):
+        chunks = []
+        remaining = size
+        while remaining > 0:
+            chunk = self.stream.read(remaining)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return b''.join(chunks)
+
+    def read(self, size=-1):
+        if self._pending:
+            if size is None or size < 0:
+                data = self._pending + self.stream.read()
+                self._pending = b''
+            else:
+                data = self._pending[:size]
+                self._pending = self._pending[size:]
+        else:
+            data = self.stream.read(size)
+        self.size += len(data)
+        self._sha256.update(data)
+        return data
+
+    def drain(self, chunk_size=1024 * 1024):
+        """Read the rest of the stream, just to count and hash it"""
+        while self.read(chunk_size):
+            pass
+
+    def content_type(self, declared=None):
+        return sniff_content_type(self.head, declared)
+
+    @property
+    def sha256(self):
+        return self._sha256.hexdigest()
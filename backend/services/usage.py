@@ -0,0 +1,315 @@
+import time
+import logging
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from services.dynamo_batch import cancellation_codes, transact_write
+from services.folders import ROOT, placement_condition
+
+logger = logging.getLogger(__name__)
+
+# One row per user in the usage table (partition key userId, S) with
+# usedBytes and fileCount, plus an optional quotaBytes that overrides the
+# default quota. The counters are only ever changed with ADD, in the same
+# transaction as the file row they account for, so reading a user's usage
+# is one GetItem however many files they have.
+#
+# Every stored file counts, including files in the trash, until its row is
+# deleted for good. Pending (not yet completed) uploads don't, and neither
+# do files the storage reconciler found missing from S3 (it takes them off
+# when it marks them).
+#
+# The row also holds listingVersion, which goes up on every write that
+# changes what the user's listings return. Usage updates bump it as part
+# of their transaction; other writes call bump_listing_version. Responses
+# derive their ETags from it, so a 304 costs one GetItem. listingChangedAt
+# (epoch milliseconds) records when it last went up, because listings read
+# from a GSI may not show that write yet.
+
+# TransactWriteItems accepts at most 100 actions; one is the usage update
+TRANSACTION_LIMIT = 100
+
+
+class QuotaExceeded(Exception):
+    """The change would take the user over their storage quota"""
+
+
+# Rows in these states aren't counted in usage
+UNCOUNTED_STATUSES = ('pending', 'missing')
+
+
+def stored_size(item):
+    # The Lambda API stores the size as fileSize
+    return int(item.get('size', item.get('fileSize', 0)) or 0)
+
+
+class UsageStore:
+    """Per-user storage usage counters and quota checks.
+
+    `default_quota` (bytes) applies to users without their own quotaBytes;
+    0 means unlimited.
+    """
+
+    def __init__(self, dynamodb, table_name, default_quota=0):
+        # The resource's client takes plain Python values, like Table does
+        self.client = dynamodb.meta.client
+        self.table = dynamodb.Table(table_name)
+        self.default_quota = default_quota
+
+    def get(self, user_id):
+        item = self.table.get_item(Key={'userId': user_id}, ConsistentRead=True).get('Item') or {}
+        quota = int(item.get('quotaBytes', self.default_quota))
+        used = int(item.get('usedBytes', 0))
+        return {
+            'usedBytes': used,
+            'fileCount': int(item.get('fileCount', 0)),
+            'quotaBytes': quota or None,
+            'availableBytes': max(0, quota - used) if quota else None
+        }
+
+    def listing_version(self, user_id):
+        return self.listing_state(user_id)[0]
+
+    def listing_state(self, user_id):
+        """The user's listing version and how many seconds ago it last changed"""
+        item = self.table.get_item(
+            Key={'userId': user_id},
+            ProjectionExpression='listingVersion, listingChangedAt',
+            ConsistentRead=True
+        ).get('Item') or {}
+        changed_at = int(item.get('listingChangedAt', 0))
+        return int(item.get('listingVersion', 0)), time.time() - changed_at / 1000
+
+    def bump_listing_version(self, user_id):
+        self.table.update_item(
+            Key={'userId': user_id},
+            UpdateExpression='SET listingChangedAt = :now ADD listingVersion :one',
+            ExpressionAttributeValues={':one': 1, ':now': int(time.time() * 1000)}
+        )
+
+    def check(self, user_id, size):
+        """Raise QuotaExceeded if `size` more bytes wouldn't fit; otherwise return the user's quota (or None).
+
+        Call it before any bytes are transferred, and pass the quota on to
+        `update` so the commit re-checks it atomically.
+        """
+        usage = self.get(user_id)
+        if usage['quotaBytes'] and usage['usedBytes'] + size > usage['quotaBytes']:
+            raise QuotaExceeded(f"Storage quota exceeded: {usage['availableBytes']} bytes available")
+        return usage['quotaBytes']
+
+    def update(self, user_id, files, size, quota=None):
+        """A TransactWriteItems action that adds files/size to a user's usage.
+
+        With a quota, growing usage is conditional on the result still fitting.
+        """
+        update = {
+            'TableName': self.table.name,
+            'Key': {'userId': user_id},
+            'UpdateExpression': 'SET listingChangedAt = :now ADD usedBytes :size, fileCount :files, listingVersion :one',
+            'ExpressionAttributeValues': {':size': size, ':files': files, ':one': 1, ':now': int(time.time() * 1000)}
+        }
+        if quota and size > 0:
+            update['ConditionExpression'] = 'attribute_not_exists(usedBytes) OR usedBytes <= :max_used'
+            update['ExpressionAttributeValues'][':max_used'] = quota - size
+        return {'Update': update}
+
+    def commit(self, actions):
+        """Run a transaction that includes a usage update; raises QuotaExceeded if that update's condition failed.
+
+        Conflicts with concurrent writes are retried. Other cancellations are
+        re-raised as they are, for the caller to inspect with
+        cancellation_codes.
+        """
+        try:
+            transact_write(self.client, actions)
+        except ClientError as e:
+            codes = cancellation_codes(e)
+            for action, code in zip(actions, codes):
+                if code == 'ConditionalCheckFailed' and action.get('Update', {}).get('TableName') == self.table.name:
+                    raise QuotaExceeded("Storage quota exceeded")
+            raise
+
+    def delete_rows(self, files_table, items, folder_store=None):
+        """Delete file rows and take them off their owners' usage, atomically per transaction.
+
+        Rows are deleted up to 99 at a time with one usage update per
+        transaction. With a folder store, the same transactions also take the
+        live (not trashed) files off their folders' totals, which leaves
+        room for fewer rows. A transaction that fails because some row is
+        already gone is retried row by row. Returns the keys of the rows that
+        couldn't be deleted (rows that were already gone count as deleted).
+
+        Each row is only deleted if its status, folder and size are still
+        the ones in `items`, since those decide what comes off the totals;
+        a row that changed meanwhile is read again and retried.
+        """
+        by_user = {}
+        for item in items:
+            by_user.setdefault(item['userId'], []).append(item)
+
+        failed = []
+        for user_id, rows in by_user.items():
+            for chunk in self._delete_chunks(files_table, user_id, rows, folder_store):
+                try:
+                    self._delete_chunk(files_table, user_id, chunk, folder_store)
+                    continue
+                except ClientError as e:
+                    if e.response['Error']['Code'] != 'TransactionCanceledException':
+                        raise
+                for row in chunk:
+                    if not self._delete_row(files_table, user_id, row, folder_store):
+                        failed.append({'userId': user_id, 'fileId': row['fileId']})
+        return failed
+
+    def _delete_row(self, files_table, user_id, row, folder_store, attempts=3):
+        """Delete one row, reading it again whenever it changed since it was read.
+
+        Returns False if it couldn't be deleted.
+        """
+        for _ in range(attempts):
+            try:
+                self._delete_chunk(files_table, user_id, [row], folder_store)
+                return True
+            except ClientError as e:
+                # Only the row's own condition failing means it changed (or is gone)
+                if cancellation_codes(e)[:1] != ['ConditionalCheckFailed']:
+                    logger.warning(f"Failed to delete {row['fileId']}: {str(e)}")
+                    return False
+            row = files_table.get_item(
+                Key={'userId': user_id, 'fileId': row['fileId']},
+                ConsistentRead=True
+            ).get('Item')
+            if row is None:
+                return True
+        logger.warning(f"Failed to delete {row['fileId']}: it kept changing")
+        return False
+
+    def _delete_chunks(self, files_table, user_id, rows, folder_store):
+        """Split rows into chunks whose actions fit in one transaction"""
+        chunk = []
+        for row in rows:
+            if chunk and len(self._delete_actions(files_table, user_id, chunk + [row], folder_store)) > TRANSACTION_LIMIT:
+                yield chunk
+                chunk = []
+            chunk.append(row)
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def _row_delete(files_table, user_id, row):
+        """Delete a row only while it is as read, so it is subtracted once and by what it counted"""
+        condition, values = placement_condition(row)
+        if 'status' in row:
+            status = '#status = :old_status'
+            values[':old_status'] = row['status']
+        else:
+            status = 'attribute_not_exists(#status)'
+        delete = {
+            'TableName': files_table.name,
+            'Key': {'userId': user_id, 'fileId': row['fileId']},
+            'ConditionExpression': f'attribute_exists(fileId) AND {status} AND {condition}',
+            'ExpressionAttributeNames': {'#status': 'status', '#size': 'size'}
+        }
+        if values:
+            delete['ExpressionAttributeValues'] = values
+        return {'Delete': delete}
+
+    def _delete_actions(self, files_table, user_id, rows, folder_store):
+        actions = [self._row_delete(files_table, user_id, row) for row in rows]
+        counted = [row for row in rows if row.get('status') not in UNCOUNTED_STATUSES]
+        if counted:
+            actions.append(self.update(user_id, -len(counted), -sum(stored_size(row) for row in counted)))
+        if folder_store:
+            # Only live files count towards folder totals
+            totals = {}
+            for row in rows:
+                if row.get('status', 'available') == 'available':
+                    files, size = totals.get(row.get('folderPath', ROOT), (0, 0))
+                    totals[row.get('folderPath', ROOT)] = (files - 1, size - stored_size(row))
+            actions += folder_store.combined_updates(user_id, totals)
+        return actions
+
+    def _delete_chunk(self, files_table, user_id, rows, folder_store=None):
+        transact_write(self.client, self._delete_actions(files_table, user_id, rows, folder_store))
+
+
+def scan_usage_segment(files_table, segment, total_segments):
+    """Sum the stored files of one scan segment per user: {userId: [bytes, files]}"""
+    totals = {}
+    scan_args = {
+        'Segment': segment,
+        'TotalSegments': total_segments,
+        'ProjectionExpression': 'userId, #size, fileSize, #status',
+        'ExpressionAttributeNames': {'#size': 'size', '#status': 'status'}
+    }
+    while True:
+        response = files_table.scan(**scan_args)
+        for item in response.get('Items', []):
+            if item.get('status') in UNCOUNTED_STATUSES:
+                continue
+            total = totals.setdefault(item['userId'], [0, 0])
+            total[0] += stored_size(item)
+            total[1] += 1
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return totals
+
+
+def reconcile_usage(files_table, usage_store, segments=8):
+    """Recompute every user's usage from the file rows with a parallel segmented scan.
+
+    Fixes drift from rows removed outside the app (e.g. by a TTL). Uploads
+    that commit while the scan runs can be missed, so run it when the
+    system is quiet. Returns {userId: (old bytes, new bytes)} for the users
+    whose usage changed.
+    """
+    totals = {}
+    with ThreadPoolExecutor(max_workers=segments, thread_name_prefix='usage-scan') as executor:
+        for segment_totals in executor.map(
+            lambda segment: scan_usage_segment(files_table, segment, segments),
+            range(segments)
+        ):
+            for user_id, (size, files) in segment_totals.items():
+                total = totals.setdefault(user_id, [0, 0])
+                total[0] += size
+                total[1] += files
+
+    # Users with a usage row but no files left go back to zero
+    scan_args = {'ProjectionExpression': 'userId, usedBytes, fileCount'}
+    current = {}
+    while True:
+        response = usage_store.table.scan(**scan_args)
+        for item in response.get('Items', []):
+            current[item['userId']] = (int(item.get('usedBytes', 0)), int(item.get('fileCount', 0)))
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    changed = {}
+    now = datetime.utcnow().isoformat()
+    for user_id in set(totals) | set(current):
+        size, files = totals.get(user_id, (0, 0))
+        if current.get(user_id) == (size, files):
+            continue
+        usage_store.table.update_item(
+            Key={'userId': user_id},
+            UpdateExpression='SET usedBytes = :size, fileCount = :files, reconciledAt = :now',
+            ExpressionAttributeValues={':size': size, ':files': files, ':now': now}
+        )
+        changed[user_id] = (current.get(user_id, (0, 0))[0], size)
+    if changed:
+        logger.warning(f"Corrected the storage usage of {len(changed)} user(s)")
+    return changed
+
+
+if __name__ == '__main__':
+    # Recompute usage from scratch: python -m services.usage
+    import os
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    from routes.file_routes import table, usage_store
+    reconcile_usage(table, usage_store, segments=int(os.getenv('USAGE_RECONCILE_SEGMENTS', '8')))
@@ -0,0 +1,169 @@
+import io
+import queue
+import logging
+import zipfile
+import threading
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# Content types that are already compressed; deflating them again only burns CPU
+STORED_CONTENT_PREFIXES = ('image/', 'video/', 'audio/')
+STORED_CONTENT_TYPES = {
+    'application/zip',
+    'application/gzip',
+    'application/x-gzip',
+    'application/x-7z-compressed',
+    'application/x-rar-compressed',
+    'application/x-bzip2',
+    'application/pdf'
+}
+
+# Markers passed from the fetch thread to the zip writer
+_START = object()
+_END = object()
+_DONE = object()
+
+
+class _OutputBuffer(io.RawIOBase):
+    """Write-only, unseekable sink that collects the zip writer's output.
+
+    Being unseekable makes zipfile write data descriptors after each entry
+    instead of seeking back to patch the local headers.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def should_compress(content_type):
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    return not (content_type.startswith(STORED_CONTENT_PREFIXES) or content_type in STORED_CONTENT_TYPES)
+
+
+def unique_names(names):
+    """Make archive member names unique: report.pdf, report (1).pdf, ..."""
+    seen = set()
+    result = []
+    for name in names:
+        candidate = name
+        stem, dot, ext = name.rpartition('.')
+        if not dot:
+            stem, ext = name, ''
+        counter = 1
+        while candidate in seen:
+            candidate = f"{stem} ({counter}){dot}{ext}"
+            counter += 1
+        seen.add(candidate)
+        result.append(candidate)
+    return result
+
+
+def zip_date_time(timestamp):
+    """Turn an ISO timestamp into the (Y, M, D, h, m, s) tuple zip expects"""
+    try:
+        parts = [int(p) for p in timestamp[:19].replace('T', '-').replace(':', '-').split('-')]
+        if len(parts) == 6 and parts[0] >= 1980:
+            return tuple(parts)
+    except (TypeError, ValueError):
+        pass
+    return (1980, 1, 1, 0, 0, 0)
+
+
+def stream_zip(s3_client, bucket, entries, chunk_size=1024 * 1024, prefetch_chunks=8):
+    """Yield a ZIP archive of S3 objects, built on the fly.
+
+    `entries` is a list of dicts with name, s3Key, size, contentType and
+    lastModified (ISO timestamp). A background thread reads objects in
+    `chunk_size` pieces into a queue of at most `prefetch_chunks`, so the
+    next object is already downloading while the current one is being
+    compressed, and memory stays bounded by roughly
+    (prefetch_chunks + 2) * chunk_size however large the archive gets.
+    """
+    chunks = queue.Queue(maxsize=prefetch_chunks)
+    stop = threading.Event()
+
+    def put(item):
+        # Give up if the client went away and nobody is reading anymore
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def fetch():
+        try:
+            for entry in entries:
+                try:
+                    body = s3_client.get_object(Bucket=bucket, Key=entry['s3Key'])['Body']
+                except ClientError as e:
+                    if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                        logger.warning(f"Skipping {entry['s3Key']} in archive: object not found")
+                        continue
+                    raise
+                try:
+                    if not put((_START, entry)):
+                        return
+                    for chunk in body.iter_chunks(chunk_size):
+                        if not put(chunk):
+                            return
+                    if not put((_END, entry)):
+                        return
+                finally:
+                    body.close()
+            put(_DONE)
+        except Exception as e:
+            put(e)
+
+    fetcher = threading.Thread(target=fetch, name='zip-fetch', daemon=True)
+    fetcher.start()
+
+    output = _OutputBuffer()
+    archive = zipfile.ZipFile(output, mode='w', compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+    member = None
+    try:
+        while True:
+            item = chunks.get()
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            if isinstance(item, tuple) and item[0] is _START:
+                entry = item[1]
+                info = zipfile.ZipInfo(entry['name'], date_time=zip_date_time(entry.get('lastModified')))
+                info.compress_type = zipfile.ZIP_DEFLATED if should_compress(entry.get('contentType')) else zipfile.ZIP_STORED
+                # The expected size lets zipfile decide up front whether the entry needs ZIP64
+                info.file_size = int(entry.get('size') or 0)
+                member = archive.open(info, mode='w', force_zip64=info.file_size == 0)
+            elif isinstance(item, tuple) and item[0] is _END:
+                member.close()
+                member = None
+            else:
+                member.write(item)
+            data = output.drain()
+            if data:
+                yield data
+        archive.close()
+        yield output.drain()
+    finally:
+        stop.set()
+
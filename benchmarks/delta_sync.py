@@ -0,0 +1,60 @@
+"""Bytes sent by a delta against a full re-upload, at several edit ratios.
+
+Run from the repository root:
+    python benchmarks/delta_sync.py [file size in MB]
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from botocore.response import StreamingBody
+from services.delta_sync import block_signatures, build_delta, default_block_size, normalize_recipe
+
+
+def main():
+    size = int(float(sys.argv[1] if len(sys.argv) > 1 else 8) * 1024 * 1024)
+    edit_size = 4096
+    rng = random.Random(0)
+    original = rng.randbytes(size)
+    block_size = default_block_size(size)
+    signatures = block_signatures(StreamingBody(io.BytesIO(original), size), block_size)
+    print(f"{size / 1024 / 1024:.0f}MB file, {block_size // 1024}KB blocks, "
+          f"{len(json.dumps(signatures)):,} bytes of signatures")
+    print(f"{'edited':>8} {'sent':>14} {'of full':>8} {'diff ms':>9}")
+
+    for ratio in (0, 0.001, 0.01, 0.05, 0.25, 1):
+        data = bytearray(original)
+        # Scattered 4KB overwrites, plus one insertion that shifts everything after it
+        for _ in range(int(size * ratio / edit_size)):
+            offset = rng.randrange(size - edit_size)
+            data[offset:offset + edit_size] = rng.randbytes(edit_size)
+        if ratio:
+            data[size // 2:size // 2] = b'inserted'
+        data = bytes(data)
+
+        start = time.perf_counter()
+        ops, literal = build_delta(signatures, block_size, data)
+        elapsed = time.perf_counter() - start
+
+        # What the server would assemble from the recipe must be the new file
+        segments, total = normalize_recipe(ops, block_size, size)
+        rebuilt, consumed = bytearray(), 0
+        for segment in segments:
+            if segment[0] == 'copy':
+                rebuilt += original[segment[1]:segment[1] + segment[2]]
+            else:
+                rebuilt += literal[consumed:consumed + segment[1]]
+                consumed += segment[1]
+        assert bytes(rebuilt) == data and total == len(data)
+
+        sent = len(literal) + len(json.dumps(ops))
+        print(f"{ratio:8.1%} {sent:>14,} {sent / len(data):8.1%} {elapsed * 1000:9.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""Lambda list_user_files latency as the table grows, against the full-table
+scan it replaced, on a moto DynamoDB stand-in.
+
+One user keeps the same number of files while other users' rows are added
+around them. The query path should stay flat; the scan grows with the table.
+Items scanned is what DynamoDB bills reads on and is the number to watch;
+moto's own latency grows with its in-memory table, and its ConsumedCapacity
+is a flat 1 per request, so it isn't reported.
+
+Run from the repository root:
+    python benchmarks/lambda_listing.py [table sizes...]
+"""
+import os
+import sys
+import time
+import uuid
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_deploy'))
+
+# boto3 clients are created at import time and need a region; the warm
+# listing cache would turn every repeat into a hit
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ['LISTING_CACHE_TTL'] = '0'
+
+import boto3
+from moto import mock_aws
+
+USER_FILES = 500
+PAGE_SIZE = 100
+RUNS = 5
+
+
+def create_tables():
+    dynamodb = boto3.resource('dynamodb')
+    dynamodb.create_table(
+        TableName='UserFiles',
+        KeySchema=[{'AttributeName': 'userId', 'KeyType': 'HASH'},
+                   {'AttributeName': 'fileId', 'KeyType': 'RANGE'}],
+        AttributeDefinitions=[{'AttributeName': 'userId', 'AttributeType': 'S'},
+                              {'AttributeName': 'fileId', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    dynamodb.create_table(
+        TableName='UserUsage',
+        KeySchema=[{'AttributeName': 'userId', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'userId', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+
+
+def seed(table, count, users):
+    with table.batch_writer() as batch:
+        for i in range(count):
+            user_id = users[i % len(users)]
+            file_id = str(uuid.uuid4())
+            batch.put_item(Item={
+                'userId': user_id,
+                'fileId': file_id,
+                'fileName': f'file-{i}.txt',
+                'fileType': 'text/plain',
+                'fileSize': 1024 + i,
+                'uploadDate': '2024-01-01T00:00:00',
+                'fileKey': f'{user_id}/{file_id}/file-{i}.txt',
+                'status': 'available'
+            })
+
+
+class CountingTable:
+    """Wraps the Lambda's table to count reads and the items they scanned."""
+
+    def __init__(self, table):
+        self.table = table
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.scanned = 0
+
+    def query(self, **kwargs):
+        response = self.table.query(**kwargs)
+        self.requests += 1
+        self.scanned += response['ScannedCount']
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.table, name)
+
+
+def scan_listing(table, user_id):
+    # The old list_user_files: a scan filtered on userId, following pages
+    requests = scanned = 0
+    args = {
+        'FilterExpression': 'userId = :userId',
+        'ExpressionAttributeValues': {':userId': user_id}
+    }
+    files = []
+    while True:
+        response = table.scan(**args)
+        requests += 1
+        scanned += response['ScannedCount']
+        files.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return files, requests, scanned
+        args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def timed(fn):
+    samples = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return result, statistics.median(samples) * 1000
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [1000, 5000, 20000]
+    with mock_aws():
+        create_tables()
+        import lambda_function
+        lambda_function.verify_token = lambda token: {'uid': token}
+        lambda_function.print = lambda *args, **kwargs: None
+        counting = CountingTable(lambda_function.table)
+        lambda_function.table = counting
+        headers = {'authorization': 'Bearer alice'}
+
+        seed(counting.table, USER_FILES, ['alice'])
+        seeded = USER_FILES
+        print(f'{USER_FILES} files for the listed user, pages of {PAGE_SIZE}')
+        print(f'{"table":>7}  {"path":<16}{"ms":>9}{"reads":>7}{"scanned":>9}')
+        for size in sizes:
+            if size > seeded:
+                others = [f'user-{i}' for i in range(max(1, (size - seeded) // USER_FILES))]
+                seed(counting.table, size - seeded, others)
+                seeded = size
+
+            counting.reset()
+            response, ms = timed(lambda: lambda_function.list_user_files(headers))
+            assert response['statusCode'] == 200, response
+            print(f'{seeded:>7,}  {"query, full":<16}{ms:>9.1f}'
+                  f'{counting.requests // RUNS:>7}{counting.scanned // RUNS:>9,}')
+
+            def paged():
+                pages, token = 0, None
+                while True:
+                    params = {'limit': str(PAGE_SIZE)}
+                    if token:
+                        params['nextToken'] = token
+                    response = lambda_function.list_user_files(headers, params)
+                    assert response['statusCode'] == 200, response
+                    pages += 1
+                    token = response['headers'].get('X-Next-Token')
+                    if not token:
+                        return pages
+
+            counting.reset()
+            pages, ms = timed(paged)
+            print(f'{"":>7}  {f"query, {pages} pages":<16}{ms:>9.1f}'
+                  f'{counting.requests // RUNS:>7}{counting.scanned // RUNS:>9,}')
+
+            (files, requests, scanned), ms = timed(lambda: scan_listing(counting.table, 'alice'))
+            assert len(files) == USER_FILES
+            print(f'{"":>7}  {"scan (old)":<16}{ms:>9.1f}{requests:>7}{scanned:>9,}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Parse time and peak RSS of the Lambda's parse_multipart_form_data against
+the split-based parser it replaced, for 1MB-50MB uploads (Linux only).
+
+Run from the repository root:
+    python benchmarks/lambda_multipart.py [sizes in MB...]
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import base64
+import resource
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_deploy'))
+
+# boto3 clients are created at import time and need a region
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+from lambda_function import get_multipart_boundary, parse_multipart_form_data
+
+
+def main():
+    def split_parse(body, headers, is_base64_encoded=False):
+        # The copies the old parser made: decode, split on the boundary, strip
+        # the part, split headers from content, rstrip the content
+        boundary = b'--' + get_multipart_boundary(headers['content-type'])
+        if is_base64_encoded:
+            body = base64.b64decode(body)
+        for part in body.split(boundary)[1:-1]:
+            header_data, content = part.strip(b'\r\n').split(b'\r\n\r\n', 1)
+            if b'filename=' in header_data:
+                return content.rstrip(b'\r\n-'), None, None, None
+        return None, None, None, 'No valid file found in multipart data'
+
+    def measure(parse, event_body, headers):
+        # Each run gets its own process so peak RSS isn't shared between runs
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            start = time.perf_counter()
+            file_content, _, _, error = parse(event_body, headers, True)
+            elapsed = time.perf_counter() - start
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+            os.write(write_fd, json.dumps([elapsed, peak, len(file_content), error]).encode())
+            os._exit(0)
+        os.close(write_fd)
+        with os.fdopen(read_fd) as result:
+            elapsed, peak, size, error = json.loads(result.read())
+        os.waitpid(pid, 0)
+        return elapsed, peak, size, error
+
+    sizes = [int(size) for size in sys.argv[1:]] or [1, 5, 10, 25, 50]
+    boundary = uuid.uuid4().hex
+    headers = {'content-type': f'multipart/form-data; boundary={boundary}'}
+    print(f"{'size':>6}  {'parser':<16} {'parse ms':>9} {'peak RSS +MB':>13}")
+    for mb in sizes:
+        data = os.urandom(mb * 1024 * 1024)
+        body = (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="data.bin"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'
+        ).encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+        event_body = base64.b64encode(body).decode('ascii')
+        del body
+        for label, parse in (('split (old)', split_parse), ('memoryview', parse_multipart_form_data)):
+            elapsed, peak, size, error = measure(parse, event_body, headers)
+            if error or size != len(data):
+                print(f"{label} failed: {error or f'{size} bytes parsed'}")
+                continue
+            print(f"{mb:>4}MB  {label:<16} {elapsed * 1000:9.1f} {peak / 1024:13.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""Thumbnails per second per core, for a camera-sized JPEG and a PNG.
+
+Run from the repository root:
+    python benchmarks/preview_pipeline.py [workers]
+"""
+import io
+import os
+import sys
+import time
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from services.preview_pipeline import render_previews
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    sizes = (128, 512)
+    samples = {}
+    for format in ('JPEG', 'PNG'):
+        image = Image.effect_mandelbrot((3000, 2000), (-2.0, -1.0, 1.0, 1.0), 100).convert('RGB')
+        output = io.BytesIO()
+        image.save(output, format=format)
+        samples[format] = output.getvalue()
+
+    for format, data in samples.items():
+        started = time.perf_counter()
+        rendered = 0
+        while time.perf_counter() - started < 3:
+            render_previews(data, sizes)
+            rendered += 1
+        single = rendered / (time.perf_counter() - started)
+
+        count = workers * 10
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            # Warm the workers up first so process start-up isn't timed
+            list(executor.map(render_previews, [data] * workers, [sizes] * workers))
+            started = time.perf_counter()
+            list(executor.map(render_previews, [data] * count, [sizes] * count))
+            pooled = count / (time.perf_counter() - started)
+
+        print(f"{format} 3000x2000 ({len(data) / 1024 / 1024:.1f}MB), sizes {sizes}: "
+              f"{single:.1f}/s on one core, {pooled:.1f}/s on {workers} workers ({pooled / workers:.1f}/s per worker)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""Serialization time and response size for a 10k-row listing.
+
+Run from the repository root:
+    python benchmarks/response_encoding.py [rows]
+"""
+import os
+import sys
+import json
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from decimal import Decimal
+from services.response_encoding import (
+    FastJSONProvider, available_encodings, compress, encode_json, orjson
+)
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    listing = [
+        {
+            'fileId': str(uuid.uuid4()),
+            'filename': f'IMG_{n:05d}.jpg',
+            'size': Decimal(1000 + n * 37),
+            'contentType': 'image/jpeg',
+            'uploadedAt': f'2025-01-{n % 28 + 1:02d}T12:{n % 60:02d}:00.000000',
+            'lastModified': f'2025-01-{n % 28 + 1:02d}T12:{n % 60:02d}:00.000000',
+            'previews': [Decimal(128), Decimal(512)],
+            'folder': f'/photos/{n % 12}/'
+        }
+        for n in range(rows)
+    ]
+
+    def timed(label, fn, repeat=10):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = fn()
+        print(f"{label:<28} {(time.perf_counter() - start) / repeat * 1000:8.2f} ms  {len(result):>10,} bytes")
+        return result
+
+    print(f"{rows:,} rows")
+    timed('json + int()/str() copies', lambda: json.dumps([
+        {**row, 'size': int(row['size']), 'previews': [int(p) for p in row['previews']]} for row in listing
+    ]).encode('utf-8'))
+    body = timed('json, Decimal default', lambda: json.dumps(listing, default=FastJSONProvider.default).encode('utf-8'))
+    if orjson is not None:
+        body = timed('orjson, Decimal default', lambda: encode_json(listing, default=FastJSONProvider.default))
+    for encoding in available_encodings():
+        timed(f'  + {encoding}', lambda: compress(body, encoding))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Build time, memory and query latency for one user's search index.
+
+Run from the repository root:
+    python benchmarks/search_index.py [files]
+"""
+import os
+import sys
+import time
+import uuid
+import random
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from services.search_index import UserSearchIndex, from_timestamp
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = random.Random(0)
+    words = ['invoice', 'report', 'holiday', 'photo', 'budget', 'draft', 'final', 'scan', 'contract',
+             'meeting', 'notes', 'project', 'backup', 'resume', 'presentation', 'video', 'export']
+    kinds = [('jpg', 'image/jpeg'), ('png', 'image/png'), ('pdf', 'application/pdf'),
+             ('docx', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'),
+             ('mp4', 'video/mp4'), ('txt', 'text/plain')]
+    files = []
+    for n in range(count):
+        extension, content_type = rng.choice(kinds)
+        files.append({
+            'fileId': str(uuid.UUID(int=rng.getrandbits(128))),
+            'filename': f"{'_'.join(rng.sample(words, 2))}_{rng.randrange(2015, 2026)}_{n:06d}.{extension}",
+            'size': rng.randrange(1, 500 * 1024 * 1024),
+            'contentType': content_type,
+            'uploadedAt': from_timestamp(1.5e9 + n * 3000)
+        })
+
+    def build_index():
+        index = UserSearchIndex()
+        for file in files:
+            index.add(file)
+        return index
+
+    # Memory is measured on a separate build, since tracing slows it down
+    tracemalloc.start()
+    index = build_index()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    started = time.perf_counter()
+    index = build_index()
+    build = time.perf_counter() - started
+    print(f"{count:,} files: built in {build:.2f}s, {memory / 1024 / 1024:.1f}MB "
+          f"({len(index.tokens):,} tokens, {len(index.grams):,} trigrams)")
+
+    cutoff = 1.5e9 + count * 1500
+    queries = [
+        ('prefix', dict(query='inv', mode='prefix')),
+        ('prefix, 2 words', dict(query='hol 2019', mode='prefix')),
+        ('token', dict(query='budget', mode='token')),
+        ('substring', dict(query='ject_20', mode='substring')),
+        ('prefix + filters', dict(query='photo', content_type='image/', min_size=1024 * 1024, after=cutoff)),
+        ('filters only', dict(content_type='video/', max_size=100 * 1024 * 1024)),
+        ('no query', dict()),
+    ]
+    for label, kwargs in queries:
+        repeat = 20
+        started = time.perf_counter()
+        for _ in range(repeat):
+            total, results = index.search(**kwargs)
+        print(f"{label:<18} {(time.perf_counter() - started) / repeat * 1000:8.2f} ms  {total:>7,} matches")
+
+    started = time.perf_counter()
+    for file in files[:count // 10]:
+        index.remove(file['fileId'])
+        index.add(file)
+    print(f"update (remove + add): {(time.perf_counter() - started) / (count // 10) * 1e6:.1f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""End-to-end check of POST /api/files/bulk-delete on moto S3 and DynamoDB.
+
+Uploads 150 files (by default) through the API into the root and two nested
+folders, then bulk deletes them in MAX_BULK_DELETE_FILE_IDS-sized requests
+together with some unknown ids. The defaults take more than one request, and
+the first request more than one transaction; uploads go one at a time
+through moto, so thousands of files take well over ten minutes. Afterwards every row and object must be gone
+and the usage record and folder totals must be back at zero, while a second
+user's file is untouched. Prints the timings and exits non-zero on the first
+mismatch. With --dedup, uploads go through the content store instead, half of
+them sharing bytes, and every blob reference must be gone too.
+
+Run from the repository root:
+    python benchmarks/verify_bulk_delete.py [files] [--dedup]
+"""
+import io
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+os.environ.update(
+    AWS_DEFAULT_REGION='us-east-1',
+    AWS_ACCESS_KEY_ID='testing',
+    AWS_SECRET_ACCESS_KEY='testing',
+    S3_BUCKET_NAME='verify-bulk-delete',
+    CONTENT_DEDUP=str('--dedup' in sys.argv).lower(),
+    PREVIEW_WORKERS='0'
+)
+os.environ.setdefault('MAX_BULK_DELETE_FILE_IDS', '120')
+
+import boto3
+from moto import mock_aws
+from flask import Flask
+
+from services.content_store import STATS_KEY
+
+FOLDERS = ['/', '/projects/', '/projects/2024/']
+
+
+def key_schema(*keys):
+    return [{'AttributeName': name, 'KeyType': kind} for name, kind in zip(keys, ('HASH', 'RANGE'))]
+
+
+def create_tables():
+    dynamodb = boto3.client('dynamodb')
+
+    def create(name, keys, attributes, **indexes):
+        dynamodb.create_table(
+            TableName=name,
+            KeySchema=key_schema(*keys),
+            AttributeDefinitions=[{'AttributeName': attribute, 'AttributeType': kind}
+                                  for attribute, kind in attributes.items()],
+            BillingMode='PAY_PER_REQUEST',
+            **indexes
+        )
+
+    def index(name, *keys):
+        return {'IndexName': name, 'KeySchema': key_schema(*keys), 'Projection': {'ProjectionType': 'ALL'}}
+
+    create('UserFiles', ('userId', 'fileId'), {
+        'userId': 'S', 'fileId': 'S', 'uploadedAt': 'S', 'filename': 'S', 'size': 'N',
+        'parentKey': 'S', 'tombstone': 'S', 'deletedAt': 'S'
+    }, GlobalSecondaryIndexes=[
+        index('userId-uploadedAt-index', 'userId', 'uploadedAt'),
+        index('userId-filename-index', 'userId', 'filename'),
+        index('userId-size-index', 'userId', 'size'),
+        index('parentKey-filename-index', 'parentKey', 'filename'),
+        index('tombstone-deletedAt-index', 'tombstone', 'deletedAt')
+    ])
+    create('UserFolders', ('userId', 'path'), {'userId': 'S', 'path': 'S', 'parentPath': 'S'},
+           LocalSecondaryIndexes=[index('userId-parentPath-index', 'userId', 'parentPath')])
+    create('UserUsage', ('userId',), {'userId': 'S'})
+    create('ContentBlobs', ('contentHash',), {'contentHash': 'S'})
+    create('UploadSessions', ('userId', 'sessionId'), {'userId': 'S', 'sessionId': 'S'})
+    boto3.client('s3').create_bucket(Bucket=os.environ['S3_BUCKET_NAME'])
+
+
+def check(condition, message):
+    if not condition:
+        print(f'FAIL: {message}')
+        sys.exit(1)
+    print(f'ok: {message}')
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if arg != '--dedup']
+    count = int(args[0]) if args else 150
+    with mock_aws():
+        create_tables()
+        import auth.firebase
+        auth.firebase.verify_token = lambda token: {'uid': token}
+        from routes import file_routes
+        from routes.file_routes import file_bp
+        from routes.folder_routes import folder_bp
+
+        app = Flask(__name__)
+        app.register_blueprint(file_bp, url_prefix='/api/files')
+        app.register_blueprint(folder_bp, url_prefix='/api/folders')
+        client = app.test_client()
+        bucket = os.environ['S3_BUCKET_NAME']
+
+        def headers(user_id):
+            return {'Authorization': f'Bearer {user_id}'}
+
+        def upload(user_id, name, data, folder):
+            response = client.post('/api/files/upload', headers=headers(user_id), data={
+                'file': (io.BytesIO(data), name, 'text/plain'),
+                'folder': folder
+            }, content_type='multipart/form-data')
+            assert response.status_code == 200, response.get_json()
+            return response.get_json()['fileId']
+
+        for path in FOLDERS[1:]:
+            response = client.post('/api/folders', headers=headers('alice'), json={'path': path})
+            assert response.status_code == 201, response.get_json()
+
+        start = time.perf_counter()
+        file_ids = []
+        for i in range(count):
+            # Every other file repeats an earlier one's bytes (shared with --dedup)
+            data = f'file {i // 2 if i % 2 else i}'.encode()
+            file_ids.append(upload('alice', f'file-{i}.txt', data, FOLDERS[i % len(FOLDERS)]))
+        bob_file = upload('bob', 'bob.txt', b'file 0', '/')
+        print(f'uploaded {count:,} files in {time.perf_counter() - start:.1f}s')
+
+        usage = file_routes.usage_store.get('alice')
+        check(usage['fileCount'] == count, f'usage counts {count:,} files before the delete')
+
+        unknown = [str(uuid.uuid4()) for _ in range(10)]
+        requested = file_ids + unknown
+        batch = file_routes.MAX_BULK_DELETE_FILE_IDS
+        deleted = not_found = failed = 0
+        start = time.perf_counter()
+        for offset in range(0, len(requested), batch):
+            response = client.post('/api/files/bulk-delete', headers=headers('alice'),
+                                   json={'fileIds': requested[offset:offset + batch]})
+            assert response.status_code == 200, response.get_json()
+            body = response.get_json()
+            deleted += body['deleted']
+            not_found += body['notFound']
+            failed += body['failed']
+        elapsed = time.perf_counter() - start
+        print(f'bulk deleted {deleted:,} files in {elapsed:.1f}s '
+              f'({len(range(0, len(requested), batch))} requests of up to {batch:,})')
+
+        check(deleted == count and not_found == len(unknown) and failed == 0,
+              f'results: {deleted:,} deleted, {not_found} not found, {failed} failed')
+
+        rows = file_routes.table.query(
+            KeyConditionExpression='userId = :user_id',
+            ExpressionAttributeValues={':user_id': 'alice'},
+            Select='COUNT'
+        )['Count']
+        check(rows == 0, 'no file rows left')
+
+        objects = [obj['Key'] for page in boto3.client('s3').get_paginator('list_objects_v2').paginate(Bucket=bucket)
+                   for obj in page.get('Contents', [])]
+        bob_key = file_routes.table.get_item(Key={'userId': 'bob', 'fileId': bob_file})['Item']['s3Key']
+        check(objects == [bob_key], "only bob's object is left in the bucket")
+
+        if file_routes.content_store:
+            blobs = [blob for blob in file_routes.content_store.table.scan()['Items']
+                     if blob['contentHash'] != STATS_KEY]
+            check(len(blobs) == 1 and blobs[0]['contentHash'].startswith('bob/'),
+                  "only bob's blob reference is left")
+
+        usage = file_routes.usage_store.get('alice')
+        check(usage['fileCount'] == 0 and usage['usedBytes'] == 0, 'usage is back at zero')
+
+        for path in FOLDERS:
+            folder = file_routes.folder_store.get('alice', path)
+            check(folder['subtreeFileCount'] == 0 and folder['subtreeSize'] == 0, f'{path} totals are back at zero')
+
+        response = client.get(f'/api/files/{bob_file}', headers=headers('bob'))
+        check(response.status_code == 200, "bob's file is untouched")
+
+
+if __name__ == '__main__':
+    main()
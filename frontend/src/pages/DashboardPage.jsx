@@ -15,7 +15,7 @@ import {
 import { useAuth } from "../contexts/AuthContext";
 import { ThemeContext } from "../contexts/ThemeContext";
 import FileUpload from "../components/FileUpload";
-import { getUserFiles, deleteFile, getFileDownloadUrl } from "../services/api";
+import { getUserFilesPage, deleteFile, getFileDownloadUrl } from "../services/api";
 import {
   FaFilePdf,
   FaFileWord,
@@ -205,7 +205,9 @@ const FileRow = ({ file, isDarkMode, onDelete }) => {
     fileSize: file.fileSize || 0,
     uploadDate: file.uploadDate || new Date().toISOString(),
     fileKey: file.fileKey || '',
-    downloadUrl: file.downloadUrl || '',
+    downloadUrl: file.downloadUrl || file.url || '',
+    downloadUrlExpiresAt: file.downloadUrlExpiresAt || 0,
+    thumbnailUrl: file.thumbnailUrl || '',
     
     // Frontend expected properties (for backward compatibility)
     filename: file.fileName || file.filename || "Unnamed File",
@@ -232,7 +234,12 @@ const FileRow = ({ file, isDarkMode, onDelete }) => {
 
     try {
       setIsDownloading(true);
-      const { url, filename } = await getFileDownloadUrl(safeFile.fileId);
+      // Use the URL embedded in the listing while it is still fresh,
+      // otherwise ask the server for one
+      const { url, filename } =
+        safeFile.downloadUrl && Date.now() < safeFile.downloadUrlExpiresAt
+          ? { url: safeFile.downloadUrl, filename: safeFile.filename }
+          : await getFileDownloadUrl(safeFile.fileId);
 
       if (!url) {
         throw new Error("No download URL received");
@@ -287,9 +294,19 @@ const FileRow = ({ file, isDarkMode, onDelete }) => {
             isDarkMode ? "text-light" : "text-dark"
           }`}
         >
-          <span className="me-2" style={{ fontSize: "1.2rem" }}>
-            {fileIcon}
-          </span>
+          {safeFile.thumbnailUrl ? (
+            <img
+              src={safeFile.thumbnailUrl}
+              alt=""
+              loading="lazy"
+              className="me-2 rounded"
+              style={{ width: "32px", height: "32px", objectFit: "cover" }}
+            />
+          ) : (
+            <span className="me-2" style={{ fontSize: "1.2rem" }}>
+              {fileIcon}
+            </span>
+          )}
           {safeFile.filename}
         </td>
         <td className={isDarkMode ? "text-light" : "text-dark"}>
@@ -398,6 +415,8 @@ const DashboardPage = () => {
   const [uploadSuccess, setUploadSuccess] = useState("");
   const [fetchError, setFetchError] = useState("");
   const [showDeleteSuccess, setShowDeleteSuccess] = useState(false);
+  const [nextPageToken, setNextPageToken] = useState(null);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
 
   // Handle file deletion
   const handleDeleteFile = async (fileId) => {
@@ -432,10 +451,11 @@ const DashboardPage = () => {
         throw new Error("Authentication token not found");
       }
 
-      const files = await getUserFiles();
+      const { files, nextToken } = await getUserFilesPage({ includeUrls: true });
 
       if (Array.isArray(files)) {
         setUploadedFiles(files);
+        setNextPageToken(nextToken);
         // Only clear error if we got a valid response
         setFetchError("");
       } else {
@@ -465,6 +485,26 @@ const DashboardPage = () => {
     }
   };
 
+  // Fetch the next page of files and append it to the list
+  const loadMoreFiles = async () => {
+    if (!nextPageToken) return;
+
+    try {
+      setIsLoadingMore(true);
+      const { files, nextToken } = await getUserFilesPage({
+        nextToken: nextPageToken,
+        includeUrls: true,
+      });
+      setUploadedFiles((prevFiles) => [...prevFiles, ...files]);
+      setNextPageToken(nextToken);
+    } catch (error) {
+      console.error("Failed to load more files:", error);
+      setFetchError("Failed to load more files. Please try again.");
+    } finally {
+      setIsLoadingMore(false);
+    }
+  };
+
   // Initial fetch when component mounts
   useEffect(() => {
     fetchUserFiles();
@@ -628,6 +668,17 @@ const DashboardPage = () => {
                       ))}
                     </tbody>
                   </Table>
+                  {nextPageToken && (
+                    <div className="text-center mt-3">
+                      <Button
+                        variant={isDarkMode ? "outline-light" : "outline-primary"}
+                        onClick={loadMoreFiles}
+                        disabled={isLoadingMore}
+                      >
+                        {isLoadingMore ? "Loading..." : "Load more"}
+                      </Button>
+                    </div>
+                  )}
                 </div>
               )}
             </Card.Body>
@@ -97,13 +97,15 @@ export const uploadFile = async (file, onUploadProgress) => {
  * Get a pre-signed URL for file upload
  * @param {string} fileName - The name of the file
  * @param {string} fileType - The MIME type of the file
+ * @param {number} fileSize - The size of the file in bytes
  * @returns {Promise} - The pre-signed URL response
  */
-export const getPresignedUrl = async (fileName, fileType) => {
+export const getPresignedUrl = async (fileName, fileType, fileSize) => {
   try {
     const response = await api.post('/files/presigned-url', {
       fileName,
       fileType,
+      fileSize,
     });
     return response.data;
   } catch (error) {
@@ -112,21 +114,50 @@ export const getPresignedUrl = async (fileName, fileType) => {
   }
 };
 
+// How long a download URL embedded in a listing is used before asking for a fresh one
+const DOWNLOAD_URL_TRUST_MS = 30 * 60 * 1000;
+
 /**
- * Get all files for the current user
- * @returns {Promise<Array>} - Array of file objects
+ * Get one page of files for the current user
+ * @param {Object} options - Listing options
+ * @param {number} options.limit - Page size
+ * @param {string} options.nextToken - Token from the previous page
+ * @param {string} options.sort - Sort order: newest, name or size
+ * @param {boolean} options.includeUrls - Embed a download URL in every file
+ * @returns {Promise<Object>} - The files and the token for the next page (or null)
  */
-export const getUserFiles = async () => {
+export const getUserFilesPage = async ({ limit, nextToken, sort, includeUrls } = {}) => {
   try {
-    const response = await api.get('/files');
+    const response = await api.get('/files', {
+      params: { limit, nextToken, sort, includeUrls },
+    });
     // The backend returns the files array directly, not in a 'files' property
-    return Array.isArray(response.data) ? response.data : [];
+    let files = Array.isArray(response.data) ? response.data : [];
+    if (includeUrls) {
+      // Embedded URLs expire server-side after an hour; only trust them for half that
+      const downloadUrlExpiresAt = Date.now() + DOWNLOAD_URL_TRUST_MS;
+      files = files.map((file) => ({ ...file, downloadUrlExpiresAt }));
+    }
+    return {
+      files,
+      // The continuation token comes back in a response header
+      nextToken: response.headers['x-next-token'] || null,
+    };
   } catch (error) {
     console.error('Error fetching user files:', error);
     throw error;
   }
 };
 
+/**
+ * Get the first page of files for the current user
+ * @returns {Promise<Array>} - Array of file objects
+ */
+export const getUserFiles = async () => {
+  const { files } = await getUserFilesPage();
+  return files;
+};
+
 /**
  * Delete a file
  * @param {string} fileId - The ID of the file to delete
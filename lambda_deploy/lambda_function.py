@@ -1,16 +1,44 @@
+import io
 import os
+import gzip
 import json
 import boto3
 from datetime import datetime
 import uuid
 import base64
+import re
+import time
+import hashlib
+from decimal import Decimal
+from collections import OrderedDict
 import firebase_admin
 from firebase_admin import auth, credentials
 
+# Shared with the Flask API (copies of backend/services/content_sniffing.py
+# and backend/auth/token_cache.py and key_store.py)
+from content_sniffing import sniff_content_type
+from token_cache import TokenCache
+from key_store import GoogleKeyStore
+
+# Optional speedups: a faster JSON encoder and better compression codecs
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 # Initialize AWS services
 s3 = boto3.client('s3')
 dynamodb = boto3.resource('dynamodb')
 table = dynamodb.Table(os.environ.get('FILES_TABLE_NAME', 'UserFiles'))
+usage_table = dynamodb.Table(os.environ.get('USAGE_TABLE_NAME', 'UserUsage'))
 
 # Initialize Firebase Admin (only if credentials are provided)
 firebase_creds = json.loads(os.environ.get('FIREBASE_SERVICE_ACCOUNT', '{}'))
@@ -18,6 +46,53 @@ if firebase_creds and not firebase_admin._apps:
     cred = credentials.Certificate(firebase_creds)
     firebase_admin.initialize_app(cred)
 
+# Verified ID tokens and Google's token signing keys, kept across warm
+# invocations. These are copies of backend/auth/token_cache.py and
+# key_store.py. Lambda freezes the container between invocations, so
+# instead of the key store's background thread the keys are refreshed
+# lazily once the Cache-Control max-age has passed. GOOGLE_CERTS_FILE loads
+# {kid: PEM} keys from a local file instead (fixture mode for offline
+# testing). Without FIREBASE_PROJECT_ID, or while no usable keys are
+# available, tokens are verified by Firebase Admin.
+FIREBASE_PROJECT_ID = os.environ.get('FIREBASE_PROJECT_ID') or firebase_creds.get('project_id')
+token_cache = TokenCache(
+    max_size=int(os.environ.get('TOKEN_CACHE_SIZE', '256')),
+    max_ttl=int(os.environ.get('TOKEN_CACHE_TTL', '3600'))
+)
+key_store = None
+if FIREBASE_PROJECT_ID:
+    key_store = GoogleKeyStore(
+        FIREBASE_PROJECT_ID,
+        certs_file=os.environ.get('GOOGLE_CERTS_FILE'),
+        grace_period=int(os.environ.get('SIGNING_KEYS_GRACE_PERIOD', str(6 * 3600))),
+        request_timeout=2
+    )
+
+def verify_token(token):
+    """Verify a Firebase ID token, reusing earlier verifications in this container."""
+    decoded_token = token_cache.get(token)
+    if decoded_token is None:
+        if key_store is not None:
+            key_store.refresh_if_expired()
+        if key_store is not None and key_store.ready:
+            decoded_token = key_store.verify(token)
+        else:
+            decoded_token = auth.verify_id_token(token)
+        token_cache.put(token, decoded_token)
+    return decoded_token
+
+def json_default(value):
+    """DynamoDB returns every number as a Decimal; send them as plain numbers."""
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dump_json(body):
+    """Serialize a response body, with orjson when it's packaged with the function."""
+    if orjson is not None:
+        return orjson.dumps(body, default=json_default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(body, default=json_default)
+
 def create_response(status_code, body, headers=None):
     """Create a properly formatted HTTP response with CORS headers."""
     # Default headers with CORS support
@@ -25,8 +100,9 @@ def create_response(status_code, body, headers=None):
         'Content-Type': 'application/json',
         'Access-Control-Allow-Origin': '*',
         'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-        'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Requested-With',
-        'Access-Control-Allow-Credentials': 'true'
+        'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Requested-With, X-File-Type, If-None-Match',
+        'Access-Control-Allow-Credentials': 'true',
+        'Access-Control-Expose-Headers': 'X-Next-Token, ETag'
     }
     
     # Add any additional headers if provided
@@ -38,7 +114,7 @@ def create_response(status_code, body, headers=None):
     if body is not None:
         try:
             if isinstance(body, (dict, list)):
-                body_str = json.dumps(body)
+                body_str = dump_json(body)
             else:
                 body_str = str(body)
         except Exception as e:
@@ -52,6 +128,55 @@ def create_response(status_code, body, headers=None):
         'body': body_str
     }
 
+# Response bodies of at least COMPRESSION_MIN_BYTES are compressed when the
+# client accepts it: zstd or brotli if those packages are bundled, else gzip
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', '1024'))
+
+def negotiate_encoding(accept_encoding):
+    """Pick a content coding for an Accept-Encoding header, or None for identity."""
+    weights = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        if not name.strip():
+            continue
+        try:
+            q = float(params.strip()[2:]) if params.strip().startswith('q=') else 1.0
+        except ValueError:
+            q = 0.0
+        weights[name.strip().lower()] = q
+    encodings = (['zstd'] if zstandard else []) + (['br'] if brotli else []) + ['gzip']
+    best, best_q = None, 0.0
+    for encoding in encodings:
+        q = weights.get(encoding, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+def compress_response(response, request_headers):
+    """Compress a create_response() result if it's large and the client accepts it."""
+    body = response.get('body') or ''
+    if response.get('isBase64Encoded') or response['statusCode'] != 200 or len(body) < COMPRESSION_MIN_BYTES:
+        return response
+    encoding = negotiate_encoding(request_headers.get('accept-encoding'))
+    if not encoding:
+        return response
+    data = body.encode('utf-8')
+    if encoding == 'zstd':
+        data = zstandard.ZstdCompressor(level=3).compress(data)
+    elif encoding == 'br':
+        data = brotli.compress(data, quality=5)
+    else:
+        data = gzip.compress(data, compresslevel=5, mtime=0)
+    # The body goes back base64-encoded, which has to still be a saving
+    encoded = base64.b64encode(data).decode('ascii')
+    if len(encoded) >= len(body):
+        return response
+    headers = {**response['headers'], 'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'}
+    # Compressed and plain bodies differ byte for byte, so the ETag becomes weak
+    if headers.get('ETag', '').startswith('"'):
+        headers['ETag'] = 'W/' + headers['ETag']
+    return {**response, 'headers': headers, 'body': encoded, 'isBase64Encoded': True}
+
 def get_user_id_from_headers(headers):
     """Extract and verify user ID from Authorization header."""
     auth_header = headers.get('authorization', '')
@@ -60,7 +185,7 @@ def get_user_id_from_headers(headers):
         
     try:
         token = auth_header.split(' ')[1]
-        decoded_token = auth.verify_id_token(token)
+        decoded_token = verify_token(token)
         return decoded_token['uid']
     except Exception as e:
         print(f"Token verification failed: {e}")
@@ -73,7 +198,7 @@ def handle_auth(request_body):
         return create_response(400, {'error': 'Token is required'})
     
     try:
-        decoded_token = auth.verify_id_token(token)
+        decoded_token = verify_token(token)
         return create_response(200, {
             'uid': decoded_token['uid'],
             'email': decoded_token.get('email', ''),
@@ -84,172 +209,160 @@ def handle_auth(request_body):
         print(f"Auth error: {str(e)}")
         return create_response(401, {'error': 'Authentication failed'})
 
+# Matches `key=value` / `key="quoted value"` pairs in a header like Content-Disposition
+HEADER_PARAM_PATTERN = re.compile(r';\s*([\w\-*]+)\s*=\s*("(?:[^"\\]|\\.)*"|[^;]*)')
+
+def parse_header_params(value):
+    """Split a header like `form-data; name="file"; filename="a.txt"` into its parameters."""
+    params = {}
+    for key, param in HEADER_PARAM_PATTERN.findall(value):
+        param = param.strip()
+        if len(param) >= 2 and param[0] == param[-1] == '"':
+            param = param[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+        params[key.lower()] = param
+    return params
+
+class BufferReader(io.RawIOBase):
+    """Read-only, seekable file object over a memoryview.
+
+    Lets us hand a slice of the request body to boto3 as a stream without
+    copying it into a new bytes object first.
+    """
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast('B')
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        size = min(len(b), len(self._view) - self._pos)
+        b[:size] = self._view[self._pos:self._pos + size]
+        self._pos += size
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        else:
+            self._pos = len(self._view) + offset
+        self._pos = max(0, min(self._pos, len(self._view)))
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def __len__(self):
+        return len(self._view)
+
+def parse_multipart(body, boundary):
+    """Parse a multipart body in a single pass.
+
+    Returns (fields, files): `fields` maps form field names to strings and
+    `files` is a list of dicts whose `data` is a memoryview into `body`, so
+    no file content is copied. Raises ValueError on malformed input.
+    """
+    view = memoryview(body)
+    delimiter = b'--' + boundary
+    fields = {}
+    files = []
+
+    pos = body.find(delimiter)
+    if pos < 0:
+        raise ValueError('Boundary not found in body')
+
+    while True:
+        pos += len(delimiter)
+        # `--boundary--` closes the body
+        if body[pos:pos + 2] == b'--':
+            break
+
+        # Skip any transport padding after the delimiter, up to the line break
+        line_end = body.find(b'\r\n', pos)
+        if line_end < 0:
+            raise ValueError('Unexpected end of body after boundary')
+        headers_start = line_end + 2
+
+        if body[headers_start:headers_start + 2] == b'\r\n':
+            # Part with no headers at all
+            headers_end = headers_start
+            data_start = headers_start + 2
+        else:
+            headers_end = body.find(b'\r\n\r\n', headers_start)
+            if headers_end < 0:
+                raise ValueError('Part headers are not terminated')
+            data_start = headers_end + 4
+
+        # The part's data runs up to the CRLF in front of the next delimiter
+        data_end = body.find(b'\r\n' + delimiter, data_start)
+        if data_end < 0:
+            raise ValueError('Missing closing boundary')
+
+        part_headers = {}
+        for line in bytes(view[headers_start:headers_end]).split(b'\r\n'):
+            name, sep, value = line.partition(b':')
+            if sep:
+                part_headers[name.strip().lower().decode('latin-1')] = value.strip().decode('utf-8', errors='replace')
+
+        disposition = part_headers.get('content-disposition', '')
+        params = parse_header_params(disposition)
+        data = view[data_start:data_end]
+
+        if 'filename' in params:
+            files.append({
+                'name': params.get('name'),
+                'filename': params['filename'],
+                'content_type': part_headers.get('content-type', 'application/octet-stream'),
+                'data': data
+            })
+        elif 'name' in params:
+            fields[params['name']] = bytes(data).decode('utf-8', errors='replace')
+
+        pos = data_end + 2
+
+    return fields, files
+
+def get_multipart_boundary(content_type):
+    """Pull the boundary parameter out of a multipart Content-Type header."""
+    boundary = parse_header_params(content_type).get('boundary')
+    return boundary.encode('latin-1') if boundary else None
+
 def parse_multipart_form_data(body, headers, is_base64_encoded=False):
-    """Parse multipart/form-data request body with proper binary handling."""
-    print("Starting multipart form data parsing...")
+    """Parse a multipart/form-data request body and return its first file.
+
+    Returns (file_content, file_name, content_type, error). file_content is a
+    memoryview into the decoded body rather than a copy.
+    """
+    content_type = headers.get('content-type', '')
+    if 'multipart/form-data' not in content_type:
+        return None, None, None, f'Content-Type must be multipart/form-data, got {content_type}'
+
+    boundary = get_multipart_boundary(content_type)
+    if not boundary:
+        return None, None, None, 'No boundary found in Content-Type'
+
     try:
-        content_type = headers.get('content-type', '')
-        print(f"Content-Type: {content_type}")
-        if 'multipart/form-data' not in content_type:
-            error_msg = f'Content-Type must be multipart/form-data, got {content_type}'
-            print(error_msg)
-            return None, None, None, error_msg
-            
-        # Get boundary from content-type
-        boundary = None
-        for part in content_type.split(';'):
-            part = part.strip()
-            if part.startswith('boundary='):
-                boundary = '--' + part[9:].strip('\'"')  # Add -- prefix if not present
-                print(f"Found boundary: {boundary}")
-                break
-                
-        if not boundary:
-            error_msg = 'No boundary found in Content-Type'
-            print(error_msg)
-            return None, None, None, error_msg
+        # API Gateway base64-encodes binary bodies; this is the only copy we make
+        if is_base64_encoded:
+            body = base64.b64decode(body)
+        elif isinstance(body, str):
+            body = body.encode('latin-1')
 
-        # Get raw body
-        try:
-            print(f"is_base64_encoded: {is_base64_encoded}")
-            print(f"Body type: {type(body)}")
-            print(f"Body length: {len(body) if hasattr(body, '__len__') else 'N/A'}")
-            
-            if is_base64_encoded:
-                print("Decoding base64 body...")
-                try:
-                    body = base64.b64decode(body)
-                    print("Successfully decoded base64 body")
-                except Exception as e:
-                    error_msg = f'Error decoding base64 body: {str(e)}'
-                    print(error_msg)
-                    return None, None, None, error_msg
-            
-            if not isinstance(body, bytes):
-                print("Converting body to bytes...")
-                try:
-                    body = body.encode('latin-1')
-                except Exception as e:
-                    error_msg = f'Error encoding body to bytes: {str(e)}'
-                    print(error_msg)
-                    return None, None, None, error_msg
-
-            # Split into parts using binary boundary
-            print(f"Splitting body with boundary: {boundary}")
-            boundary_bytes = boundary.encode('latin-1')
-            parts = body.split(boundary_bytes)
-            print(f"Split into {len(parts)} parts")
-            
-            if len(parts) < 3:  # Should have at least 3 parts (preamble, content, epilogue)
-                error_msg = f'Invalid multipart format: not enough parts (got {len(parts)} parts, expected at least 3)'
-                print(error_msg)
-                return None, None, None, error_msg
-                
-        except Exception as e:
-            error_msg = f'Error processing request body: {str(e)}'
-            print(error_msg)
-            import traceback
-            print(traceback.format_exc())
-            return None, None, None, error_msg
-            
-        file_content = None
-        file_name = None
-        content_type = 'application/octet-stream'
-        
-        print(f"Processing {len(parts) - 2} parts (excluding boundary parts)")
-        
-        # Process each part (skip first and last empty parts)
-        for i, part in enumerate(parts[1:-1], 1):
-            print(f"\n--- Processing part {i} ---")
-            try:
-                # Clean up the part
-                part = part.strip(b'\r\n')
-                if not part:
-                    print("Empty part, skipping")
-                    continue
-                
-                print(f"Part size: {len(part)} bytes")
-                
-                # Split headers from content
-                try:
-                    header_data, content = part.split(b'\r\n\r\n', 1)
-                    print(f"Headers size: {len(header_data)} bytes")
-                    print(f"Content size: {len(content)} bytes")
-                    
-                    headers = {}
-                    print("Parsing headers...")
-                    
-                    # Parse headers
-                    for j, header_line in enumerate(header_data.split(b'\r\n'), 1):
-                        if b':' not in header_line:
-                            print(f"  Skipping malformed header line {j}")
-                            continue
-                        try:
-                            name, value = header_line.split(b':', 1)
-                            name = name.strip().lower()
-                            value = value.strip()
-                            headers[name] = value
-                            print(f"  Header: {name.decode('latin-1')}: {value.decode('latin-1', errors='replace')}")
-                        except Exception as e:
-                            print(f"  Warning: Error parsing header line {j}: {str(e)}")
-                            print(f"  Header line content: {header_line}")
-                    
-                    # Check if this is a file part
-                    if b'content-disposition' in headers:
-                        print("Found content-disposition header")
-                        try:
-                            disposition = headers[b'content-disposition'].decode('latin-1', errors='replace')
-                            print(f"  Disposition: {disposition}")
-                            
-                            if 'filename=' in disposition:
-                                # Extract filename
-                                file_name = disposition.split('filename=')[1].split(';')[0].strip('"\'')
-                                print(f"  Found file: {file_name}")
-                                
-                                # Get content type if available
-                                if b'content-type' in headers:
-                                    content_type = headers[b'content-type'].decode('latin-1', errors='replace')
-                                    print(f"  Content-Type: {content_type}")
-                                
-                                # Get file content (remove trailing \r\n-- if present)
-                                file_content = content.rstrip(b'\r\n-')
-                                print(f"  File content size: {len(file_content)} bytes")
-                                
-                                # Found our file, no need to check other parts
-                                break  
-                                
-                        except Exception as e:
-                            error_msg = f"Error parsing content-disposition: {str(e)}"
-                            print(f"  {error_msg}")
-                            import traceback
-                            print(traceback.format_exc())
-                            continue
-                    else:
-                        print("No content-disposition header found in this part")
-                        
-                except Exception as e:
-                    error_msg = f"Error splitting headers from content: {str(e)}"
-                    print(error_msg)
-                    import traceback
-                    print(traceback.format_exc())
-                    continue
-                    
-            except Exception as e:
-                error_msg = f"Unexpected error processing part {i}: {str(e)}"
-                print(error_msg)
-                import traceback
-                print(traceback.format_exc())
-                continue
-        
-        if not file_content or not file_name:
-            return None, None, None, 'No valid file found in multipart data'
-            
-        return file_content, file_name, content_type, None
-        
+        fields, files = parse_multipart(body, boundary)
     except Exception as e:
-        error_msg = f'Error parsing multipart data: {str(e)}'
-        print(error_msg)
-        return None, None, None, error_msg
+        return None, None, None, f'Error parsing multipart data: {str(e)}'
+
+    if not files or not files[0]['filename']:
+        return None, None, None, 'No valid file found in multipart data'
+
+    file_part = files[0]
+    return file_part['data'], file_part['filename'], file_part['content_type'], None
 
 def handle_file_upload(event, headers):
     """Handle file upload to S3 and save metadata to DynamoDB."""
@@ -294,29 +407,150 @@ def handle_file_upload(event, headers):
     if not file_content or not file_name:
         return create_response(400, {'error': 'File content and name are required'})
     
+    # Ensure file_content is a bytes-like buffer
+    if isinstance(file_content, str):
+        file_content = file_content.encode('latin-1')
+    
+    return store_uploaded_file(user_id, file_name, file_type, file_content)
+
+# Storage usage: one row per user in the usage table (shared with the Flask
+# API) with usedBytes and fileCount, changed only with ADD in the same
+# transaction as the file row. quotaBytes on the row overrides the default;
+# STORAGE_QUOTA_GB=0 means no quota. Every usage update also bumps the
+# row's listingVersion, which versions the user's listings for ETags.
+STORAGE_QUOTA_BYTES = int(float(os.environ.get('STORAGE_QUOTA_GB', '15')) * 1024 * 1024 * 1024)
+
+class QuotaExceededError(Exception):
+    pass
+
+def get_usage(user_id):
+    """Read a user's usage record: one GetItem, however many files they have."""
+    item = usage_table.get_item(Key={'userId': user_id}, ConsistentRead=True).get('Item') or {}
+    quota = int(item.get('quotaBytes', STORAGE_QUOTA_BYTES))
+    used = int(item.get('usedBytes', 0))
+    return {
+        'usedBytes': used,
+        'fileCount': int(item.get('fileCount', 0)),
+        'quotaBytes': quota or None,
+        'availableBytes': max(0, quota - used) if quota else None
+    }
+
+def check_quota(user_id, size):
+    """Raise QuotaExceededError if `size` more bytes don't fit; otherwise return the quota (or None)."""
+    usage = get_usage(user_id)
+    if usage['quotaBytes'] and usage['usedBytes'] + size > usage['quotaBytes']:
+        raise QuotaExceededError(f"Storage quota exceeded: {usage['availableBytes']} bytes available")
+    return usage['quotaBytes']
+
+def usage_update(user_id, files, size, quota=None):
+    """TransactWriteItems action adding to a user's usage; growth is conditional on fitting the quota."""
+    update = {
+        'TableName': usage_table.name,
+        'Key': {'userId': user_id},
+        'UpdateExpression': 'SET listingChangedAt = :now ADD usedBytes :size, fileCount :files, listingVersion :one',
+        'ExpressionAttributeValues': {':size': size, ':files': files, ':one': 1, ':now': int(time.time() * 1000)}
+    }
+    if quota and size > 0:
+        update['ConditionExpression'] = 'attribute_not_exists(usedBytes) OR usedBytes <= :max_used'
+        update['ExpressionAttributeValues'][':max_used'] = quota - size
+    return {'Update': update}
+
+def get_listing_version(user_id):
+    """Version of the user's listings, bumped by every upload and delete."""
+    item = usage_table.get_item(
+        Key={'userId': user_id},
+        ProjectionExpression='listingVersion',
+        ConsistentRead=True
+    ).get('Item') or {}
+    return int(item.get('listingVersion', 0))
+
+def make_etag(*parts):
+    return '"' + hashlib.sha256(json.dumps(parts, default=str).encode('utf-8')).hexdigest()[:32] + '"'
+
+def url_window():
+    """Responses with presigned URLs change ETag every half URL lifetime, so cached URLs stay valid."""
+    return int(time.time() // max(1, DOWNLOAD_URL_EXPIRY // 2))
+
+def is_not_modified(headers, etag):
+    """True if the request's If-None-Match already has this ETag."""
+    tags = [tag.strip() for tag in headers.get('if-none-match', '').split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+def not_modified_response(etag):
+    return create_response(304, None, {'ETag': etag, 'Cache-Control': 'private, no-cache'})
+
+def cancellation_codes(error):
+    if error.response['Error']['Code'] != 'TransactionCanceledException':
+        return []
+    return [reason.get('Code', 'None') for reason in error.response.get('CancellationReasons', [])]
+
+def transact_write(actions, max_retries=5):
+    """TransactWriteItems, retried with backoff while a concurrent transaction on the same items cancels it.
+
+    Same as the Flask API's services.dynamo_batch.transact_write: writes by
+    one user share their usage row, so they can conflict. Any other
+    cancellation (a failed condition in particular) is raised straight away.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return dynamodb.meta.client.transact_write_items(TransactItems=actions)
+        except s3.exceptions.ClientError as e:
+            codes = cancellation_codes(e)
+            if 'TransactionConflict' not in codes or 'ConditionalCheckFailed' in codes or attempt == max_retries:
+                raise
+            time.sleep(min(2.0, 0.05 * (2 ** attempt)))
+
+def commit_with_usage(actions):
+    """Run a transaction whose last action is the usage update; QuotaExceededError if that failed."""
     try:
+        transact_write(actions)
+    except s3.exceptions.ClientError as e:
+        codes = cancellation_codes(e)
+        if len(codes) == len(actions) and codes[-1] == 'ConditionalCheckFailed':
+            raise QuotaExceededError('Storage quota exceeded')
+        raise
+
+def get_storage_usage(headers):
+    """Return the caller's storage usage and quota."""
+    user_id = get_user_id_from_headers(headers)
+    if not user_id:
+        return create_response(401, {'error': 'Unauthorized'})
+    try:
+        return create_response(200, get_usage(user_id))
+    except Exception as e:
+        print(f"Usage error: {str(e)}")
+        return create_response(500, {'error': 'Failed to read storage usage'})
+
+def store_uploaded_file(user_id, file_name, file_type, file_content):
+    """Write an uploaded file's bytes to S3 and its metadata to DynamoDB."""
+    try:
+        try:
+            quota = check_quota(user_id, len(file_content))
+        except QuotaExceededError as e:
+            return create_response(507, {'error': str(e)})
+        
         file_id = str(uuid.uuid4())
         file_key = f"{user_id}/{file_id}/{file_name}"
         
-        # Ensure file_content is bytes
-        if not isinstance(file_content, bytes):
-            file_content = file_content.encode('latin-1')
-            
-        file_data = file_content
+        # API Gateway hands us the whole body, so the exact size, checksum
+        # and sniffed type all come from that one buffer without copying it
+        file_type = sniff_content_type(file_content, file_type)
+        sha256 = hashlib.sha256(file_content)
+        file_data = BufferReader(file_content)
         
-        # Upload to S3
+        # Upload to S3 straight from the request buffer. S3 verifies the
+        # checksum and rejects the object if the bytes don't match.
         s3.put_object(
             Bucket=os.environ.get('FILE_BUCKET_NAME', 'google-drive-clone-files'),
             Key=file_key,
             Body=file_data,
-            ContentType=file_type
+            ContentType=file_type,
+            ChecksumAlgorithm='SHA256',
+            ChecksumSHA256=base64.b64encode(sha256.digest()).decode('ascii')
         )
         
-        # Calculate TTL (1 day from now in seconds since epoch)
-        ttl_days = 1  # Set TTL to 1 day
-        ttl_timestamp = int((datetime.utcnow().timestamp() + (ttl_days * 24 * 60 * 60)))
-        
-        # Save metadata to DynamoDB with TTL
+        # Save metadata to DynamoDB. No expiresAt here: the row is counted
+        # in the user's usage, so it must only go away through a delete.
         item = {
             'fileId': file_id,
             'userId': user_id,
@@ -324,67 +558,442 @@ def handle_file_upload(event, headers):
             'fileKey': file_key,
             'fileType': file_type,
             'fileSize': len(file_data),
-            'uploadDate': datetime.utcnow().isoformat(),
-            'expiresAt': ttl_timestamp  # TTL attribute for DynamoDB
+            'sha256': sha256.hexdigest(),
+            'uploadDate': datetime.utcnow().isoformat()
         }
-        table.put_item(Item=item)
+        try:
+            commit_with_usage([
+                {'Put': {'TableName': table.name, 'Item': item}},
+                usage_update(user_id, 1, item['fileSize'], quota)
+            ])
+        except QuotaExceededError as e:
+            s3.delete_object(Bucket=os.environ.get('FILE_BUCKET_NAME', 'google-drive-clone-files'), Key=file_key)
+            return create_response(507, {'error': str(e)})
+        except s3.exceptions.ClientError:
+            # Throttled, conflicting or invalid: nothing records the object, so drop it
+            s3.delete_object(Bucket=os.environ.get('FILE_BUCKET_NAME', 'google-drive-clone-files'), Key=file_key)
+            raise
+        invalidate_listing_cache(user_id)
         
         return create_response(200, {
             'message': 'File uploaded successfully',
             'fileId': file_id,
-            'fileName': file_name
+            'fileName': file_name,
+            'fileType': file_type,
+            'fileSize': item['fileSize'],
+            'sha256': item['sha256']
         })
         
     except Exception as e:
         print(f"Upload error: {str(e)}")
         return create_response(500, {'error': 'Failed to upload file'})
 
-def list_user_files(headers):
-    """List all files for the authenticated user."""
+def handle_raw_upload(event, headers):
+    """Handle PUT /files/{name} with the raw file bytes as the request body.
+
+    Skips multipart and JSON/base64 wrapping entirely: the only decode is
+    API Gateway's own base64 encoding of binary bodies. The file's MIME type
+    comes from the X-File-Type header (falling back to Content-Type).
+    """
+    user_id = get_user_id_from_headers(headers)
+    if not user_id:
+        return create_response(401, {'error': 'Unauthorized'})
+
+    # The route may be declared as /files/{fileName} or share the /files/{fileId}
+    # variable. API Gateway has already percent-decoded path parameters, so
+    # decoding again would turn a literal %25 or %2F in the name into % or /.
+    path_parameters = event.get('pathParameters') or {}
+    file_name = os.path.basename(path_parameters.get('fileName') or path_parameters.get('fileId') or '')
+    if not file_name:
+        return create_response(400, {'error': 'File name is required'})
+
+    file_type = headers.get('x-file-type') or headers.get('content-type') or 'application/octet-stream'
+
+    body = event.get('body') or ''
+    try:
+        if event.get('isBase64Encoded', False):
+            file_content = base64.b64decode(body)
+        elif isinstance(body, str):
+            file_content = body.encode('utf-8')
+        else:
+            file_content = body
+    except Exception as e:
+        print(f"Error decoding raw upload body: {str(e)}")
+        return create_response(400, {'error': 'Invalid request body'})
+
+    if not file_content:
+        return create_response(400, {'error': 'File content is required'})
+
+    return store_uploaded_file(user_id, file_name, file_type, file_content)
+
+# Presigned (direct-to-S3) uploads. Bytes go straight from the browser to S3,
+# so they are not bound by the Lambda payload limit.
+PRESIGNED_UPLOAD_EXPIRY = int(os.environ.get('PRESIGNED_UPLOAD_EXPIRY', '900'))
+MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE', str(5 * 1024 * 1024 * 1024)))
+
+def create_presigned_upload(request_body, headers):
+    """Reserve a metadata row and return a presigned POST/PUT for the upload."""
+    user_id = get_user_id_from_headers(headers)
+    if not user_id:
+        return create_response(401, {'error': 'Unauthorized'})
+
+    file_name = os.path.basename(request_body.get('fileName') or '')
+    file_type = request_body.get('fileType') or 'application/octet-stream'
+    method = (request_body.get('method') or 'POST').upper()
+    if not file_name:
+        return create_response(400, {'error': 'fileName is required'})
+    if method not in ('POST', 'PUT'):
+        return create_response(400, {'error': 'method must be POST or PUT'})
+    try:
+        file_size = int(request_body.get('fileSize', 0))
+    except (TypeError, ValueError):
+        return create_response(400, {'error': 'fileSize must be an integer'})
+    if file_size <= 0 or file_size > MAX_UPLOAD_SIZE:
+        return create_response(400, {'error': f'fileSize must be between 1 and {MAX_UPLOAD_SIZE} bytes'})
+
+    try:
+        try:
+            check_quota(user_id, file_size)
+        except QuotaExceededError as e:
+            return create_response(507, {'error': str(e)})
+
+        bucket = os.environ.get('FILE_BUCKET_NAME', 'google-drive-clone-files')
+        file_id = str(uuid.uuid4())
+        file_key = f"{user_id}/{file_id}/{file_name}"
+
+        if method == 'POST':
+            # Policy limits the size and pins the content type
+            presigned = s3.generate_presigned_post(
+                Bucket=bucket,
+                Key=file_key,
+                Fields={'Content-Type': file_type},
+                Conditions=[
+                    {'Content-Type': file_type},
+                    ['content-length-range', 1, file_size]
+                ],
+                ExpiresIn=PRESIGNED_UPLOAD_EXPIRY
+            )
+            upload = {'url': presigned['url'], 'fields': presigned['fields']}
+        else:
+            url = s3.generate_presigned_url(
+                'put_object',
+                Params={'Bucket': bucket, 'Key': file_key, 'ContentType': file_type, 'ContentLength': file_size},
+                ExpiresIn=PRESIGNED_UPLOAD_EXPIRY
+            )
+            upload = {'url': url, 'headers': {'Content-Type': file_type}}
+
+        # Reserve the row; it is hidden from listings until completed and
+        # expires through the table's TTL if the upload never finishes.
+        ttl_timestamp = int(datetime.utcnow().timestamp() + 24 * 60 * 60)
+        table.put_item(
+            Item={
+                'fileId': file_id,
+                'userId': user_id,
+                'fileName': file_name,
+                'fileKey': file_key,
+                'fileType': file_type,
+                'fileSize': file_size,
+                'status': 'pending',
+                'uploadDate': datetime.utcnow().isoformat(),
+                'expiresAt': ttl_timestamp
+            },
+            ConditionExpression='attribute_not_exists(fileId)'
+        )
+
+        return create_response(200, {
+            'fileId': file_id,
+            'fileName': file_name,
+            'method': method,
+            'expiresIn': PRESIGNED_UPLOAD_EXPIRY,
+            **upload
+        })
+
+    except Exception as e:
+        print(f"Presigned upload error: {str(e)}")
+        return create_response(500, {'error': 'Failed to create upload URL'})
+
+def complete_presigned_upload(file_id, headers):
+    """Check a presigned upload landed in S3 and finalize its metadata row."""
+    user_id = get_user_id_from_headers(headers)
+    if not user_id:
+        return create_response(401, {'error': 'Unauthorized'})
+
+    try:
+        response = table.get_item(Key={'userId': user_id, 'fileId': file_id})
+        if 'Item' not in response:
+            return create_response(404, {'error': 'Upload not found'})
+
+        item = response['Item']
+        if item.get('status') != 'pending':
+            return create_response(409, {'error': 'Upload already completed'})
+
+        bucket = os.environ.get('FILE_BUCKET_NAME', 'google-drive-clone-files')
+        try:
+            head = s3.head_object(Bucket=bucket, Key=item['fileKey'])
+        except s3.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return create_response(409, {'error': 'File has not been uploaded yet'})
+            raise
+
+        file_size = head['ContentLength']
+        if file_size > int(item['fileSize']) or head.get('ContentType') != item['fileType']:
+            s3.delete_object(Bucket=bucket, Key=item['fileKey'])
+            table.delete_item(Key={'userId': user_id, 'fileId': file_id})
+            return create_response(400, {'error': 'Uploaded file does not match the upload request'})
+
+        try:
+            commit_with_usage([
+                {
+                    'Update': {
+                        'TableName': table.name,
+                        'Key': {'userId': user_id, 'fileId': file_id},
+                        # Without the TTL the pending row's expiry would delete the finished file
+                        'UpdateExpression': 'SET #status = :available, fileSize = :size REMOVE expiresAt',
+                        'ConditionExpression': '#status = :pending',
+                        'ExpressionAttributeNames': {'#status': 'status'},
+                        'ExpressionAttributeValues': {':available': 'available', ':pending': 'pending', ':size': file_size}
+                    }
+                },
+                usage_update(user_id, 1, file_size, get_usage(user_id)['quotaBytes'])
+            ])
+        except QuotaExceededError as e:
+            s3.delete_object(Bucket=bucket, Key=item['fileKey'])
+            table.delete_item(Key={'userId': user_id, 'fileId': file_id})
+            return create_response(507, {'error': str(e)})
+        except s3.exceptions.ClientError as e:
+            if cancellation_codes(e)[:1] == ['ConditionalCheckFailed']:
+                return create_response(409, {'error': 'Upload already completed'})
+            # Like the quota case: the upload can't be completed, so don't
+            # leave an object behind that nothing counts
+            s3.delete_object(Bucket=bucket, Key=item['fileKey'])
+            table.delete_item(Key={'userId': user_id, 'fileId': file_id})
+            raise
+        invalidate_listing_cache(user_id)
+
+        return create_response(200, {
+            'message': 'File uploaded successfully',
+            'fileId': file_id,
+            'fileName': item['fileName']
+        })
+
+    except Exception as e:
+        print(f"Complete upload error: {str(e)}")
+        return create_response(500, {'error': 'Failed to complete upload'})
+
+# Attributes returned by list_user_files. Reading only these keeps the
+# consumed read capacity proportional to what we actually send back.
+LIST_PROJECTION = 'fileId, fileName, fileType, fileSize, uploadDate, fileKey, #status'
+MAX_LIST_PAGE_SIZE = 1000
+
+# Cache of listing results for this container: an LRU of at most
+# LISTING_CACHE_MAX_ENTRIES pages, each kept for LISTING_CACHE_TTL seconds
+# (like the Flask API's MemoryBackend). Uploads and deletes handled here
+# invalidate the user's pages immediately. Pages are also keyed by the
+# user's listing version, so writes handled by other containers (or the
+# Flask API) make them miss and the old pages age out of the LRU; writes that
+# don't bump it (e.g. TTL expiry of pending rows, which are never listed
+# anyway) become visible after LISTING_CACHE_TTL.
+LISTING_CACHE_TTL = int(os.environ.get('LISTING_CACHE_TTL', '30'))
+LISTING_CACHE_MAX_ENTRIES = int(os.environ.get('LISTING_CACHE_MAX_ENTRIES', '1000'))
+_listing_cache = OrderedDict()
+_listing_cache_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+def get_cached_listing(key):
+    """Return the cached (files, headers) for a page, dropping it if it has expired"""
+    entry = _listing_cache.get(key)
+    if entry is None:
+        return None
+    if entry[0] <= time.time():
+        del _listing_cache[key]
+        return None
+    _listing_cache.move_to_end(key)
+    return entry[1], entry[2]
+
+def cache_listing(key, files, response_headers):
+    _listing_cache[key] = (time.time() + LISTING_CACHE_TTL, files, response_headers)
+    _listing_cache.move_to_end(key)
+    while len(_listing_cache) > LISTING_CACHE_MAX_ENTRIES:
+        _listing_cache.popitem(last=False)
+
+def invalidate_listing_cache(user_id):
+    keys = [key for key in _listing_cache if key[0] == user_id]
+    for key in keys:
+        del _listing_cache[key]
+    if keys:
+        _listing_cache_stats['invalidations'] += 1
+
+def encode_cursor(last_evaluated_key):
+    """Turn a DynamoDB LastEvaluatedKey into an opaque, URL-safe token."""
+    return base64.urlsafe_b64encode(json.dumps(last_evaluated_key).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+
+DOWNLOAD_URL_EXPIRY = int(os.environ.get('DOWNLOAD_URL_EXPIRY', '3600'))
+MAX_BATCH_FILE_IDS = 100  # BatchGetItem limit
+
+def generate_download_url(file_key):
+    """Sign a GET URL for a file. This is local CPU work, no network call."""
+    return s3.generate_presigned_url(
+        'get_object',
+        Params={
+            'Bucket': os.environ.get('FILE_BUCKET_NAME', 'google-drive-clone-files'),
+            'Key': file_key
+        },
+        ExpiresIn=DOWNLOAD_URL_EXPIRY
+    )
+
+def with_download_urls(files, include_urls):
+    """Return the listing with a downloadUrl added to every file, if requested."""
+    if not include_urls:
+        return files
+    return [{**f, 'downloadUrl': generate_download_url(f['fileKey'])} if f.get('fileKey') else f for f in files]
+
+def batch_get_files(user_id, file_ids, projection, consistent=False):
+    """Fetch a user's file rows with BatchGetItem (100 keys per call), retrying unprocessed keys."""
+    items = []
+    for start in range(0, len(file_ids), 100):
+        request_items = {
+            table.name: {
+                'Keys': [{'userId': user_id, 'fileId': file_id} for file_id in file_ids[start:start + 100]],
+                'ProjectionExpression': projection,
+                'ExpressionAttributeNames': {'#status': 'status'},
+                'ConsistentRead': consistent
+            }
+        }
+        for attempt in range(6):
+            response = dynamodb.batch_get_item(RequestItems=request_items)
+            items.extend(response.get('Responses', {}).get(table.name, []))
+            request_items = response.get('UnprocessedKeys') or {}
+            if not request_items:
+                break
+            time.sleep(min(2.0, 0.05 * (2 ** attempt)))
+        if request_items:
+            raise RuntimeError('BatchGetItem left keys unprocessed')
+    return items
+
+def get_download_urls(request_body, headers):
+    """Return presigned download URLs for up to MAX_BATCH_FILE_IDS files in one call."""
+    user_id = get_user_id_from_headers(headers)
+    if not user_id:
+        return create_response(401, {'error': 'Unauthorized'})
+
+    file_ids = request_body.get('fileIds')
+    if not isinstance(file_ids, list) or not file_ids:
+        return create_response(400, {'error': 'fileIds must be a non-empty list'})
+    if len(file_ids) > MAX_BATCH_FILE_IDS:
+        return create_response(400, {'error': f'At most {MAX_BATCH_FILE_IDS} fileIds per request'})
+    file_ids = list(dict.fromkeys(str(file_id) for file_id in file_ids))
+
+    try:
+        # One BatchGetItem instead of a get_item per file
+        items = batch_get_files(user_id, file_ids, 'fileId, fileName, fileType, fileKey, #status')
+
+        found = {}
+        for item in items:
+            if item.get('status', 'available') == 'available':
+                found[item['fileId']] = {
+                    'fileId': item['fileId'],
+                    'fileName': item.get('fileName'),
+                    'fileType': item.get('fileType'),
+                    'downloadUrl': generate_download_url(item['fileKey'])
+                }
+
+        return create_response(200, {
+            'files': [found[file_id] for file_id in file_ids if file_id in found],
+            'notFound': [file_id for file_id in file_ids if file_id not in found]
+        })
+
+    except Exception as e:
+        print(f"Batch download URL error: {str(e)}")
+        return create_response(500, {'error': 'Failed to generate download URLs'})
+
+def list_user_files(headers, query_params=None):
+    """List files for the authenticated user.
+
+    Queries the user's partition instead of scanning the table. Without a
+    `limit` every page is followed so the list is never truncated at 1MB;
+    with `limit` one page is returned and the X-Next-Token response header
+    carries the cursor for the next one (pass it back as `nextToken`).
+    `includeUrls=true` embeds a presigned downloadUrl in every file.
+    """
+    query_params = query_params or {}
+    include_urls = str(query_params.get('includeUrls', 'false')).lower() == 'true'
     try:
-        print("List files headers:", json.dumps(headers, default=str))
         user_id = get_user_id_from_headers(headers)
         if not user_id:
             print("Unauthorized: No user ID found in headers")
             return create_response(401, {'error': 'Unauthorized'})
         
-        print(f"Fetching files for user: {user_id}")
+        query_args = {
+            'KeyConditionExpression': 'userId = :userId',
+            # Hide presigned uploads that haven't been completed yet
+            'FilterExpression': 'attribute_not_exists(#status) OR #status = :available',
+            'ProjectionExpression': LIST_PROJECTION,
+            # Strongly consistent, so a page cached or tagged with the
+            # version read below has every write that version counts
+            'ConsistentRead': True,
+            'ExpressionAttributeNames': {'#status': 'status'},
+            'ExpressionAttributeValues': {':userId': user_id, ':available': 'available'}
+        }
+        
+        page_size = None
+        try:
+            if query_params.get('limit'):
+                page_size = max(1, min(int(query_params['limit']), MAX_LIST_PAGE_SIZE))
+                query_args['Limit'] = page_size
+            if query_params.get('nextToken'):
+                start_key = decode_cursor(query_params['nextToken'])
+                # Never let a cursor point into someone else's partition
+                if start_key.get('userId') != user_id:
+                    raise ValueError('cursor does not belong to this user')
+                query_args['ExclusiveStartKey'] = start_key
+        except Exception as e:
+            return create_response(400, {'error': 'Invalid limit or nextToken', 'details': str(e)})
+        
+        # The version is read before the files, so a concurrent write can
+        # only cost an extra 200, never a stale 304
+        listing_version = get_listing_version(user_id)
+        etag = make_etag(
+            'list', user_id, listing_version, query_params.get('limit'),
+            query_params.get('nextToken'), include_urls and url_window()
+        )
+        if is_not_modified(headers, etag):
+            return not_modified_response(etag)
+        etag_headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
         
-        # Add debug logging for environment variables
-        print(f"DynamoDB Table Name: {os.environ.get('FILES_TABLE_NAME')}")
+        # Keyed by version too, so writes made in other containers are seen right away
+        cache_key = (user_id, listing_version, query_params.get('limit'), query_params.get('nextToken'))
+        cached = get_cached_listing(cache_key)
+        if cached:
+            _listing_cache_stats['hits'] += 1
+            return create_response(200, with_download_urls(cached[0], include_urls), {**cached[1], **etag_headers})
+        _listing_cache_stats['misses'] += 1
         
-        # Add error handling for DynamoDB scan
         try:
-            response = table.scan(
-                FilterExpression='userId = :userId',
-                ExpressionAttributeValues={':userId': user_id}
-            )
-            print(f"DynamoDB response: {json.dumps(response, default=str)}")
-            
-            if 'Items' not in response:
-                print("No 'Items' key in DynamoDB response")
-                return create_response(200, [])
-                
             files = []
-            for item in response.get('Items', []):
-                try:
-                    file_data = {
-                        'fileId': str(item.get('fileId', '')),
-                        'fileName': str(item.get('fileName', 'Unknown')),
-                        'fileType': str(item.get('fileType', '')),
-                        'fileSize': int(item.get('fileSize', 0)) if item.get('fileSize') else 0,
-                        'uploadDate': str(item.get('uploadDate', '')),
-                        'fileKey': str(item.get('fileKey', ''))
-                    }
-                    # Ensure all values are JSON serializable
-                    files.append(file_data)
-                except Exception as e:
-                    print(f"Error processing file item: {str(e)}")
-                    continue
+            while True:
+                response = table.query(**query_args)
+                # Rows go out as DynamoDB returns them; dump_json turns the
+                # Decimal sizes into numbers. The status was only projected
+                # for the filter.
+                for item in response.get('Items', []):
+                    item.pop('status', None)
+                    files.append(item)
+                
+                last_key = response.get('LastEvaluatedKey')
+                if not last_key or page_size:
+                    break
+                query_args['ExclusiveStartKey'] = last_key
             
             print(f"Found {len(files)} files for user {user_id}")
-            print(f"Sample file data: {json.dumps(files[0] if files else {})}")
-            return create_response(200, files)
+            response_headers = {}
+            if page_size and last_key:
+                response_headers['X-Next-Token'] = encode_cursor(last_key)
+            
+            if LISTING_CACHE_TTL > 0:
+                cache_listing(cache_key, files, response_headers)
+            return create_response(200, with_download_urls(files, include_urls), {**response_headers, **etag_headers})
             
         except Exception as db_error:
             print(f"DynamoDB Error: {str(db_error)}")
@@ -415,12 +1024,20 @@ def get_file(file_id, headers):
         return create_response(401, {'error': 'Unauthorized'})
     
     try:
-        # Get file metadata
+        # Uploads and deletes bump the listing version, so it versions each
+        # file's metadata as well
+        etag = make_etag('file', user_id, file_id, get_listing_version(user_id), url_window())
+        if is_not_modified(headers, etag):
+            return not_modified_response(etag)
+        
+        # Get file metadata (strongly consistent, since the response is
+        # tagged with the version read above)
         response = table.get_item(
-            Key={'userId': user_id, 'fileId': file_id}
+            Key={'userId': user_id, 'fileId': file_id},
+            ConsistentRead=True
         )
         
-        if 'Item' not in response:
+        if 'Item' not in response or response['Item'].get('status', 'available') != 'available':
             return create_response(404, {'error': 'File not found'})
         
         item = response['Item']
@@ -432,7 +1049,7 @@ def get_file(file_id, headers):
                 'Bucket': os.environ.get('FILE_BUCKET_NAME', 'google-drive-clone-files'),
                 'Key': item['fileKey']
             },
-            ExpiresIn=3600  # 1 hour
+            ExpiresIn=DOWNLOAD_URL_EXPIRY
         )
         
         # Prepare response with only the necessary fields and ensure they're serializable
@@ -446,7 +1063,7 @@ def get_file(file_id, headers):
         }
         
         # Return file metadata with download URL
-        return create_response(200, file_data)
+        return create_response(200, file_data, {'ETag': etag, 'Cache-Control': 'private, no-cache'})
         
     except Exception as e:
         print(f"Get file error: {str(e)}")
@@ -459,9 +1076,11 @@ def delete_file(file_id, headers):
         return create_response(401, {'error': 'Unauthorized'})
     
     try:
-        # Get file metadata first
+        # Get file metadata first (strongly consistent: the usage update
+        # below depends on its status and size)
         response = table.get_item(
-            Key={'userId': user_id, 'fileId': file_id}
+            Key={'userId': user_id, 'fileId': file_id},
+            ConsistentRead=True
         )
         
         if 'Item' not in response:
@@ -475,10 +1094,24 @@ def delete_file(file_id, headers):
             Key=item['fileKey']
         )
         
-        # Delete from DynamoDB
-        table.delete_item(
-            Key={'userId': user_id, 'fileId': file_id}
-        )
+        # Delete from DynamoDB and take the file off the user's usage in one
+        # transaction (pending uploads were never counted)
+        actions = [{
+            'Delete': {
+                'TableName': table.name,
+                'Key': {'userId': user_id, 'fileId': file_id},
+                'ConditionExpression': 'attribute_exists(fileId)'
+            }
+        }]
+        if item.get('status') != 'pending':
+            actions.append(usage_update(user_id, -1, -int(item.get('fileSize', 0))))
+        try:
+            transact_write(actions)
+        except s3.exceptions.ClientError as e:
+            # Deleted by someone else in the meantime, and subtracted by them
+            if 'ConditionalCheckFailed' not in cancellation_codes(e):
+                raise
+        invalidate_listing_cache(user_id)
         
         return create_response(200, {'message': 'File deleted successfully'})
         
@@ -486,37 +1119,142 @@ def delete_file(file_id, headers):
         print(f"Delete file error: {str(e)}")
         return create_response(500, {'error': 'Failed to delete file'})
 
+MAX_BULK_DELETE_FILE_IDS = int(os.environ.get('MAX_BULK_DELETE_FILE_IDS', '5000'))
+
+def bulk_delete_files(request_body, headers):
+    """Delete many files: DeleteObjects in 1000-key batches, then the rows and their usage in transactions of 100."""
+    user_id = get_user_id_from_headers(headers)
+    if not user_id:
+        return create_response(401, {'error': 'Unauthorized'})
+
+    file_ids = request_body.get('fileIds')
+    if not isinstance(file_ids, list) or not file_ids:
+        return create_response(400, {'error': 'fileIds must be a non-empty list'})
+    if len(file_ids) > MAX_BULK_DELETE_FILE_IDS:
+        return create_response(400, {'error': f'At most {MAX_BULK_DELETE_FILE_IDS} fileIds per request'})
+    file_ids = list(dict.fromkeys(str(file_id) for file_id in file_ids))
+
+    try:
+        results = {file_id: 'not_found' for file_id in file_ids}
+        # Consistent, since the row deletes are conditional on the status read here
+        items = batch_get_files(user_id, file_ids, 'fileId, fileKey, fileSize, #status', consistent=True)
+        file_by_key = {item['fileKey']: item['fileId'] for item in items}
+        item_by_id = {item['fileId']: item for item in items}
+
+        # S3 accepts at most 1000 keys per DeleteObjects call; in quiet mode
+        # it only reports the keys it failed to delete
+        bucket = os.environ.get('FILE_BUCKET_NAME', 'google-drive-clone-files')
+        file_keys = list(file_by_key)
+        deleted_files = []
+        for start in range(0, len(file_keys), 1000):
+            batch = file_keys[start:start + 1000]
+            response = s3.delete_objects(
+                Bucket=bucket,
+                Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+            )
+            failed_keys = {error['Key'] for error in response.get('Errors', [])}
+            for key in batch:
+                if key in failed_keys:
+                    results[file_by_key[key]] = 'failed'
+                else:
+                    deleted_files.append(file_by_key[key])
+
+        # Only remove rows whose object is gone. Rows go 99 per transaction,
+        # with the usage update as the 100th action so the two always agree.
+        # Each Delete requires the status that was read, since that decides
+        # whether the row is subtracted (a presigned upload may complete
+        # in between).
+        def row_delete(file_id):
+            item = item_by_id[file_id]
+            delete = {
+                'TableName': table.name,
+                'Key': {'userId': user_id, 'fileId': file_id},
+                'ExpressionAttributeNames': {'#status': 'status'}
+            }
+            if 'status' in item:
+                delete['ConditionExpression'] = 'attribute_exists(fileId) AND #status = :status'
+                delete['ExpressionAttributeValues'] = {':status': item['status']}
+            else:
+                delete['ConditionExpression'] = 'attribute_exists(fileId) AND attribute_not_exists(#status)'
+            return {'Delete': delete}
+
+        def delete_rows(batch):
+            counted = [item_by_id[file_id] for file_id in batch if item_by_id[file_id].get('status') != 'pending']
+            actions = [row_delete(file_id) for file_id in batch]
+            if counted:
+                actions.append(usage_update(user_id, -len(counted), -sum(int(item.get('fileSize', 0)) for item in counted)))
+            transact_write(actions)
+
+        def delete_row(file_id):
+            """Delete one row, reading it again whenever it changed since it was read."""
+            for attempt in range(3):
+                try:
+                    delete_rows([file_id])
+                    return 'deleted'
+                except s3.exceptions.ClientError as e:
+                    if cancellation_codes(e)[:1] != ['ConditionalCheckFailed']:
+                        print(f"Failed to delete row {file_id}: {str(e)}")
+                        return 'failed'
+                item = table.get_item(Key={'userId': user_id, 'fileId': file_id}, ConsistentRead=True).get('Item')
+                if item is None:
+                    # Deleted by someone else, and subtracted by them
+                    return 'deleted'
+                item_by_id[file_id] = item
+            return 'failed'
+
+        for start in range(0, len(deleted_files), 99):
+            batch = deleted_files[start:start + 99]
+            try:
+                delete_rows(batch)
+                for file_id in batch:
+                    results[file_id] = 'deleted'
+                continue
+            except s3.exceptions.ClientError as e:
+                if e.response['Error']['Code'] != 'TransactionCanceledException':
+                    raise
+            # A row in the batch changed or was already gone; go one by one
+            for file_id in batch:
+                results[file_id] = delete_row(file_id)
+
+        if deleted_files:
+            invalidate_listing_cache(user_id)
+
+        statuses = list(results.values())
+        return create_response(200, {
+            'results': [{'fileId': file_id, 'status': results[file_id]} for file_id in file_ids],
+            'deleted': statuses.count('deleted'),
+            'notFound': statuses.count('not_found'),
+            'failed': statuses.count('failed')
+        })
+
+    except Exception as e:
+        print(f"Bulk delete error: {str(e)}")
+        return create_response(500, {'error': 'Failed to delete files'})
+
 def lambda_handler(event, context):
     """Main Lambda handler function."""
     try:
-        print("=== LAMBDA INVOCATION START ===")
-        print("Event keys:", json.dumps(list(event.keys()), default=str))
-        
         # Get HTTP method and route key
         http_method = event.get('requestContext', {}).get('http', {}).get('method', '')
         route_key = event.get('routeKey', '')
-        print(f"HTTP Method: {http_method}")
-        print(f"Route Key: {route_key}")
         
         # Get headers in lowercase for case-insensitive access
         headers = {k.lower(): v for k, v in event.get('headers', {}).items()}
-        print("Headers:", json.dumps(headers, default=str))
         
         # Handle request body
         body = event.get('body', '')
         is_base64_encoded = event.get('isBase64Encoded', False)
         content_type = headers.get('content-type', '').lower()
         
-        print(f"Content-Type: {content_type}")
-        print(f"isBase64Encoded: {is_base64_encoded}")
-        print(f"Body type: {type(body)}")
-        print(f"Body length: {len(body) if hasattr(body, '__len__') else 'N/A'}")
-        
         # For file uploads, we'll handle the raw body in the upload handler
         if 'multipart/form-data' in content_type:
-            print("Processing multipart/form-data request")
             # Pass the raw body and headers to handle_file_upload
             return handle_file_upload(event, headers)
+        
+        # Raw binary uploads (PUT /files/{name}) also skip body parsing
+        path = route_key.split(' ', 1)[1] if ' ' in route_key else route_key
+        if http_method == 'PUT' and path.startswith('/files/'):
+            return handle_raw_upload(event, headers)
             
         # For JSON requests, parse the body
         parsed_body = {}
@@ -536,36 +1274,39 @@ def lambda_handler(event, context):
                 print(f"Error parsing request body: {str(e)}")
                 return create_response(400, {'error': 'Invalid request body', 'details': str(e)})
         
-        print("Parsed body:", json.dumps(parsed_body, default=str))
-        
         # Extract the path from route key (e.g., 'GET /files' -> '/files')
         path = route_key.split(' ', 1)[1] if ' ' in route_key else route_key
-        print(f"Routing request: {http_method} {path}")
         
         # Handle OPTIONS requests first (CORS preflight)
         if http_method == 'OPTIONS':
-            print("Handling OPTIONS preflight request")
             return create_response(200, {})
         
         # Route the request based on HTTP method and path
         if http_method == 'POST' and path == '/auth':
-            print("Routing to auth handler")
             return handle_auth(parsed_body)
+        elif http_method == 'POST' and path == '/files/bulk-delete':
+            return bulk_delete_files(parsed_body, headers)
+        elif http_method == 'POST' and path == '/files/download-urls':
+            return compress_response(get_download_urls(parsed_body, headers), headers)
+        elif http_method == 'POST' and path == '/files/presigned-url':
+            return create_presigned_upload(parsed_body, headers)
+        elif http_method == 'POST' and path.startswith('/files/') and path.endswith('/complete'):
+            file_id = event.get('pathParameters', {}).get('fileId')
+            if file_id:
+                return complete_presigned_upload(file_id, headers)
         elif http_method == 'POST' and path == '/files':
-            print("Routing to file upload handler")
             # For file uploads, pass the entire event and headers
             return handle_file_upload(event, headers)
+        elif http_method == 'GET' and path == '/usage':
+            return get_storage_usage(headers)
         elif http_method == 'GET' and path == '/files':
-            print("Routing to list files handler")
-            return list_user_files(headers)
+            return compress_response(list_user_files(headers, event.get('queryStringParameters') or {}), headers)
         elif http_method == 'GET' and path.startswith('/files/'):
             file_id = event.get('pathParameters', {}).get('fileId')
-            print(f"Fetching file with ID: {file_id}")
             if file_id:
                 return get_file(file_id, headers)
         elif http_method == 'DELETE' and path.startswith('/files/'):
             file_id = event.get('pathParameters', {}).get('fileId')
-            print(f"Deleting file with ID: {file_id}")
             if file_id:
                 return delete_file(file_id, headers)
         
@@ -575,4 +1316,4 @@ def lambda_handler(event, context):
         
     except Exception as e:
         print(f"Error: {str(e)}")
-        return create_response(500, {'error': 'Internal Server Error', 'details': str(e)})
\ No newline at end of file
+        return create_response(500, {'error': 'Internal Server Error', 'details': str(e)})
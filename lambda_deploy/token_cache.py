@@ -0,0 +1,91 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Shared by the Flask API (backend/auth/token_cache.py) and the Lambda API
+# (lambda_deploy/token_cache.py). The two files are identical copies, since
+# Lambda packaging doesn't follow symlinks reliably; change them together.
+
+
+class TokenCache:
+    """Bounded LRU cache of verified Firebase ID tokens.
+
+    Entries are keyed by a SHA-256 hash of the raw token (we never keep the
+    token itself around) and expire at the token's own `exp` claim, so a cached
+    token is never accepted after Firebase would have rejected it.
+    """
+
+    def __init__(self, max_size=1024, max_ttl=3600):
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get(self, token):
+        """Return the decoded token if it is cached and not expired, else None"""
+        key = self._key(token)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, decoded_token = entry
+            if expires_at <= now:
+                # Token has expired since we cached it, drop it
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            # Mark as most recently used
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return decoded_token
+
+    def put(self, token, decoded_token):
+        """Cache a decoded token until its `exp` claim (capped at max_ttl)"""
+        now = time.time()
+        expires_at = now + self.max_ttl
+        if 'exp' in decoded_token:
+            expires_at = min(expires_at, float(decoded_token['exp']))
+
+        # Don't bother caching tokens that are already expired
+        if expires_at <= now:
+            return
+
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (expires_at, decoded_token)
+            self._entries.move_to_end(key)
+
+            # Evict least recently used entries once we are over the limit
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return hit/miss counters for monitoring"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxSize': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hitRatio': (self.hits / lookups) if lookups else 0.0
+            }